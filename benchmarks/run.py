@@ -0,0 +1,219 @@
+"""
+benchmarks the non-nlp stages against the datastores in .ennotator_data.
+
+nothing needs a spacy model (or the original texts). the datastores are
+copied to a temporary directory first, so the fixtures aren't touched.
+
+usage:
+    python benchmarks/run.py                    # compare against the baseline
+    python benchmarks/run.py --save-baseline    # record a new baseline
+    python benchmarks/run.py --texts DonQuixote --repeat 5
+
+exits with 1 if a stage got slower (or used more memory) than the baseline by
+more than the tolerance. the committed baseline (benchmarks/baseline.json) is
+re-recorded whenever a change is meant to move the numbers.
+
+the baseline's times are scaled by how long a fixed bit of python work takes
+now compared to when it was recorded (see `calibrate`), so a slower or busier
+machine isn't taken for a regression. that only goes so far: for a tight
+comparison, record a local baseline first (`--baseline PATH --save-baseline`)
+and compare against that.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from ennotator import entities
+from ennotator import network
+from ennotator import reader
+from ennotator import storage
+
+FIXTURES = os.path.join(REPO, '.ennotator_data')
+BASELINE = os.path.join(REPO, 'benchmarks', 'baseline.json')
+
+class Measurements():
+    """wall times and peak (python) memory of each stage. tracing memory
+    slows things down, so it's only done on the runs where `trace` is set and
+    those runs' times aren't used."""
+    def __init__(self):
+        self.seconds = {}
+        self.peak_bytes = {}
+        self.trace = False
+
+    @contextmanager
+    def measure(self, stage):
+        if self.trace:
+            tracemalloc.start()
+            yield
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.peak_bytes.setdefault(stage, []).append(peak)
+        else:
+            start = time.perf_counter()
+            yield
+            self.seconds.setdefault(stage, []).append(time.perf_counter() - start)
+
+def benchmark_text(text_name, measurements):
+    """runs each stage once on a fresh datastore"""
+    measure = measurements.measure
+    with measure('load_raw_matches'):
+        text_storage = storage.TextDatastore(text_name)
+        raw_matches = {name: text_storage.raw_matches[name] for name in text_storage.raw_matches}
+
+    entity_interface = entities.TextEntities(text_storage)
+    file_names = [
+        f for f in reader.TextReader.get_ordered_content_files(text_storage.metadata)
+        if f in raw_matches
+    ]
+
+    with measure('add_entity_keys_to_matches'):
+        section_matches = [
+            entity_interface.add_entity_keys_to_matches(raw_matches[f], section_name=f)
+            for f in file_names
+        ]
+
+    all_matches = [m for matches in raw_matches.values() for m in matches]
+    with measure('unlabeled_entities'):
+        entity_interface.unlabeled_entities(all_matches)
+
+    section_networks = [network.SectionNetwork(matches) for matches in section_matches]
+    with measure('make_edges'):
+        for section_network in section_networks:
+            section_network.make_edges(section_network.matches, [])
+
+    with measure('TextNetwork'):
+        network.TextNetwork(text_storage, file_names, entity_interface)
+
+def calibrate(repeat=5):
+    """the best time of a fixed bit of python work, to scale timings from
+    one machine (or moment) to another"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sorted(str(i * 7919 % 100003) for i in range(100000))
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+
+    return best
+
+def run(text_names, repeat=5):
+    """returns {text: {stage: {'seconds': best, 'peak_bytes': best}}}"""
+    summary = {}
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            for text_name in text_names:
+                measurements = Measurements()
+                for i in range(repeat + 1):
+                    measurements.trace = i == repeat
+
+                    # a fresh copy each time, so nothing is cached between runs
+                    shutil.rmtree('.ennotator_data', ignore_errors=True)
+                    shutil.copytree(FIXTURES, '.ennotator_data')
+                    benchmark_text(text_name, measurements)
+
+                summary[text_name] = {
+                    stage: {
+                        'seconds' : min(measurements.seconds[stage]),
+                        'peak_bytes' : min(measurements.peak_bytes[stage]),
+                    } for stage in measurements.seconds
+                }
+        finally:
+            os.chdir(cwd)
+
+    return summary
+
+def compare(summary, baseline, tolerance, calibration=None):
+    """prints each stage next to the baseline, whose times are scaled by
+    `calibration` against the baseline's. returns the regressions."""
+    scale = 1
+    if calibration and baseline.get('_calibration'):
+        # only ever loosened: a calibration that ran slow when the
+        # baseline was recorded mustn't make the stages look slower now
+        scale = max(1, calibration / baseline['_calibration'])
+        print("baseline times scaled by {:.2f} for this machine".format(scale))
+
+    regressions = []
+    row = "{:<16} {:<28} {:>10} {:>10} {:>8} {:>12} {:>12}"
+    print(row.format('text', 'stage', 'ms', 'base ms', 'change', 'peak KiB', 'base KiB'))
+
+    for text_name, stages in summary.items():
+        for stage, result in stages.items():
+            base = baseline.get(text_name, {}).get(stage)
+            if base:
+                base = dict(base, seconds=base['seconds'] * scale)
+
+            change = ''
+            if base:
+                ratio = result['seconds'] / base['seconds'] if base['seconds'] else 1
+                change = "{:+.0%}".format(ratio - 1)
+
+                # tiny stages are all noise, so they need to grow by a minimum
+                # amount too
+                if ratio > 1 + tolerance and result['seconds'] - base['seconds'] > .002:
+                    regressions.append((text_name, stage, 'time'))
+
+                extra_bytes = result['peak_bytes'] - base['peak_bytes']
+                if extra_bytes > tolerance * base['peak_bytes'] and extra_bytes > 64 * 1024:
+                    regressions.append((text_name, stage, 'memory'))
+
+            print(row.format(
+                text_name,
+                stage,
+                "{:.1f}".format(result['seconds'] * 1000),
+                "{:.1f}".format(base['seconds'] * 1000) if base else '-',
+                change,
+                result['peak_bytes'] // 1024,
+                base['peak_bytes'] // 1024 if base else '-',
+            ))
+
+    return regressions
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="benchmark the bundled datastores")
+    parser.add_argument('--texts', nargs='*', default=None, help="defaults to every bundled datastore")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=.25, help="allowed slowdown, as a fraction")
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args(args)
+
+    text_names = args.texts or sorted(os.listdir(FIXTURES))
+    calibration = calibrate()
+    summary = run(text_names, repeat=args.repeat)
+    calibration = min(calibration, calibrate())
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    regressions = compare(summary, baseline, args.tolerance, calibration)
+
+    if args.save_baseline:
+        baseline.update(summary)
+        baseline['_calibration'] = calibration
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+
+        print("saved baseline to {}".format(args.baseline))
+    elif regressions:
+        for text_name, stage, kind in regressions:
+            print("regression: {} {} ({})".format(text_name, stage, kind))
+
+        sys.exit(1)
+    elif not baseline:
+        print("no baseline to compare against (record one with --save-baseline)")
+
+if __name__ == '__main__':
+    main()
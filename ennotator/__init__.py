@@ -1,8 +1,17 @@
+from contextlib import nullcontext
+
+from . import budget as budget_
+from . import candidates
 from . import entities
 from . import interacter
 from . import matcher
+from . import matchstore
+from . import model
 from . import network
+from . import preview as preview_
+from . import profiling
 from . import reader
+from . import snapshots
 from . import storage
 
 # the default process of doing this is:
@@ -15,20 +24,123 @@ from . import storage
 #   - etc
 
 class Ennotator():
-    def __init__(self, text_name, path, datastore_path=None, reload_entities=False):
-        self.storage = storage.TextDatastore(text_name, datastore_path)
+    def __init__(self, text_name, path, datastore_path=None, reload_entities=False, profile=False, model_name=None, preview=False, memory_budget=None, keep_snapshots=20):
+        """
+        parameters:
+        - preview: if True (or the fraction of sections to start with), only
+          a sample of the sections is matched before `network` is made. the
+          rest are matched in the background (see `preview.Preview`);
+          `finish_preview` waits for them and remakes the network.
+        - model_name: the spacy pipeline to match the text with (eg,
+          'es_core_news_md' for a spanish edition). it's remembered by the
+          datastore, and changing it remakes the matches.
+        - profile: if True, times each stage and writes a report to the
+          datastore's `reports` directory. can also be a dict of options for
+          `profiling.Profiler.enable` (`cprofile`, `trace_memory`,
+          `track_rss`)
+        - memory_budget: bytes (or a string like '1.5GB') to keep the run
+          within (see `budget.MemoryBudget`). the text is matched and its
+          network is made a few sections at a time, and the peak resident
+          memory of each stage is reported, as if `profile` were
+          {'track_rss': True}. a datastore whose raw matches are still json
+          is converted to the binary format first. the budget's limits on
+          spacy pipelines only last while the text is loaded (not while a
+          preview goes on in the background).
+        - keep_snapshots: how many of the datastore's automatic snapshots
+          are kept (see `snapshots.Snapshots`). one is taken when the
+          datastore is opened, before anything in it is rewritten.
+        """
+        self.keep_snapshots = keep_snapshots
+
+        self.budget = None
+        models_within_budget = nullcontext()
+        if memory_budget:
+            self.budget = budget_.MemoryBudget(memory_budget)
+            models_within_budget = self.budget.applied_to_models(model.REGISTRY)
+
+            profile = dict(profile if isinstance(profile, dict) else {}, track_rss=True)
+
+        if profile:
+            profiling.PROFILER.enable(**(profile if isinstance(profile, dict) else {}))
+
+        # the profiler is disabled even if loading fails, so it doesn't keep
+        # timing (and tracing) whatever runs next
+        try:
+            with models_within_budget:
+                self.load(text_name, path, datastore_path, reload_entities, model_name, preview)
+        finally:
+            if profile:
+                profiling.PROFILER.disable()
+
+        if profile:
+            self.profile_report_path = profiling.PROFILER.write_report(self.storage)
+
+    def load(self, text_name, path, datastore_path, reload_entities, model_name, preview):
+        """opens the datastore, matches the text and makes its network"""
+        self.storage = storage.TextDatastore(
+            text_name,
+            datastore_path,
+            max_raw_match_sections=self.budget.max_raw_match_sections if self.budget else None,
+        )
+
+        # the annotations and the matches made for them, before journaled
+        # decisions are written out or anything is rematched
+        snapshots.Snapshots(self.storage, keep=self.keep_snapshots).checkpoint()
+
+        if self.budget:
+            self.budget.prepare_storage(self.storage)
+
+        if model_name and model_name != self.storage.model_name:
+            self.storage.set_model_name(model_name)
+
         self.entity_interface = entities.TextEntities(self.storage)
         self.reader = reader.TextReader(self.storage, path)
 
-        if self.entity_interface.matches_are_not_up_to_date:
-            entities_with_aliases = self.entity_interface.get_entities_with_aliases()
-            self.reader.load_matches(reload=True, entities_with_aliases=entities_with_aliases)
+        # only sections whose content changed get matched with spacy. if the
+        # entities changed, the others' entity and alias matches are remade
+        # without it.
+        match_kwargs = {
+            'reload' : reload_entities,
+            'rematch' : self.entity_interface.matches_are_not_up_to_date,
+        }
 
-        self.network = network.TextNetwork(
-            self.storage,
-            self.reader.ordered_content_files,
-            self.entity_interface,
-        )
+        network_kwargs = {}
+        if self.budget:
+            match_kwargs.update(self.budget.match_kwargs)
+            network_kwargs = self.budget.network_kwargs
+
+        self.preview = None
+        if preview:
+            self.preview = preview_.Preview(
+                self.storage,
+                self.reader,
+                self.entity_interface,
+                fraction=.2 if preview is True else preview,
+                network_kwargs=network_kwargs,
+                **match_kwargs
+            ).start()
+
+            self.network = self.preview.network
+        else:
+            with profiling.PROFILER.stage('ennotator.match'):
+                self.reader.load_matches(
+                    entities_with_aliases=self.entity_interface.get_entities_with_aliases(),
+                    **match_kwargs
+                )
+
+            with profiling.PROFILER.stage('ennotator.network'):
+                self.network = network.TextNetwork(
+                    self.storage,
+                    self.reader.ordered_content_files,
+                    self.entity_interface,
+                    **network_kwargs
+                )
+
+                # the layers are made (and spilled) now, so using the network
+                # afterwards only reads them back
+                if self.network.spill:
+                    for _ in self.network.iter_layers():
+                        pass
 
         self.interacter = {
             'files' : interacter.FileInteracter(
@@ -44,3 +156,11 @@ class Ennotator():
         }
 
         self.entity_interface.update_storage()
+
+    def finish_preview(self):
+        """waits for a preview's sections to be matched, and then uses the
+        whole text's network"""
+        if self.preview is not None:
+            self.preview.wait()
+            self.network = self.preview.network
+            self.preview = None
@@ -0,0 +1,152 @@
+"""
+attributes of entities (family, faction, gender, ...), stored in the
+datastore's `attributes` file, one per line:
+
+    "ENTITY_KEY","ATTRIBUTE","VALUE"
+
+an entity can have several values for an attribute (eg, two factions).
+
+for filtering networks, attributes are compiled into boolean masks over an
+integer index of entity keys (see `AttributeMasks`), so filtering a
+network's edges is a lookup into a mask rather than a pass over the
+attributes.
+"""
+import os
+from collections import defaultdict
+
+import numpy as np
+
+class Attribute():
+    def __init__(self, key, attribute, value):
+        self.key = key
+        self.attribute = attribute
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, Attribute) and (
+            (self.key, self.attribute, self.value) == (other.key, other.attribute, other.value)
+        )
+
+    def __hash__(self):
+        return hash((self.key, self.attribute, self.value))
+
+    def __repr__(self):
+        return "{key}: {attribute}={value}".format(key=self.key, attribute=self.attribute, value=self.value)
+
+    def get_storage_representation(self):
+        """represented as: "ENTITY_KEY","ATTRIBUTE","VALUE" """
+        return '"{key}","{attribute}","{value}"'.format(
+            key=self.key,
+            attribute=self.attribute,
+            value=self.value,
+        )
+
+    @classmethod
+    def load_from_storage(cls, line):
+        parts = [part.strip('"') for part in line.split('","')]
+        if len(parts) != 3:
+            return None
+
+        return cls(*parts)
+
+class AttributeStore():
+    """the attributes of a text's entities"""
+    def __init__(self, storage):
+        self.storage = storage
+        self.attributes = self.load_attributes()
+
+    def load_attributes(self):
+        attributes = [Attribute.load_from_storage(l.strip()) for l in self.storage.read_lines('attributes') if l.strip()]
+
+        return [a for a in attributes if a is not None]
+
+    def add(self, key, attribute, value):
+        attribute = Attribute(key, attribute, value)
+        if attribute in self.attributes:
+            return
+
+        self.attributes.append(attribute)
+
+    def remove(self, key, attribute, value=None):
+        """removes an entity's attribute (just one value of it, if `value` is
+        given)"""
+        removed = [
+            a for a in self.attributes
+            if a.key == key and a.attribute == attribute and value in (None, a.value)
+        ]
+
+        for a in removed:
+            self.attributes.remove(a)
+
+    def get(self, key, attribute):
+        """the values an entity has for an attribute"""
+        return [a.value for a in self.attributes if a.key == key and a.attribute == attribute]
+
+    def get_entity_attributes(self, key):
+        """attribute -> values for an entity"""
+        entity_attributes = defaultdict(list)
+        for a in self.attributes:
+            if a.key == key:
+                entity_attributes[a.attribute].append(a.value)
+
+        return dict(entity_attributes)
+
+    @property
+    def attributes_file_contents(self):
+        return os.linesep.join(sorted(a.get_storage_representation() for a in self.attributes))
+
+    def update_storage(self):
+        self.storage.save_file_content('attributes', self.attributes_file_contents)
+
+    def compile(self, keys):
+        return AttributeMasks(self.attributes, keys)
+
+class AttributeMasks():
+    """boolean masks over an integer index of entity keys: for each attribute,
+    a (values x keys) matrix of which keys have which values"""
+    def __init__(self, attributes, keys):
+        self.keys = list(keys)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+
+        values = defaultdict(set)
+        for a in attributes:
+            values[a.attribute].add(a.value)
+
+        # attribute -> sorted values
+        self.values = {attribute: sorted(v) for attribute, v in values.items()}
+
+        self.masks = {
+            attribute: np.zeros((len(v), len(self.keys)), dtype=bool)
+            for attribute, v in self.values.items()
+        }
+
+        for a in attributes:
+            if a.key in self.index:
+                row = self.values[a.attribute].index(a.value)
+                self.masks[a.attribute][row, self.index[a.key]] = True
+
+    def get_value_mask(self, attribute, values):
+        """keys with any of `values` for `attribute`. unknown attributes and
+        values match nothing."""
+        if isinstance(values, str):
+            values = [values]
+
+        mask = np.zeros(len(self.keys), dtype=bool)
+        for value in values:
+            if value in self.values.get(attribute, []):
+                mask |= self.masks[attribute][self.values[attribute].index(value)]
+
+        return mask
+
+    def get_mask(self, filters):
+        """keys that pass every filter. `filters` is attribute -> value (or a
+        list of values, any of which will do)"""
+        mask = np.ones(len(self.keys), dtype=bool)
+        for attribute, values in filters.items():
+            mask &= self.get_value_mask(attribute, values)
+
+        return mask
+
+    def get_indexes(self, keys):
+        """the index of each key (-1 if it isn't indexed)"""
+        return np.array([self.index.get(key, -1) for key in keys], dtype=np.int64)
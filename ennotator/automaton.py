@@ -0,0 +1,122 @@
+"""
+finds entity and alias strings in a section's text without spacy.
+
+every string is compiled into one aho-corasick automaton, so a section is
+scanned once however many strings there are. like the token patterns
+`matcher.EntityMatchObject` makes:
+- a string's words can be separated by any whitespace in the text
+- matches have to start and end at word boundaries ("Sancho" is found in
+  "Sancho's", but not in "Sanchos")
+- matching is case sensitive
+
+matches are returned with character offsets.
+"""
+from collections import deque
+
+from . matcher import Match
+
+class AliasAutomaton():
+    def __init__(self, entities_with_aliases={}):
+        # a trie of (whitespace normalized) strings. each state has its
+        # transitions, the state to fall back to, and the (length, key)s of
+        # the strings that end there
+        self.transitions = [{}]
+        self.fallbacks = [0]
+        self.outputs = [[]]
+
+        for key, strings in entities_with_aliases.items():
+            for string in strings:
+                self.add(string, key)
+
+        self.compile()
+
+    def add(self, string, key):
+        string = " ".join(string.split())
+        if not string:
+            return
+
+        state = 0
+        for character in string:
+            next_state = self.transitions[state].get(character)
+            if next_state is None:
+                next_state = len(self.transitions)
+                self.transitions.append({})
+                self.fallbacks.append(0)
+                self.outputs.append([])
+                self.transitions[state][character] = next_state
+
+            state = next_state
+
+        if (len(string), key) not in self.outputs[state]:
+            self.outputs[state].append((len(string), key))
+
+    def compile(self):
+        """sets each state's fallback (the longest proper suffix of its string
+        that's also in the trie), breadth first"""
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, next_state in self.transitions[state].items():
+                queue.append(next_state)
+
+                fallback = self.fallbacks[state]
+                while fallback and character not in self.transitions[fallback]:
+                    fallback = self.fallbacks[fallback]
+
+                fallback = self.transitions[fallback].get(character, 0)
+                self.fallbacks[next_state] = fallback if fallback != next_state else 0
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fallbacks[next_state]]
+
+    def find(self, text):
+        """yields (start, end, key) for every occurrence of every string, in
+        order of their end"""
+        transitions = self.transitions
+        fallbacks = self.fallbacks
+        outputs = self.outputs
+
+        # the text is scanned with runs of whitespace as a single space;
+        # `positions` maps each scanned character back to the text
+        positions = []
+        state = 0
+        previous_space = False
+        for index, character in enumerate(text):
+            if character.isspace():
+                if previous_space:
+                    continue
+
+                character = ' '
+                previous_space = True
+            else:
+                previous_space = False
+
+            positions.append(index)
+
+            while state and character not in transitions[state]:
+                state = fallbacks[state]
+
+            state = transitions[state].get(character, 0)
+
+            for length, key in outputs[state]:
+                start = positions[len(positions) - length]
+                end = index + 1
+                if is_boundary(text, start, end):
+                    yield start, end, key
+
+    def get_matches(self, text):
+        """`Match`es for every occurrence, sorted by start"""
+        matches = [
+            Match(start=start, end=end, text=text[start:end], key=key)
+            for start, end, key in self.find(text)
+        ]
+
+        return sorted(matches, key=lambda m: (m.start, m.end))
+
+def is_boundary(text, start, end):
+    """whether text[start:end] doesn't start or end partway through a word"""
+    if start > 0 and text[start - 1].isalnum() and text[start].isalnum():
+        return False
+
+    if end < len(text) and text[end].isalnum() and text[end - 1].isalnum():
+        return False
+
+    return True
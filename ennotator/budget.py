@@ -0,0 +1,127 @@
+"""
+settings that keep a run within a memory budget, for large texts on shared
+machines:
+
+    text = Ennotator('DonQuixote', path, memory_budget='1.5GB')
+
+with a budget:
+- sections are matched in small batches with little read-ahead, so only a
+  few sections' texts (and spacy docs) are in memory at once. a doc is let
+  go of as soon as its matches are taken from it.
+- only so many sections' raw matches are held in memory; the rest are read
+  from the datastore when they're used (see `matchstore.LazyRawMatches`).
+  that needs the binary raw match format, since a json file can only be
+  read whole, so a datastore still in json is converted first.
+- the network isn't built up front. its layers are made one at a time,
+  without copying their matches, and spilled to the datastore (see
+  `network.TextNetwork`)
+- only one spacy pipeline is kept while the run is going, so one that's in
+  use is let go of before another is loaded (see `model.ModelRegistry`)
+- the peak resident memory of each stage is reported (see
+  `profiling.Profiler`)
+
+the budget is split up with rough estimates of what each thing takes, so
+it's an envelope to aim for rather than a hard limit. the pipeline has to
+fit in it, so a budget under `MODEL_BYTES` leaves nothing for the rest: it
+gets the smallest settings, and will still be exceeded.
+"""
+import re
+from contextlib import contextmanager
+
+# roughly what's taken up before any section is read: the interpreter and a
+# medium spacy pipeline
+MODEL_BYTES = 600 * 2**20
+
+# roughly what a section being matched takes up (its text and doc)
+SECTION_BYTES = 16 * 2**20
+
+# roughly what a section's raw matches take up once they're loaded
+RAW_MATCH_SECTION_BYTES = 2**20
+
+UNITS = {
+    '': 1, 'B': 1,
+    'K': 2**10, 'KB': 2**10,
+    'M': 2**20, 'MB': 2**20,
+    'G': 2**30, 'GB': 2**30,
+}
+
+def parse_bytes(size):
+    """a number of bytes, or a string like '512MB', '512M' or '1.5GB'"""
+    if not isinstance(size, str):
+        return int(size)
+
+    match = re.fullmatch(r'\s*(\d+(?:\.\d*)?|\.\d+)\s*([KMG]?B?)\s*', size.upper())
+    if match is None:
+        raise ValueError("can't read '{}' as a size (eg, '512MB', '1.5GB')".format(size))
+
+    number, unit = match.groups()
+    return int(float(number) * UNITS[unit])
+
+class MemoryBudget():
+    def __init__(self, max_bytes):
+        """
+        parameters:
+        - max_bytes: the budget, in bytes or as a string like '1.5GB'
+        """
+        self.max_bytes = parse_bytes(max_bytes)
+
+        # what's left once the pipeline is loaded. half of it is for the
+        # sections being matched, and a quarter for loaded raw matches.
+        self.spare_bytes = max(self.max_bytes - MODEL_BYTES, 0)
+
+    def __repr__(self):
+        return "MemoryBudget({})".format(self.max_bytes)
+
+    @property
+    def sections_in_flight(self):
+        """how many sections can be being read or parsed at once"""
+        return min(max(self.spare_bytes // 2 // SECTION_BYTES, 2), 24)
+
+    @property
+    def match_kwargs(self):
+        """`TextReader.load_matches` parameters (see `pipeline.MatchPipeline`)"""
+        batch_size = min(max(self.sections_in_flight // 3, 1), 8)
+        queue_size = self.sections_in_flight - batch_size
+
+        return {
+            'readers' : 1 if queue_size < 4 else 2,
+            'batch_size' : batch_size,
+            'queue_size' : queue_size,
+        }
+
+    @property
+    def max_raw_match_sections(self):
+        """how many sections' raw matches can be held in memory at once"""
+        return min(max(self.spare_bytes // 4 // RAW_MATCH_SECTION_BYTES, 8), 512)
+
+    @property
+    def network_kwargs(self):
+        """`network.TextNetwork` parameters"""
+        return {
+            'build' : False,
+            'keep_matches' : False,
+            'spill' : True,
+        }
+
+    @contextmanager
+    def applied_to_models(self, registry):
+        """has a `model.ModelRegistry` keep only one pipeline until the
+        context exits, so loading another lets go of the first before it's
+        loaded. the registry's limit is put back afterwards, since it's shared
+        by everything in the process."""
+        previous = registry.max_models
+        registry.max_models = 1
+
+        try:
+            yield registry
+        finally:
+            registry.max_models = previous
+
+    def prepare_storage(self, storage):
+        """converts a datastore's raw matches to the binary format, which can
+        be read a section at a time. json raw matches are read whole, so they
+        can't be kept within the budget."""
+        format, compression = storage.raw_matches_format
+        if format != 'binary':
+            print("converting the raw matches of '{}' to the binary format, to read them a section at a time".format(storage.text_name))
+            storage.convert_raw_matches('binary', compression)
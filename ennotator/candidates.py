@@ -0,0 +1,177 @@
+"""
+ranks unlabeled strings so that labeling covers the most mentions quickly.
+
+- strings are counted by how many mentions they have
+- strings that are contained (token-wise) in a longer string are grouped with
+  it, so `Adam` is grouped with `Adam Smith`
+- groups are served by their total number of mentions, and within a group the
+  longest string comes first
+"""
+from collections import Counter, defaultdict
+
+class CandidateIndex():
+    """an index of unlabeled strings.
+
+    strings are indexed by their (lowercased) tokens, so the longer strings
+    that contain a string can be found by intersecting a few small sets.
+    everything is updated incrementally as strings are added and removed.
+    """
+    def __init__(self, strings=()):
+        self.counts = Counter()
+        self.token_index = defaultdict(set)
+        self.parents = {}
+        self.children = defaultdict(set)
+        self._current_group = []
+
+        for string in strings:
+            self.add(string)
+
+    @classmethod
+    def from_matches(cls, matches, labeled=()):
+        """builds the index in one pass over the matches, leaving out strings
+        which are already labeled"""
+        labeled = set(labeled)
+        counts = Counter(m.clean_text for m in matches)
+
+        index = cls()
+        for string, count in counts.items():
+            if string and string not in labeled:
+                index.add(string, count)
+
+        return index
+
+    @staticmethod
+    def get_tokens(string):
+        return tuple(string.lower().split())
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, string):
+        return string in self.counts
+
+    @property
+    def total_mentions(self):
+        return sum(self.counts.values())
+
+    def contains(self, container, string):
+        """true if the tokens of `string` are a contiguous run of the tokens of
+        `container`"""
+        container_tokens = self.get_tokens(container)
+        tokens = self.get_tokens(string)
+
+        for i in range(len(container_tokens) - len(tokens) + 1):
+            if container_tokens[i:i + len(tokens)] == tokens:
+                return True
+
+        return False
+
+    def containers(self, string):
+        """strings in the index which contain `string` (and are longer)"""
+        tokens = self.get_tokens(string)
+        if not tokens:
+            return set()
+
+        token_sets = sorted([self.token_index[t] for t in set(tokens)], key=len)
+        candidates = set.intersection(*token_sets)
+
+        return {
+            c for c in candidates
+            if len(self.get_tokens(c)) > len(tokens) and self.contains(c, string)
+        }
+
+    def contained(self, string):
+        """strings in the index which `string` contains (and are shorter)"""
+        tokens = self.get_tokens(string)
+
+        contained = set()
+        for candidate in set.union(set(), *[self.token_index[t] for t in set(tokens)]):
+            if len(self.get_tokens(candidate)) < len(tokens) and self.contains(string, candidate):
+                contained.add(candidate)
+
+        return contained
+
+    def update_parent(self, string):
+        """a string's parent is the most mentioned string that contains it"""
+        old_parent = self.parents.pop(string, None)
+        if old_parent is not None:
+            self.children[old_parent].discard(string)
+
+        containers = self.containers(string)
+        if containers:
+            parent = max(containers, key=lambda c: (self.counts[c], len(c), c))
+            self.parents[string] = parent
+            self.children[parent].add(string)
+
+    def add(self, string, count=1):
+        is_new = string not in self.counts
+        self.counts[string] += count
+
+        if not is_new:
+            return
+
+        for token in self.get_tokens(string):
+            self.token_index[token].add(string)
+
+        self.update_parent(string)
+
+        # we might be a better parent for the strings we contain
+        for contained in self.contained(string):
+            self.update_parent(contained)
+
+    def remove(self, string):
+        """removes a string (eg, because it was labeled)"""
+        if string not in self.counts:
+            return
+
+        del self.counts[string]
+
+        for token in self.get_tokens(string):
+            self.token_index[token].discard(string)
+            if not self.token_index[token]:
+                del self.token_index[token]
+
+        parent = self.parents.pop(string, None)
+        if parent is not None:
+            self.children[parent].discard(string)
+
+        for child in self.children.pop(string, set()):
+            del self.parents[child]
+            self.update_parent(child)
+
+        if string in self._current_group:
+            self._current_group.remove(string)
+
+    def get_root(self, string):
+        while string in self.parents:
+            string = self.parents[string]
+
+        return string
+
+    def groups(self):
+        """groups of strings, from most to least mentioned. each group is
+        ordered longest first."""
+        groups = defaultdict(list)
+        for string in self.counts:
+            groups[self.get_root(string)].append(string)
+
+        groups = [
+            sorted(group, key=lambda s: (-len(self.get_tokens(s)), -self.counts[s], s))
+            for group in groups.values()
+        ]
+
+        return sorted(groups, key=lambda g: (-sum(self.counts[s] for s in g), g[0]))
+
+    def next_candidate(self):
+        """the string to label next. finishes the current group before moving
+        on to the next most mentioned one. None if there's nothing left."""
+        self._current_group = [s for s in self._current_group if s in self.counts]
+
+        if not self._current_group:
+            groups = self.groups()
+            if not groups:
+                return None
+
+            self._current_group = groups[0]
+
+        return self._current_group[0]
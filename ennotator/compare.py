@@ -0,0 +1,214 @@
+"""
+compares the networks of several texts (editions, translations, ...).
+
+each text's network is summarized once (its nodes, its whole-text edges and
+its entities' aliases) and the summary is cached in its datastore by the
+network's `cache_key`. the key is made from the datastore's metadata and
+annotations alone, so comparing texts again doesn't open their matches.
+
+entities are aligned across texts by key, or through an alias map of
+strings (keys or aliases) to shared names:
+
+    comparison = Comparison(['DonQuixote', 'DonQuijote'], alias_map={
+        'Don Quijote' : 'DonQuixote',
+        'Sancho' : 'SanchoPanza',
+    })
+
+    comparison.edge_jaccard('DonQuixote', 'DonQuijote')
+    comparison.degree_correlation('DonQuixote', 'DonQuijote')
+"""
+from itertools import combinations
+
+import numpy as np
+
+from . import entities
+from . import network
+from . import reader
+from . import storage
+from . metrics import MetricsCache
+
+def summarize(text_storage, entity_interface, weighting='count', use_cache=True):
+    """the nodes, whole-text edges and aliases of a text's network"""
+    ordered_content_files = reader.TextReader.get_ordered_content_files(text_storage.metadata)
+
+    # an unbuilt network's key only needs the metadata and annotations. the
+    # sections without matches are in it too; their match hashes are None.
+    cache = MetricsCache(text_storage, 'network_summaries')
+    cache_key = network.TextNetwork(
+        text_storage,
+        ordered_content_files,
+        entity_interface,
+        build=False,
+        weighting=weighting,
+    ).cache_key
+
+    if use_cache:
+        summary = cache.get(cache_key)
+        if summary is not None:
+            return summary
+
+    text_network = network.TextNetwork(
+        text_storage,
+        [f for f in ordered_content_files if f in text_storage.raw_matches],
+        entity_interface,
+        build=False,
+        weighting=weighting,
+    )
+
+    nodes, edges = set(), []
+    for _, section_network in text_network.iter_layers():
+        if text_network.accumulative:
+            nodes, edges = section_network.nodes, section_network.edges
+        else:
+            nodes |= section_network.nodes
+            edges += section_network.edges
+
+    aliases = {}
+    for alias in entity_interface.aliases:
+        if alias.entity:
+            aliases.setdefault(alias.entity.key, []).append(alias.string)
+
+    summary = {
+        'text_name' : text_storage.text_name,
+        'nodes' : sorted(nodes),
+        'edges' : edges,
+        'aliases' : aliases,
+    }
+
+    cache.set(cache_key, summary)
+    return summary
+
+class Comparison():
+    def __init__(self, text_names, datastore_path='.ennotator_data', alias_map=None, weighting='count', use_cache=True):
+        """
+        parameters:
+        - alias_map: string -> shared name. a text's entity is aligned to the
+          shared name of its key or, failing that, of one of its aliases.
+          entities that aren't in the map are aligned by key.
+        - weighting: the edge weighting to compare (see `network.WEIGHTINGS`)
+        """
+        self.alias_map = alias_map or {}
+        self.summaries = {}
+        for text_name in text_names:
+            text_storage = storage.TextDatastore(text_name, datastore_path)
+            entity_interface = entities.TextEntities(text_storage)
+            self.summaries[text_name] = summarize(text_storage, entity_interface, weighting, use_cache)
+
+        self._edge_arrays = {}
+        self.node_index = {}
+        for text_name in text_names:
+            for node in self.get_alignment(text_name).values():
+                self.node_index.setdefault(node, len(self.node_index))
+
+    @property
+    def text_names(self):
+        return list(self.summaries)
+
+    def get_alignment(self, text_name):
+        """the text's node -> its shared name"""
+        summary = self.summaries[text_name]
+
+        alignment = {}
+        for node in summary['nodes']:
+            alignment[node] = self.alias_map.get(node)
+
+            for alias in summary['aliases'].get(node, []):
+                if alignment[node] is None:
+                    alignment[node] = self.alias_map.get(alias)
+
+            if alignment[node] is None:
+                alignment[node] = node
+
+        return alignment
+
+    def get_edge_arrays(self, text_name):
+        """the text's aligned edges as (sorted, unique) pair codes and their
+        weights. a pair of nodes (i, j), i < j, in the shared index is coded
+        as i * n + j. edges between nodes aligned to the same name are
+        dropped, and edges aligned to the same pair are summed."""
+        if text_name not in self._edge_arrays:
+            alignment = self.get_alignment(text_name)
+            edges = self.summaries[text_name]['edges']
+            n = len(self.node_index)
+
+            ones = np.array([self.node_index[alignment[one]] for one, _, _ in edges], dtype=np.int64)
+            twos = np.array([self.node_index[alignment[two]] for _, two, _ in edges], dtype=np.int64)
+            weights = np.array([weight for _, _, weight in edges], dtype=np.float64)
+
+            keep = ones != twos
+            ones, twos, weights = ones[keep], twos[keep], weights[keep]
+
+            codes = np.minimum(ones, twos) * n + np.maximum(ones, twos)
+            codes, inverse = np.unique(codes, return_inverse=True)
+            self._edge_arrays[text_name] = (codes, np.bincount(inverse, weights=weights, minlength=len(codes)))
+
+        return self._edge_arrays[text_name]
+
+    def edge_jaccard(self, one, two, weighted=False):
+        """how much the texts' edge sets overlap: shared edges / all edges. if
+        `weighted`, it's the sum of the smaller weight of each edge over the
+        sum of the larger."""
+        one_codes, one_weights = self.get_edge_arrays(one)
+        two_codes, two_weights = self.get_edge_arrays(two)
+
+        if not weighted:
+            union = len(np.union1d(one_codes, two_codes))
+            return len(np.intersect1d(one_codes, two_codes, assume_unique=True)) / union if union else 0.0
+
+        codes = np.union1d(one_codes, two_codes)
+        one_aligned = self.align_weights(codes, one_codes, one_weights)
+        two_aligned = self.align_weights(codes, two_codes, two_weights)
+
+        total = np.maximum(one_aligned, two_aligned).sum()
+        return float(np.minimum(one_aligned, two_aligned).sum() / total) if total else 0.0
+
+    @staticmethod
+    def align_weights(codes, text_codes, text_weights):
+        """the text's weights for each of `codes` (0 where it has no edge)"""
+        weights = np.zeros(len(codes))
+        weights[np.searchsorted(codes, text_codes)] = text_weights
+        return weights
+
+    def get_degrees(self, text_name, weighted=False):
+        """the (weighted) degree of every node in the shared index"""
+        codes, weights = self.get_edge_arrays(text_name)
+        n = len(self.node_index)
+        ones, twos = codes // n, codes % n
+
+        if not weighted:
+            weights = np.ones(len(codes))
+
+        return np.bincount(ones, weights=weights, minlength=n) + np.bincount(twos, weights=weights, minlength=n)
+
+    def get_shared_nodes(self, one, two):
+        """a mask of the shared index's nodes that both texts have"""
+        mask = np.zeros((2, len(self.node_index)), dtype=bool)
+        for row, text_name in enumerate((one, two)):
+            mask[row, [self.node_index[node] for node in self.get_alignment(text_name).values()]] = True
+
+        return mask[0] & mask[1]
+
+    def degree_correlation(self, one, two, weighted=False):
+        """the pearson correlation of the degrees of the nodes both texts
+        have. None if it can't be told (fewer than two shared nodes, or no
+        variation)."""
+        shared = self.get_shared_nodes(one, two)
+        one_degrees = self.get_degrees(one, weighted)[shared]
+        two_degrees = self.get_degrees(two, weighted)[shared]
+
+        if len(one_degrees) < 2 or not one_degrees.std() or not two_degrees.std():
+            return None
+
+        return float(np.corrcoef(one_degrees, two_degrees)[0, 1])
+
+    def compare(self, weighted=False):
+        """each pair of texts' edge jaccard, degree correlation and number of
+        shared nodes"""
+        return [
+            {
+                'texts' : [one, two],
+                'shared_nodes' : int(self.get_shared_nodes(one, two).sum()),
+                'edge_jaccard' : self.edge_jaccard(one, two, weighted),
+                'degree_correlation' : self.degree_correlation(one, two, weighted),
+            } for one, two in combinations(self.text_names, 2)
+        ]
@@ -6,35 +6,50 @@ holds methods for entities
     - or all files
 """
 import os
+import bisect
 import hashlib
+import heapq
+import json
 from collections import defaultdict
 
+from . import candidates
+from . profiling import PROFILER
+
 class TextEntities():
-    """centralized place for handling of entities, aliases, blacklist, etcetera."""
+    """centralized place for handling of entities, aliases, blacklist, etcetera.
+
+    if the datastore is read-only, a labeling session's journal is applied in
+    memory but never written or removed (see `replay_journal`)."""
     def __init__(self, storage):
         self.storage = storage
         self.blacklist = self.load_blacklist()
         self.entities = self.load_entities()
         self.aliases = self.load_aliases(self.entities)
 
+        self._resolver = None
+        self._journal_file = None
+        self._replaying = False
+        self.replay_journal()
+
     def load_blacklist(self):
         """loads the blacklist"""
-        with open(self.storage.get_loc('blacklist'), 'r') as f:
-            blacklist = [l.strip() for l in f.readlines()]
+        blacklist = [l.strip() for l in self.storage.read_lines('blacklist')]
 
         return blacklist
 
     def load_entities(self):
         """loads the aliases"""
-        with open(self.storage.get_loc('entities'), 'r') as f:
-            entities = [Entity.load_from_storage(l.strip()) for l in f.readlines()]
+        entities = [Entity.load_from_storage(l.strip()) for l in self.storage.read_lines('entities')]
 
         return entities
 
     def load_aliases(self, entities):
         """loads the aliases"""
-        with open(self.storage.get_loc('aliases'), 'r') as f:
-            aliases = [Alias.load_from_storage(l.strip(), entities) for l in f.readlines()]
+        entities_by_key = {}
+        for entity in entities:
+            entities_by_key.setdefault(entity.key, entity)
+
+        aliases = [Alias.load_from_storage(l.strip(), entities_by_key) for l in self.storage.read_lines('aliases')]
 
         return aliases
 
@@ -58,24 +73,133 @@ class TextEntities():
 
         return None
 
+    # decisions are made under the datastore's lock, since the entities can
+    # be read from another thread (eg, a preview's matching)
+
+    def add_to_blacklist(self, string):
+        with self.storage.lock():
+            self.blacklist.append(string)
+            self._resolver = None
+            self.journal({'decision' : 'not_entity', 'string' : string})
+
+    def add_entity(self, key, scope=None):
+        entity = Entity(key=key, scope=scope)
+        with self.storage.lock():
+            self.entities.append(entity)
+            self.journal({
+                'decision' : 'new_entity',
+                'key' : key,
+                'scope' : scope.get_storage_representation() if scope else None,
+            })
+            self._resolver = None
+
+        return entity
+
+    def add_alias(self, string, entity, scope=None):
+        alias = Alias(string=string, entity=entity, scope=scope)
+        with self.storage.lock():
+            self.aliases.append(alias)
+            self.journal({
+                'decision' : 'alias',
+                'string' : string,
+                'key' : entity.key,
+                'scope' : scope.get_storage_representation() if scope else None,
+            })
+            self._resolver = None
+
+        return alias
+
+    @property
+    def journal_path(self):
+        return self.storage.get_loc('journal')
+
+    def journal(self, decision):
+        """appends a labeling decision to the journal. this is much cheaper
+        than rewriting the annotation files, and survives a crash; the journal
+        is folded into the annotation files by `update_storage`."""
+        # decisions being replayed are already in the journal
+        if self._replaying:
+            return
+
+        self.storage.check_writable()
+        if self._journal_file is None:
+            self._journal_file = open(self.journal_path, 'a')
+
+        self._journal_file.write(json.dumps(decision) + '\n')
+        self._journal_file.flush()
+        os.fsync(self._journal_file.fileno())
+
+    def close_journal(self):
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+
+    def replay_journal(self):
+        """applies decisions journaled (but not written to the annotation
+        files) by an earlier session, then writes them. read-only datastores
+        only apply them."""
+        if not os.path.isfile(self.journal_path):
+            return
+
+        with open(self.journal_path, 'r') as f:
+            lines = f.readlines()
+
+        self._replaying = True
+        try:
+            self.apply_decisions(lines)
+        finally:
+            self._replaying = False
+
+        if not self.storage.read_only:
+            self.update_storage()
+
+    def apply_decisions(self, lines):
+        """applies journaled decisions which haven't been already"""
+        alias_lines = {a.get_storage_representation() for a in self.aliases}
+        for line in lines:
+            try:
+                decision = json.loads(line)
+            except ValueError:
+                # a decision that was being written when we crashed
+                continue
+
+            if decision['decision'] == 'not_entity':
+                if decision['string'] not in self.blacklist:
+                    self.add_to_blacklist(decision['string'])
+            elif decision['decision'] == 'new_entity':
+                if not self.find_entity_with_key(self.entities, decision['key']):
+                    self.add_entity(decision['key'], scope=Scope.load_from_storage(decision.get('scope')))
+            elif decision['decision'] == 'alias':
+                entity = self.find_entity_with_key(self.entities, decision['key'])
+                scope = Scope.load_from_storage(decision.get('scope'))
+                alias = Alias(string=decision['string'], entity=entity, scope=scope)
+                if entity and alias.get_storage_representation() not in alias_lines:
+                    self.add_alias(decision['string'], entity, scope=scope)
+                    alias_lines.add(alias.get_storage_representation())
+
     def update_storage(self):
-        """updates the state of the storage"""
-        blacklist_content = self.blacklist_file_contents
-        with open(self.storage.get_loc('blacklist'), 'w') as f:
-            f.write(blacklist_content)
+        """updates the state of the storage, and empties the journal"""
+        with PROFILER.stage('entities.update_storage'), self.storage.lock():
+            blacklist_content = self.blacklist_file_contents
+            entities_content = self.entities_file_contents
+            aliases_content = self.aliases_file_contents
+
+            new_hashes = {
+                'blacklist_hash' : self.get_content_hash(blacklist_content),
+                'entities_hash' : self.get_content_hash(entities_content),
+                'aliases_hash' : self.get_content_hash(aliases_content),
+            }
 
-        entities_content = self.entities_file_contents
-        with open(self.storage.get_loc('entities'), 'w') as f:
-            f.write(entities_content)
+            self.storage.save_file_content('blacklist', blacklist_content)
+            self.storage.save_file_content('entities', entities_content)
+            self.storage.save_file_content('aliases', aliases_content)
 
-        aliases_content = self.aliases_file_contents
-        with open(self.storage.get_loc('aliases'), 'w') as f:
-            f.write(aliases_content)
+            self.storage.metadata.update(new_hashes)
+            self.storage.save_metadata()
 
-        self.storage.metadata['blacklist_hash'] = self.get_content_hash(blacklist_content)
-        self.storage.metadata['entities_hash'] = self.get_content_hash(entities_content)
-        self.storage.metadata['aliases_hash'] = self.get_content_hash(aliases_content)
-        self.storage.save_metadata()
+            self.close_journal()
+            if os.path.isfile(self.journal_path):
+                os.remove(self.journal_path)
 
     @property
     def matches_are_not_up_to_date(self):
@@ -100,24 +224,33 @@ class TextEntities():
 
         return False
 
+    @property
+    def annotations_hash(self):
+        """a hash of the current blacklist, entities and aliases (including
+        any that haven't been written to storage yet)"""
+        return self.get_content_hash(",".join([
+            self.get_content_hash(self.blacklist_file_contents),
+            self.get_content_hash(self.entities_file_contents),
+            self.get_content_hash(self.aliases_file_contents),
+        ]))
+
     def get_content_hash(self, content=''):
         return hashlib.sha224(content.encode('utf-8')).hexdigest()
 
+    # the files are made from the blacklist, entities and aliases as they are
+    # when asked for, so changes made to the lists directly are written too
+
     @property
     def blacklist_file_contents(self):
-        return os.linesep.join(sorted([b for b in self.blacklist]))
+        return os.linesep.join(sorted(self.blacklist))
 
     @property
     def entities_file_contents(self):
-        return os.linesep.join(
-            sorted([e.get_storage_representation() for e in self.entities])
-        )
+        return os.linesep.join(sorted(e.get_storage_representation() for e in self.entities))
 
     @property
     def aliases_file_contents(self):
-        return os.linesep.join(
-            sorted([a.get_storage_representation() for a in self.aliases])
-        )
+        return os.linesep.join(sorted(a.get_storage_representation() for a in self.aliases))
 
     def unlabeled_entities(self, matches):
         """returns the unlabeled entities
@@ -137,34 +270,58 @@ class TextEntities():
 
         return list(unlabeled_entities)
 
-    def add_entity_keys_to_matches(self, raw_matches, include_unlabeled=False):
+    @property
+    def labeled_strings(self):
+        """strings that are entities, aliases or blacklisted"""
+        return {e.key for e in self.entities}.union(
+            self.blacklist
+        ).union(
+            {a.string for a in self.aliases}
+        )
+
+    def candidate_index(self, matches):
+        """the unlabeled entities, ranked and grouped (see `candidates`)"""
+        return candidates.CandidateIndex.from_matches(matches, labeled=self.labeled_strings)
+
+    @property
+    def resolver(self):
+        """a `Resolver` for the current entities/aliases/blacklist. rebuilt
+        when entities or aliases are added."""
+        if self._resolver is None:
+            self._resolver = Resolver(self.entities, self.aliases, self.blacklist)
+
+        return self._resolver
+
+    def add_entity_keys_to_matches(self, raw_matches, include_unlabeled=False, section_name=None):
         """returns entities in a given section
         takes all of the matches and finds their entity (disambiguating aliases)
         if include_unlabeled is True, don't require an entity/alias
+        scoped entities/aliases are only used if `section_name` is given
+        overlapping matches are resolved after the ones without an entity (or
+        blacklisted) are dropped, so those never cost a keyed match (see
+        `matcher.resolve_overlaps`)
         """
-        matches = []
-        for match in raw_matches:
-            clean_text = match.clean_text
+        from . matcher import resolve_overlaps
 
-            if clean_text in self.blacklist:
-                continue
+        with PROFILER.stage('entities.resolve'):
+            resolver = self.resolver
 
-            entity = self.find_entity_with_key(self.entities, clean_text)
+            matches = []
+            for match in raw_matches:
+                clean_text = match.clean_text
 
-            found_entity_or_alias = False
+                if clean_text in resolver.blacklist:
+                    continue
 
-            if entity:
-                match.key = entity.key
-                found_entity_or_alias = True
-            else:
-                alias = self.find_alias_with_key(self.aliases, clean_text)
+                key = resolver.resolve(clean_text, section_name, match.start)
 
-                if alias:
-                    match.key = alias.entity.key
-                    found_entity_or_alias = True
+                if key is not None:
+                    match.key = key
 
-            if found_entity_or_alias or include_unlabeled:
-                matches.append(match)
+                if key is not None or include_unlabeled:
+                    matches.append(match)
+
+            matches = resolve_overlaps(matches, self.storage.overlap_policy)
 
         return matches
 
@@ -172,29 +329,203 @@ class TextEntities():
         """gets the entities in a nice format for spacy's matcher"""
         entities_with_aliases = defaultdict(list)
 
-        for entity in self.entities:
-            entities_with_aliases[entity.key].append(entity.key)
+        with self.storage.lock():
+            for entity in self.entities:
+                entities_with_aliases[entity.key].append(entity.key)
 
-        for alias in self.aliases:
-            entities_with_aliases[alias.entity.key].append(alias.string)
+            for alias in self.aliases:
+                entities_with_aliases[alias.entity.key].append(alias.string)
 
         return entities_with_aliases
 
 
+class Resolver():
+    """finds the entity key for a string at a place in the text.
+
+    unscoped entities/aliases are a dictionary lookup. scoped ones are compiled
+    into an `IntervalIndex` per (string, section), so a lookup is a binary
+    search rather than a check of every scope. scoped entities/aliases take
+    precedence over unscoped ones.
+    """
+    def __init__(self, entities, aliases, blacklist=()):
+        self.blacklist = set(blacklist)
+        self.unscoped = {}
+        scoped_intervals = defaultdict(lambda: defaultdict(list))
+
+        # entities before aliases, so an entity's key always resolves to itself
+        for string, key, scope in [(e.key, e.key, e.scope) for e in entities] + [
+            (a.string, a.entity.key, a.scope) for a in aliases if a.entity
+        ]:
+            if scope:
+                for section_name, start, end in scope.intervals():
+                    scoped_intervals[string][section_name].append((start, end, key))
+            else:
+                self.unscoped.setdefault(string, key)
+
+        self.scoped = {
+            string: {
+                section_name: IntervalIndex(intervals)
+                for section_name, intervals in sections.items()
+            } for string, sections in scoped_intervals.items()
+        }
+
+    def resolve(self, string, section_name=None, position=0):
+        """the key `string` resolves to, or None"""
+        if section_name is not None and string in self.scoped:
+            index = self.scoped[string].get(section_name)
+            if index:
+                key = index.find(position)
+                if key is not None:
+                    return key
+
+        return self.unscoped.get(string)
+
+class IntervalIndex():
+    """maps positions to values, given (start, end, value) intervals (end is
+    exclusive). overlaps are resolved in favor of the earlier interval.
+
+    the intervals are split into non-overlapping segments at build time, so
+    lookups are a single bisect. they're split in one sweep over their
+    sorted boundaries, with a heap of the intervals that are open."""
+    def __init__(self, intervals):
+        intervals = list(intervals)
+        boundaries = sorted({b for start, end, value in intervals for b in (start, end)})
+        by_start = sorted(range(len(intervals)), key=lambda i: intervals[i][0])
+
+        self.starts = []
+        self.ends = []
+        self.values = []
+
+        # (the interval's place in `intervals`, its end). the earliest open
+        # interval is on top; intervals that have ended are dropped once
+        # they get there.
+        open_intervals = []
+        next_interval = 0
+        for start, end in zip(boundaries, boundaries[1:]):
+            while next_interval < len(by_start) and intervals[by_start[next_interval]][0] <= start:
+                i = by_start[next_interval]
+                heapq.heappush(open_intervals, (i, intervals[i][1]))
+                next_interval += 1
+
+            while open_intervals and open_intervals[0][1] <= start:
+                heapq.heappop(open_intervals)
+
+            if not open_intervals:
+                continue
+
+            value = intervals[open_intervals[0][0]][2]
+
+            # merge with the previous segment if it continues it
+            if self.ends and self.ends[-1] == start and self.values[-1] == value:
+                self.ends[-1] = end
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+                self.values.append(value)
+
+    def __bool__(self):
+        return bool(self.starts)
+
+    def find(self, position):
+        i = bisect.bisect_right(self.starts, position) - 1
+        if 0 <= i and position < self.ends[i]:
+            return self.values[i]
+
+        return None
+
 class Scope():
-    """restricts the scope of something (an alias or entity)."""
-    def __init__(self, sections_list):
-        self.sections_list = sections_list
+    """restricts the scope of something (an alias or entity) to whole sections
+    and/or character ranges of sections.
+
+    stored as `;` separated parts, each either `SECTION` or `SECTION:START-END`.
+    `\\`, `;` and `:` in section names are escaped with a `\\`.
+    """
+    def __init__(self, sections_list=(), ranges=()):
+        """
+        parameters:
+        - sections_list: sections which are entirely in scope
+        - ranges: (section, start, end) character ranges which are in scope
+        """
+        self.sections_list = list(sections_list)
+        self.ranges = [tuple(r) for r in ranges]
+
+    def __bool__(self):
+        return bool(self.sections_list or self.ranges)
 
     def in_scope(self, section_name, start_token, end_token):
-        return True
+        if section_name in self.sections_list:
+            return True
+
+        for range_section, range_start, range_end in self.ranges:
+            if range_section == section_name and range_start <= start_token and end_token <= range_end:
+                return True
+
+        return False
+
+    def intervals(self):
+        """(section, start, end) for everything in scope"""
+        for section_name in self.sections_list:
+            yield section_name, 0, float('inf')
+
+        for section_name, start, end in self.ranges:
+            yield section_name, start, end
+
+    @staticmethod
+    def escape(section_name):
+        return section_name.replace('\\', '\\\\').replace(';', '\\;').replace(':', '\\:')
+
+    def get_storage_representation(self):
+        parts = [self.escape(section) for section in self.sections_list]
+        parts += ["{}:{}-{}".format(self.escape(section), start, end) for section, start, end in self.ranges]
+        return ";".join(parts)
+
+    @staticmethod
+    def split_storage_representation(string):
+        """(part, index of its last unescaped `:` or None) for each part, with
+        the escapes taken out"""
+        parts = []
+        part, colon = [], None
+        characters = iter(string)
+        for character in characters:
+            if character == '\\':
+                part.append(next(characters, ''))
+            elif character == ';':
+                parts.append((''.join(part), colon))
+                part, colon = [], None
+            else:
+                if character == ':':
+                    colon = len(part)
+
+                part.append(character)
+
+        parts.append((''.join(part), colon))
+        return parts
+
+    @classmethod
+    def load_from_storage(cls, string):
+        """returns None for an empty scope"""
+        if not string:
+            return None
+
+        sections_list = []
+        ranges = []
+        for part, colon in cls.split_storage_representation(string):
+            if colon:
+                start, _, end = part[colon + 1:].partition('-')
+                if start.isdigit() and end.isdigit():
+                    ranges.append((part[:colon], int(start), int(end)))
+                    continue
+
+            sections_list.append(part)
+
+        return Scope(sections_list, ranges)
 
 class Entity():
     """an entity in a text. has a key and a set of aliases."""
-    def __init__(self, key):
+    def __init__(self, key, scope=None):
         self.key = key
         self.aliases = []
-        self.scope = None
+        self.scope = scope
 
     def __eq__(self, other):
         """there are two ways we look for equality:
@@ -209,15 +540,19 @@ class Entity():
             return False
 
     def get_storage_representation(self):
-        """should probably later be able to set scopes"""
+        """represented as: "ENTITY_KEY" or "ENTITY_KEY","SCOPE" """
+        if self.scope:
+            return '"{key}","{scope}"'.format(key=self.key, scope=self.scope.get_storage_representation())
+
         return '"{key}"'.format(key=self.key)
 
     @classmethod
     def load_from_storage(cls, line):
         """given a line of a file, returns an entity for that line
-        handles entities with scopes and without (all lack scopes for now)"""
-        key = line.split(',', 1)[0].strip('"')
-        return Entity(key=key)
+        handles entities with scopes and without"""
+        parts = [part.strip('"') for part in line.split('","')]
+        scope = Scope.load_from_storage(parts[1]) if len(parts) > 1 else None
+        return Entity(key=parts[0], scope=scope)
 
     def __repr__(self):
         if bool(self.aliases):
@@ -252,17 +587,32 @@ class Alias():
             return False
 
     def get_storage_representation(self):
-        """represented as: "ENTITY_KEY","ALIAS_STRING","SCOPE"
-        should probably later be able to set scopes"""
+        """represented as: "ENTITY_KEY","ALIAS_STRING" or
+        "ENTITY_KEY","ALIAS_STRING","SCOPE" """
+        if self.scope:
+            return '"{key}","{alias_string}","{scope}"'.format(
+                key=self.entity.key,
+                alias_string=self.string,
+                scope=self.scope.get_storage_representation(),
+            )
+
         return '"{key}","{alias_string}"'.format(key=self.entity.key, alias_string=self.string)
 
     @classmethod
     def load_from_storage(cls, line, entities):
         """given a line of a file, returns an alias for that line
-        handles entities with scopes and without (all lack scopes for now)"""
-        entity_key, alias_string = [part.strip('"') for part in line.split('","')]
-        entity = TextEntities.find_entity_with_key(entities, entity_key)
-        return Alias(string=alias_string, entity=entity)
+        handles entities with scopes and without.
+        `entities` is either a list of entities or a dict of them by key"""
+        parts = [part.strip('"') for part in line.split('","')]
+        entity_key, alias_string = parts[:2]
+        scope = Scope.load_from_storage(parts[2]) if len(parts) > 2 else None
+
+        if isinstance(entities, dict):
+            entity = entities.get(entity_key)
+        else:
+            entity = TextEntities.find_entity_with_key(entities, entity_key)
+
+        return Alias(string=alias_string, entity=entity, scope=scope)
 
     def __repr__(self):
         return "{string} ({entity_key})".format(string=self.string, entity_key=self.entity.key)
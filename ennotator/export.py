@@ -0,0 +1,158 @@
+"""
+writes a network's layers to a file handle as they're made, so a long text
+never has all of its layers in memory at once.
+
+every exporter takes an iterable of (section name, section network) pairs
+(eg, `TextNetwork.iter_layers()`) and a text file handle.
+"""
+import csv
+import json
+from xml.sax.saxutils import escape, quoteattr
+
+def write_csv(layers, f):
+    """an edge list: one `section,source,target,weight` row per edge per layer"""
+    writer = csv.writer(f)
+    writer.writerow(['section', 'source', 'target', 'weight'])
+    for section_name, section_network in layers:
+        for one, two, weight in section_network.edges:
+            writer.writerow([section_name, one, two, weight])
+
+def write_graphml(layers, f):
+    """graphml with a graph per layer. ids have to be unique across the whole
+    document, so a node's id is prefixed with its layer (`3/SanchoPanza`),
+    and its name is its `label`."""
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+    f.write('  <key id="label" for="node" attr.name="label" attr.type="string"/>\n')
+    f.write('  <key id="weight" for="edge" attr.name="weight" attr.type="double"/>\n')
+
+    for layer, (section_name, section_network) in enumerate(layers):
+        f.write('  <graph id={} edgedefault="undirected">\n'.format(quoteattr(section_name)))
+
+        def node_id(node):
+            return quoteattr('{}/{}'.format(layer, node))
+
+        for node in sorted(section_network.nodes):
+            f.write('    <node id={}><data key="label">{}</data></node>\n'.format(node_id(node), escape(node)))
+
+        for i, (one, two, weight) in enumerate(section_network.edges):
+            f.write('    <edge id={} source={} target={}><data key="weight">{}</data></edge>\n'.format(
+                quoteattr('{}/e{}'.format(layer, i)),
+                node_id(one),
+                node_id(two),
+                weight,
+            ))
+
+        f.write('  </graph>\n')
+
+    f.write('</graphml>\n')
+
+class Spells():
+    """the (start, end, value) runs over which something had a value, for
+    layers `start` up to (not including) `end`. layer `i` is written as time
+    `i`."""
+    def __init__(self):
+        self.spells = []
+
+    def add(self, layer, value=None):
+        if self.spells:
+            start, end, last_value = self.spells[-1]
+            if end == layer and last_value == value:
+                self.spells[-1][1] = layer + 1
+                return
+
+        self.spells.append([layer, layer + 1, value])
+
+def write_gexf(layers, f):
+    """a single dynamic gexf graph: nodes and edges have spells for the layers
+    they're in, and edges have a dynamic weight.
+
+    gexf puts every node before every edge, so rather than holding on to the
+    layers, only the runs of each node's presence and each edge's weight are
+    kept until the end."""
+    nodes = {}
+    edges = {}
+    for layer, (section_name, section_network) in enumerate(layers):
+        for node in section_network.nodes:
+            nodes.setdefault(node, Spells()).add(layer)
+
+        for one, two, weight in section_network.edges:
+            edges.setdefault((one, two), Spells()).add(layer, weight)
+
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    f.write('<gexf xmlns="http://www.gexf.net/1.2draft" version="1.2">\n')
+    f.write('  <graph mode="dynamic" defaultedgetype="undirected" timeformat="double">\n')
+    f.write('    <attributes class="edge" mode="dynamic">\n')
+    f.write('      <attribute id="weight" title="weight" type="double"/>\n')
+    f.write('    </attributes>\n')
+
+    f.write('    <nodes>\n')
+    for node, spells in nodes.items():
+        f.write('      <node id={id} label={id}>\n'.format(id=quoteattr(node)))
+        write_gexf_spells(f, spells, '        ')
+        f.write('      </node>\n')
+    f.write('    </nodes>\n')
+
+    f.write('    <edges>\n')
+    for i, ((one, two), spells) in enumerate(edges.items()):
+        f.write('      <edge id="{i}" source={one} target={two}>\n'.format(
+            i=i,
+            one=quoteattr(one),
+            two=quoteattr(two),
+        ))
+
+        f.write('        <attvalues>\n')
+        for start, end, weight in spells.spells:
+            f.write('          <attvalue for="weight" value="{}" start="{}" end="{}"/>\n'.format(weight, start, end - 1))
+        f.write('        </attvalues>\n')
+
+        write_gexf_spells(f, spells, '        ')
+        f.write('      </edge>\n')
+    f.write('    </edges>\n')
+
+    f.write('  </graph>\n')
+    f.write('</gexf>\n')
+
+def write_gexf_spells(f, spells, indent):
+    """writes when something is present. runs that touch are merged, since
+    an edge whose weight changed between layers was there the whole time."""
+    merged = []
+    for start, end, _ in spells.spells:
+        if merged and merged[-1][1] == start:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    f.write(indent + '<spells>\n')
+    for start, end in merged:
+        f.write(indent + '  <spell start="{}" end="{}"/>\n'.format(start, end - 1))
+    f.write(indent + '</spells>\n')
+
+def write_webweb(layers, f, name='network', node_attributes=None):
+    """json that webweb can display, with a layer per section. nodes can be
+    colored by the attributes in `node_attributes` (node -> {attribute:
+    value}, eg from `TextNetwork.node_attributes`)."""
+    node_attributes = node_attributes or {}
+
+    f.write('{')
+    f.write('"title": {}, '.format(json.dumps(name)))
+    f.write('"display": {}, '.format(json.dumps({'networkName' : name})))
+    f.write('"networks": {{{}: {{"layers": ['.format(json.dumps(name)))
+
+    for i, (section_name, section_network) in enumerate(layers):
+        if i:
+            f.write(', ')
+
+        json.dump({
+            'edgeList' : section_network.edges,
+            'nodes' : {node: node_attributes.get(node, {}) for node in sorted(section_network.nodes)},
+        }, f)
+
+    f.write(']}}}')
+
+EXPORTERS = {
+    'csv' : write_csv,
+    'graphml' : write_graphml,
+    'gexf' : write_gexf,
+    'webweb' : write_webweb,
+}
@@ -52,9 +52,10 @@ class FileInteracter(Interacter):
         1
 
     def update_storage(self):
-        self.storage.metadata['files']['exclusions'] = self.exclusions
-        self.storage.metadata['files']['ordering'] = self.ordering
-        self.storage.save_metadata()
+        with self.storage.lock():
+            self.storage.metadata['files']['exclusions'] = self.exclusions
+            self.storage.metadata['files']['ordering'] = self.ordering
+            self.storage.save_metadata()
 
     def order(self):
         """order is kinda dumb, you can only add things to the end"""
@@ -127,21 +128,76 @@ class FileInteracter(Interacter):
         self.update_storage()
 
 class EntityInteracter(Interacter):
-    def __init__(self, storage, entity_interface):
+    def __init__(self, storage, entity_interface, suggest=True):
+        """
+        parameters:
+        - suggest: if True, suggests existing entities that unlabeled strings
+          might be aliases of (needs a model with word vectors)
+        """
         self.storage = storage
         self.entity_interface = entity_interface
+        self.suggest = suggest
+        self._suggester = None
 
         # ENTITIES will be one entity per line
         # STRINGS_BLACKLIST will be one string per line
         # ALIASES will be one per line:
         #   - "entity", "alias", INCLUDE_IN_FILES:[],EXCLUDE_FROM_FILES:[]
 
-    def label_entities(self):
-        all_matches = [m for matches in self.storage.raw_matches.values() for m in matches]
-        unlabeled_entities = sorted(self.entity_interface.unlabeled_entities(all_matches))
+    @property
+    def suggester(self):
+        if self.suggest and self._suggester is None:
+            from . import suggestions
+            self._suggester = suggestions.AliasSuggester(
+                [e.key for e in self.entity_interface.entities],
+                model_name=self.storage.model_name,
+            )
+
+        return self._suggester
+
+    def get_suggestions(self, unlabeled_entity, k=5):
+        if not self.suggest:
+            return []
+
+        try:
+            return [key for key, score in self.suggester.suggest(unlabeled_entity, k=k)]
+        except OSError:
+            print("can't load a model with vectors, so not suggesting entities.")
+            self.suggest = False
+            return []
+
+    def label_entities(self, checkpoint_every=100):
+        """decisions are journaled as they're made, and written to the
+        annotation files every `checkpoint_every` decisions and on exit"""
+        with self.storage.lock():
+            all_matches = [m for f in self.storage.raw_matches for m in self.storage.get_matches(f)]
+
+        candidate_index = self.entity_interface.candidate_index(all_matches)
+
+        try:
+            self._label_entities(candidate_index, checkpoint_every)
+        finally:
+            self.entity_interface.update_storage()
+
+    def _label_entities(self, candidate_index, checkpoint_every):
+        """candidates are presented most mentioned first, with strings that
+        share words presented together"""
+        count_of_unlabeled_entities = len(candidate_index)
+        total_mentions = candidate_index.total_mentions
+        decisions = 0
+        i = 0
+        while True:
+            unlabeled_entity = candidate_index.next_candidate()
+            if unlabeled_entity is None:
+                break
+
+            mentions = candidate_index.counts[unlabeled_entity]
+            remaining_mentions = candidate_index.total_mentions
+
+            # whatever happens, don't ask about this one again
+            candidate_index.remove(unlabeled_entity)
+            i += 1
 
-        count_of_unlabeled_entities = len(unlabeled_entities)
-        for i, unlabeled_entity in enumerate(unlabeled_entities):
             handler = self.list_interaction(
                 [e.key for e in self.entity_interface.entities],
                 [
@@ -151,34 +207,45 @@ class EntityInteracter(Interacter):
                     SkipEntityListInteractionHandler(print_precedence=3),
                     QuitListInteractionHandler(print_precedence=4),
                 ],
-                prompt="match {i}/{total}: {unlabeled_entity}".format(
+                prompt="match {i}/{total} ({covered}/{total_mentions} mentions covered): {unlabeled_entity} ({mentions} mentions)".format(
                     i=i,
                     total=count_of_unlabeled_entities,
+                    covered=total_mentions - remaining_mentions,
+                    total_mentions=total_mentions,
                     unlabeled_entity=unlabeled_entity,
-                )
+                    mentions=mentions,
+                ),
+                suggestions=self.get_suggestions(unlabeled_entity),
             )
 
             if handler.name == 'not_entity':
-                self.entity_interface.blacklist.append(unlabeled_entity)
+                self.entity_interface.add_to_blacklist(unlabeled_entity)
             elif handler.name == 'new_entity':
-                entity = entities.Entity(key=handler.result)
-                self.entity_interface.entities.append(entity)
+                entity = self.entity_interface.add_entity(handler.result)
+
+                if self._suggester is not None:
+                    self._suggester.add([entity.key])
+
                 # add an alias if the key is different from the unlabeled entity
                 # supplied
                 if handler.result != unlabeled_entity:
-                    alias = entities.Alias(string=unlabeled_entity, entity=entity)
-                    self.entity_interface.aliases.append(alias)
+                    self.entity_interface.add_alias(unlabeled_entity, entity)
             elif handler.name == 'existing_entity':
                 entity_index = handler.result
                 entity = self.entity_interface.entities[entity_index]
-                alias = entities.Alias(string=unlabeled_entity, entity=entity)
-                self.entity_interface.aliases.append(alias)
+                self.entity_interface.add_alias(unlabeled_entity, entity)
             elif handler.name == 'quit':
                 break
+            else:
+                continue
 
-            self.entity_interface.update_storage()
+            decisions += 1
+            if checkpoint_every and not decisions % checkpoint_every:
+                self.entity_interface.update_storage()
 
-    def list_interaction(self, _list, handlers, prompt=""):
+    def list_interaction(self, _list, handlers, prompt="", suggestions=[]):
+        """`suggestions` are options to print (with their numbers) right
+        before the prompt"""
         sorted_list = sorted(copy.deepcopy(_list))
         handlers_in_order_to_print = sorted(handlers, key=lambda h: h.print_precedence)
 
@@ -191,6 +258,12 @@ class EntityInteracter(Interacter):
         for i, option in enumerate(sorted_list):
             print("[{i}] - {option}".format(i=i+1, option=option))
 
+        if suggestions:
+            print("suggestions: " + ", ".join([
+                "[{i}] {option}".format(i=sorted_list.index(s) + 1, option=s)
+                for s in suggestions
+            ]))
+
         print(prompt)
 
         answer = input().strip()
@@ -1,9 +1,9 @@
 import re
 from spacy.matcher import Matcher as SpacyMatcher
-from collections import defaultdict
 
 from . import model
 from . import entities
+from . profiling import PROFILER
 
 def make_stopwords():
     """turns things into stopwords, yaknow"""
@@ -20,15 +20,31 @@ def make_stopwords():
     stop_words.update(contraction_stopwords)
     return stop_words
 
+# bump this when a change to matching changes its results, so that matches
+# made before it are remade
+# - 2: spacy matcher matches have character offsets; overlaps are resolved
+MATCHER_VERSION = 2
+
 class EntityMatchObject():
     """interfaces with spacy to make entity recognition better based on
     user-supplied entities and disambiguations"""
-    def __init__(self, entities_with_aliases={}):
+    def __init__(self, entities_with_aliases={}, model_name=None):
         self.entities_with_aliases = entities_with_aliases
+        self.model_name = model_name or model.DEFAULT_MODEL
 
     @property
     def nlp(self):
-        return model.load_spacy('en_core_web_md')
+        return model.load_spacy(self.model_name)
+
+    @property
+    def signature(self):
+        """what the matches depend on, other than the text and entities. it's
+        told without loading the model."""
+        return {
+            'name' : self.model_name,
+            'version' : model.get_model_version(self.model_name),
+            'matcher' : MATCHER_VERSION,
+        }
 
     @property
     def matcher(self):
@@ -44,32 +60,119 @@ class EntityMatchObject():
         return self._matcher
 
     def get_matches(self, text):
-        doc = self.nlp(text)
+        return self.get_matches_and_boundaries(text)[0]
+
+    def get_matches_and_boundaries(self, text):
+        """returns the text's matches and its boundaries (see
+        `get_doc_boundaries`)"""
+        with PROFILER.stage('matcher.nlp'):
+            doc = self.nlp(text)
+
+        with PROFILER.stage('matcher.match'):
+            matches = self.get_doc_matches(doc)
+
+        PROFILER.count('mentions', len(matches))
+        return matches, self.get_doc_boundaries(doc)
+
+    def pipe_matches(self, texts, batch_size=8):
+        """like `get_matches_and_boundaries` for an iterable of (text,
+        context) pairs, with the texts parsed in batches. yields (matches,
+        boundaries, context) in order."""
+        docs = iter(self.nlp.pipe(texts, as_tuples=True, batch_size=batch_size))
+        while True:
+            with PROFILER.stage('matcher.nlp'):
+                doc, context = next(docs, (None, None))
+
+            if doc is None:
+                return
+
+            with PROFILER.stage('matcher.match'):
+                matches = self.get_doc_matches(doc)
+                boundaries = self.get_doc_boundaries(doc)
+
+            # the doc is much bigger than what's taken from it, so it's let go
+            # of before the matches are passed on
+            del doc
+
+            PROFILER.count('mentions', len(matches))
+            yield matches, boundaries, context
+
+    @staticmethod
+    def get_doc_boundaries(doc):
+        """the character offsets the doc's sentences and paragraphs start at.
+        paragraphs are separated by blank lines, or by line breaks if there
+        aren't any blank lines."""
+        try:
+            sentences = [sentence.start_char for sentence in doc.sents]
+        except ValueError:
+            # the pipeline doesn't split sentences
+            sentences = []
+
+        breaks = list(re.finditer(r'\n[ \t]*\n\s*', doc.text)) or list(re.finditer(r'\n\s*', doc.text))
+        paragraphs = [0] + [b.end() for b in breaks if b.end() < len(doc.text)]
+
+        return {
+            'sentences' : sentences,
+            'paragraphs' : paragraphs,
+        }
+
+    def get_doc_matches(self, doc):
+        """the user's entities and aliases, and the people spacy recognizes.
+        overlapping matches are all kept, so that the recognizer's can be
+        weighed against the user's again when those change; they're resolved
+        when they're read (see `entities.TextEntities.add_entity_keys_to_matches`)"""
         matches = []
 
-        seen_matches = defaultdict(defaultdict(defaultdict(dict).copy).copy)
         matcher = self.matcher
         raw_matches = matcher(doc)
 
+        # the matcher gives token offsets, entities give character offsets
         for _id, start, end in raw_matches:
-            text = doc[start:end].text
+            span = doc[start:end]
             key = matcher.vocab.strings[_id]
-            matches.append(Match(start=start, end=end, text=text, key=key))
-            seen_matches[start][end][text] = True
+            matches.append(Match(start=span.start_char, end=span.end_char, text=span.text, key=key))
 
         for match in [e for e in doc.ents if e.label_ == 'PERSON']:
-            start = match.start_char
-            end = match.end_char
-            text = match.text
-
-            if not seen_matches[start][end][text]:
-                matches.append(Match(
-                    text=text,
-                    start=start,
-                    end=end,
-                ))
-
-        return matches
+            matches.append(Match(
+                text=match.text,
+                start=match.start_char,
+                end=match.end_char,
+            ))
+
+        return sorted(matches, key=lambda m: (m.start, m.end))
+
+OVERLAP_POLICIES = ['longest', 'user']
+
+def resolve_overlaps(matches, policy='longest'):
+    """keeps one of each run of overlapping matches, in a single sweep over
+    the matches sorted by start. which one is kept depends on the policy:
+    - longest: the longest (on a tie, the one from the user's entities and
+      aliases)
+    - user: the one from the user's entities and aliases (on a tie, the
+      longest)
+    after that, the earliest wins. returns the kept matches, sorted by start.
+    """
+    if policy not in OVERLAP_POLICIES:
+        raise ValueError("unknown overlap policy '{}' (options: {})".format(policy, ", ".join(OVERLAP_POLICIES)))
+
+    def priority(match):
+        from_user = match['key'] is not None
+        length = match.end - match.start
+        return (from_user, length) if policy == 'user' else (length, from_user)
+
+    kept = []
+    for match in sorted(matches, key=lambda m: (m.start, m.start - m.end)):
+        if kept and match.start < kept[-1].end:
+            # the match it replaces didn't overlap the one before, and this
+            # one starts later, so it doesn't either
+            if priority(match) > priority(kept[-1]):
+                kept[-1] = match
+
+            continue
+
+        kept.append(match)
+
+    return kept
 
 class Match(dict):
     def __init__(self, start=0, end=0, text="", key=None):
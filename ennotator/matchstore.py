@@ -0,0 +1,530 @@
+"""
+a compact binary format for raw matches.
+
+the json format repeats "start", "end", "text" and "key" for every mention.
+this one stores:
+- a string table (every text and key, once)
+- a section directory (section name, first match, number of matches)
+- four integer arrays (starts, ends, text indexes, key indexes)
+
+layout (little endian, every field is 4 bytes):
+    header:     MAGIC, version (u8), compression (u8), 2 bytes of padding
+    payload:    (compressed with gzip/zstd if the header says so)
+        n_strings, blob_length, string_offsets[n_strings + 1], blob (padded to 4)
+        n_sections, [name_index, first_match, match_count] * n_sections
+        n_matches, starts[n], ends[n], texts[n], keys[n] (-1 is no key)
+
+uncompressed files are memory mapped, and matches are only built for the
+sections that are asked for.
+"""
+import argparse
+import gzip
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+MAGIC = b'ENRM'
+VERSION = 1
+
+COMPRESSIONS = {
+    None : 0,
+    'gzip' : 1,
+    'zstd' : 2,
+}
+
+HEADER = struct.Struct('<4sBB2x')
+U32 = struct.Struct('<I')
+
+def is_binary_file(path):
+    """true if the file at `path` is in this format"""
+    if not os.path.isfile(path):
+        return False
+
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def get_file_signature(path):
+    """identifies a version of a file: files are replaced (not rewritten) when
+    they're saved, so a new one has a new inode"""
+    if not os.path.isfile(path):
+        return None
+
+    stat = os.stat(path)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def compress(payload, compression):
+    if compression == 'gzip':
+        return gzip.compress(payload)
+    elif compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor().compress(payload)
+
+    return payload
+
+def decompress(payload, compression):
+    if compression == 'gzip':
+        return gzip.decompress(payload)
+    elif compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(payload)
+
+    return payload
+
+def to_little_endian(values):
+    """an array's bytes, little endian whatever the host's byte order"""
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+
+    return values.tobytes()
+
+def u32_array(values):
+    return to_little_endian(array('I', values))
+
+def dump(raw_matches, f, compression=None):
+    """writes `raw_matches` (section name -> list of matches) to the binary
+    file handle `f`"""
+    if compression not in COMPRESSIONS:
+        raise ValueError("unknown compression: {}".format(compression))
+
+    string_indexes = {}
+    def string_index(string):
+        if string not in string_indexes:
+            string_indexes[string] = len(string_indexes)
+
+        return string_indexes[string]
+
+    sections = []
+    starts = array('I')
+    ends = array('I')
+    texts = array('I')
+    keys = array('i')
+    for section_name, section_matches in raw_matches.items():
+        sections.append((string_index(section_name), len(starts), len(section_matches)))
+
+        for match in section_matches:
+            starts.append(match['start'])
+            ends.append(match['end'])
+            texts.append(string_index(match['text']))
+            keys.append(-1 if match['key'] is None else string_index(match['key']))
+
+    encoded_strings = [s.encode('utf-8') for s in string_indexes]
+    string_offsets = [0]
+    for encoded_string in encoded_strings:
+        string_offsets.append(string_offsets[-1] + len(encoded_string))
+
+    blob = b''.join(encoded_strings)
+    blob += b'\0' * (-len(blob) % 4)
+
+    parts = [
+        U32.pack(len(encoded_strings)),
+        U32.pack(string_offsets[-1]),
+        u32_array(string_offsets),
+        blob,
+        U32.pack(len(sections)),
+        u32_array([n for section in sections for n in section]),
+        U32.pack(len(starts)),
+        to_little_endian(starts),
+        to_little_endian(ends),
+        to_little_endian(texts),
+        to_little_endian(keys),
+    ]
+
+    f.write(HEADER.pack(MAGIC, VERSION, COMPRESSIONS[compression]))
+    f.write(compress(b''.join(parts), compression))
+
+class RawMatchFile():
+    """reads a binary raw matches file. sections are decoded on demand."""
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = None
+
+        magic, version, compression = HEADER.unpack(self._file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("{} is not a binary raw matches file".format(path))
+
+        if version != VERSION:
+            raise ValueError("unsupported raw matches version: {}".format(version))
+
+        self.compression = {v: k for k, v in COMPRESSIONS.items()}[compression]
+
+        if self.compression:
+            payload = memoryview(decompress(self._file.read(), self.compression))
+        else:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            payload = memoryview(self._mmap)[HEADER.size:]
+
+        self._parse(payload)
+
+    def _parse(self, payload):
+        offset = 0
+        self._views = [payload]
+        def take_u32s(count, format='I'):
+            nonlocal offset
+            values = payload[offset:offset + 4 * count]
+            offset += 4 * count
+
+            # the file is little endian. on other hosts the values are copied
+            # and swapped rather than viewed in place.
+            if sys.byteorder != 'little':
+                values = array(format, values.tobytes())
+                values.byteswap()
+                return values
+
+            values = values.cast(format)
+            self._views.append(values)
+            return values
+
+        n_strings, blob_length = take_u32s(2)
+        self._string_offsets = take_u32s(n_strings + 1)
+        self._blob = payload[offset:offset + blob_length]
+        self._views.append(self._blob)
+        offset += blob_length + (-blob_length % 4)
+        self._strings = {}
+
+        n_sections = take_u32s(1)[0]
+        directory = take_u32s(3 * n_sections)
+        self.sections = {}
+        for i in range(n_sections):
+            name_index, first_match, match_count = directory[3 * i:3 * i + 3]
+            self.sections[self.get_string(name_index)] = (first_match, match_count)
+
+        n_matches = take_u32s(1)[0]
+        self._starts = take_u32s(n_matches)
+        self._ends = take_u32s(n_matches)
+        self._texts = take_u32s(n_matches)
+        self._keys = take_u32s(n_matches, 'i')
+
+    def get_string(self, index):
+        string = self._strings.get(index)
+        if string is None:
+            start, end = self._string_offsets[index], self._string_offsets[index + 1]
+            string = str(self._blob[start:end], 'utf-8')
+            self._strings[index] = string
+
+        return string
+
+    def get_section(self, section_name):
+        """the matches of a section, as `Match`es"""
+        from . matcher import Match
+        first_match, match_count = self.sections[section_name]
+
+        starts = self._starts[first_match:first_match + match_count].tolist()
+        ends = self._ends[first_match:first_match + match_count].tolist()
+        texts = self._texts[first_match:first_match + match_count].tolist()
+        keys = self._keys[first_match:first_match + match_count].tolist()
+
+        return [
+            Match(
+                start=start,
+                end=end,
+                text=self.get_string(text),
+                key=None if key < 0 else self.get_string(key),
+            ) for start, end, text, key in zip(starts, ends, texts, keys)
+        ]
+
+    def load(self):
+        """every section's matches"""
+        return {section_name: self.get_section(section_name) for section_name in self.sections}
+
+    def close(self):
+        # views into the mmap have to be released before it can be closed
+        for view in reversed(self._views):
+            view.release()
+
+        if self._mmap is not None:
+            self._mmap.close()
+
+        self._file.close()
+
+def load_json(path):
+    """reads the old json format"""
+    from . matcher import Match
+    with open(path, 'r') as f:
+        raw_matches = json.load(f)
+
+    return {
+        file_name: [
+            Match(
+                start=m['start'],
+                end=m['end'],
+                text=m['text'],
+                key=m.get('key'),
+            ) for m in file_raw_matches
+        ] for file_name, file_raw_matches in raw_matches.items()
+    }
+
+class LazyRawMatches(MutableMapping):
+    """section name -> raw matches, read from disk the first time a section is
+    asked for.
+
+    if `max_sections` is set, at most that many sections are held in memory;
+    the least recently used are dropped first (and reread if asked for again).
+    sections that were set but haven't been saved are never dropped.
+
+    the file isn't opened until the matches are used, so a datastore can be
+    opened without reading them (a json file is read whole).
+    """
+    def __init__(self, path, max_sections=None):
+        self.path = path
+        self.max_sections = max_sections
+
+        self._loaded = OrderedDict()
+        self._unsaved = set()
+        self._deleted = set()
+        self._file_signature = None
+        self._match_file = None
+        self._json_matches = None
+        self._reopen = False
+        self._section_names = None
+
+    @property
+    def changed_sections(self):
+        """the sections set or deleted since the file was last saved"""
+        return self._unsaved | self._deleted
+
+    @property
+    def section_names(self):
+        """the sections on disk and in memory. opens the file the first time."""
+        if self._section_names is None:
+            self.reload()
+
+        return self._section_names
+
+    def reload(self):
+        """(re)opens the file on disk. sections already in memory are kept."""
+        self._open()
+
+        on_disk = list(self._match_file.sections if self._match_file is not None else self._json_matches)
+        self._section_names = on_disk + [n for n in self._loaded if n not in on_disk]
+        self._unsaved = set()
+        self._deleted = set()
+
+    def saved(self):
+        """called once every section has been written to the file. the
+        sections in memory are what was written, so the file isn't read
+        again: json is updated in memory, and a binary file is only reopened
+        when a section that isn't in memory is asked for."""
+        if self._json_matches is not None:
+            for section_name in self._unsaved:
+                self._json_matches[section_name] = [dict(m) for m in self._loaded[section_name]]
+
+            self._json_matches = {
+                section_name: self._json_matches[section_name]
+                for section_name in self.section_names if section_name in self._json_matches
+            }
+        else:
+            self._reopen = True
+
+        self._unsaved = set()
+        self._deleted = set()
+        self._file_signature = get_file_signature(self.path)
+
+    def refresh(self):
+        """picks up sections others saved to the file since it was read.
+        sections set or deleted here, and not saved yet, stay as they are."""
+        if not self.is_open or get_file_signature(self.path) == self._file_signature:
+            return
+
+        unsaved, deleted = self._unsaved, self._deleted
+        self._loaded = OrderedDict((name, matches) for name, matches in self._loaded.items() if name in unsaved)
+
+        self.reload()
+        self._section_names = [name for name in self._section_names if name not in deleted]
+        self._unsaved, self._deleted = unsaved, deleted
+
+    def _open(self):
+        self.close()
+        self._file_signature = get_file_signature(self.path)
+
+        if is_binary_file(self.path):
+            self._match_file = RawMatchFile(self.path)
+        else:
+            with open(self.path, 'r') as f:
+                self._json_matches = json.load(f)
+
+        self._reopen = False
+
+    def close(self):
+        if self._match_file is not None:
+            self._match_file.close()
+
+        self._match_file = None
+        self._json_matches = None
+
+    def _load_section(self, section_name):
+        from . matcher import Match
+        if self._reopen:
+            self._open()
+
+        if self._match_file is not None:
+            return self._match_file.get_section(section_name)
+
+        return [
+            Match(
+                start=m['start'],
+                end=m['end'],
+                text=m['text'],
+                key=m.get('key'),
+            ) for m in self._json_matches[section_name]
+        ]
+
+    def _evict(self):
+        if not self.max_sections:
+            return
+
+        for section_name in list(self._loaded):
+            if len(self._loaded) <= self.max_sections:
+                break
+
+            if section_name not in self._unsaved:
+                del self._loaded[section_name]
+
+    def __getitem__(self, section_name):
+        if section_name in self._loaded:
+            self._loaded.move_to_end(section_name)
+            return self._loaded[section_name]
+
+        if section_name not in self.section_names:
+            raise KeyError(section_name)
+
+        section_matches = self._load_section(section_name)
+        self._loaded[section_name] = section_matches
+        self._evict()
+        return section_matches
+
+    def __setitem__(self, section_name, section_matches):
+        if section_name not in self.section_names:
+            self._section_names.append(section_name)
+
+        self._loaded[section_name] = section_matches
+        self._loaded.move_to_end(section_name)
+        self._unsaved.add(section_name)
+        self._deleted.discard(section_name)
+        self._evict()
+
+    def __delitem__(self, section_name):
+        if section_name not in self.section_names:
+            raise KeyError(section_name)
+
+        self._section_names.remove(section_name)
+        self._loaded.pop(section_name, None)
+        self._unsaved.discard(section_name)
+        self._deleted.add(section_name)
+
+    def __contains__(self, section_name):
+        return section_name in self.section_names
+
+    def __iter__(self):
+        return iter(list(self.section_names))
+
+    def __len__(self):
+        return len(self.section_names)
+
+    @property
+    def is_open(self):
+        """whether the file has been read (or mapped) yet"""
+        return self._section_names is not None
+
+    @property
+    def loaded_sections(self):
+        """the sections currently held in memory"""
+        return list(self._loaded)
+
+def load(path):
+    """reads raw matches in either format"""
+    if is_binary_file(path):
+        match_file = RawMatchFile(path)
+        raw_matches = match_file.load()
+        match_file.close()
+        return raw_matches
+
+    return load_json(path)
+
+def convert(json_path, binary_path=None, compression=None):
+    """converts a json raw matches file to the binary format. converts in
+    place if no `binary_path` is given. a datastore's raw matches are
+    converted through the datastore (see `TextDatastore.convert_raw_matches`),
+    so its metadata records the format and it keeps saving in it."""
+    from . storage import TextDatastore, atomic_open
+    if binary_path is None:
+        directory = os.path.dirname(os.path.abspath(json_path))
+        text_storage = TextDatastore.at_path(directory)
+        if text_storage is not None and os.path.abspath(json_path) == text_storage.raw_matches_path:
+            text_storage.convert_raw_matches('binary', compression)
+            return
+
+    raw_matches = load_json(json_path)
+
+    with atomic_open(binary_path or json_path, 'wb') as f:
+        dump(raw_matches, f, compression=compression)
+
+def benchmark(path, repeat=5):
+    """times loading `path` as json and in each binary format.
+    returns {format: (seconds per load, bytes on disk)}"""
+    import shutil
+    import tempfile
+    from . storage import atomic_open
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, 'json')
+        if is_binary_file(path):
+            with open(json_path, 'w') as f:
+                json.dump(load(path), f)
+        else:
+            shutil.copy(path, json_path)
+
+        candidates = {'json' : json_path}
+        for compression in COMPRESSIONS:
+            if compression == 'zstd':
+                try:
+                    import zstandard
+                except ImportError:
+                    continue
+
+            binary_path = os.path.join(directory, str(compression))
+            convert(json_path, binary_path, compression=compression)
+            candidates['binary ({})'.format(compression or 'uncompressed')] = binary_path
+
+        for name, candidate_path in candidates.items():
+            start = time.perf_counter()
+            for _ in range(repeat):
+                load(candidate_path)
+
+            results[name] = ((time.perf_counter() - start) / repeat, os.path.getsize(candidate_path))
+
+    return results
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="convert/benchmark raw match files")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert_parser = subparsers.add_parser('convert', help="convert a json raw matches file in place")
+    convert_parser.add_argument('path')
+    convert_parser.add_argument('--compression', choices=['gzip', 'zstd'], default=None)
+
+    benchmark_parser = subparsers.add_parser('benchmark', help="time loading a raw matches file")
+    benchmark_parser.add_argument('path')
+    benchmark_parser.add_argument('--repeat', type=int, default=5)
+
+    args = parser.parse_args(args)
+
+    if args.command == 'convert':
+        if is_binary_file(args.path):
+            sys.exit("{} is already binary".format(args.path))
+
+        convert(args.path, compression=args.compression)
+    elif args.command == 'benchmark':
+        for name, (seconds, size) in benchmark(args.path, repeat=args.repeat).items():
+            print("{name:<25} {ms:>9.1f} ms {size:>12,} bytes".format(name=name, ms=seconds * 1000, size=size))
+
+if __name__ == '__main__':
+    main()
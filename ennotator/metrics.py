@@ -0,0 +1,211 @@
+"""
+metrics for each layer (section) of a `TextNetwork`:
+- degree and weighted degree
+- connected components
+- betweenness (optional, and optionally estimated from a sample of nodes)
+
+when the network is accumulative, each layer only adds to the one before, so
+degrees and components are updated from the edges a section adds instead of
+being recomputed.
+"""
+import json
+import os
+import random
+from collections import defaultdict, deque
+
+from . storage import atomic_open
+
+class NetworkMetrics():
+    def __init__(self, text_network):
+        self.text_network = text_network
+
+    def compute(self, betweenness=False, betweenness_samples=None, seed=0):
+        """returns a list with a dict of metrics for each layer:
+        - section: the section's name
+        - nodes/edges: how many there are
+        - degree/weighted_degree: node -> value
+        - components: lists of nodes, largest first
+        - betweenness: node -> (normalized) betweenness, if asked for. if
+          `betweenness_samples` is set, it is estimated from that many
+          source nodes.
+        """
+        layers = []
+
+        degree = defaultdict(int)
+        weighted_degree = defaultdict(int)
+        adjacency = defaultdict(set)
+        components = UnionFind()
+
+        for file_name, section_network in self.text_network.iter_layers():
+            if self.text_network.accumulative:
+                new_edges = section_network.section_edges
+            else:
+                degree = defaultdict(int)
+                weighted_degree = defaultdict(int)
+                adjacency = defaultdict(set)
+                components = UnionFind()
+                new_edges = section_network.edges
+
+            for one, two, weight in new_edges:
+                if two not in adjacency[one]:
+                    adjacency[one].add(two)
+                    adjacency[two].add(one)
+                    degree[one] += 1
+                    degree[two] += 1
+
+                weighted_degree[one] += weight
+                weighted_degree[two] += weight
+                components.union(one, two)
+
+            # a weighting like pmi changes the weights of earlier edges too
+            if self.text_network.accumulative and not section_network.additive:
+                weighted_degree = defaultdict(int)
+                for one, two, weight in section_network.edges:
+                    weighted_degree[one] += weight
+                    weighted_degree[two] += weight
+
+            for node in section_network.nodes:
+                components.add(node)
+
+            layer = {
+                'section' : file_name,
+                'nodes' : len(section_network.nodes),
+                'edges' : len(section_network.edges),
+                'degree' : {n: degree.get(n, 0) for n in section_network.nodes},
+                'weighted_degree' : {n: weighted_degree.get(n, 0) for n in section_network.nodes},
+                'components' : components.groups(),
+            }
+
+            if betweenness:
+                layer['betweenness'] = get_betweenness(
+                    adjacency,
+                    section_network.nodes,
+                    samples=betweenness_samples,
+                    seed=seed,
+                )
+
+            layers.append(layer)
+
+        return layers
+
+class UnionFind():
+    """connected components which can only grow, so each edge is merged in
+    once"""
+    def __init__(self):
+        self.parents = {}
+        self.sizes = {}
+
+    def add(self, node):
+        if node not in self.parents:
+            self.parents[node] = node
+            self.sizes[node] = 1
+
+    def find(self, node):
+        self.add(node)
+        root = node
+        while self.parents[root] != root:
+            root = self.parents[root]
+
+        while self.parents[node] != root:
+            self.parents[node], node = root, self.parents[node]
+
+        return root
+
+    def union(self, one, two):
+        one, two = self.find(one), self.find(two)
+        if one == two:
+            return
+
+        if self.sizes[one] < self.sizes[two]:
+            one, two = two, one
+
+        self.parents[two] = one
+        self.sizes[one] += self.sizes[two]
+
+    def groups(self):
+        groups = defaultdict(list)
+        for node in self.parents:
+            groups[self.find(node)].append(node)
+
+        return sorted([sorted(g) for g in groups.values()], key=lambda g: (-len(g), g))
+
+def get_betweenness(adjacency, nodes, samples=None, seed=0):
+    """(unweighted) betweenness centrality with brandes' algorithm, normalized
+    like networkx's. if `samples` is given, only that many (deterministically
+    chosen) source nodes are used and the result is scaled up."""
+    nodes = sorted(nodes)
+    betweenness = dict.fromkeys(nodes, 0.0)
+
+    sources = nodes
+    if samples and samples < len(nodes):
+        sources = random.Random(seed).sample(nodes, samples)
+
+    for source in sources:
+        stack = []
+        predecessors = defaultdict(list)
+        paths = defaultdict(int)
+        paths[source] = 1
+        distances = {source: 0}
+
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            stack.append(node)
+            for neighbor in adjacency.get(node, ()):
+                if neighbor not in distances:
+                    distances[neighbor] = distances[node] + 1
+                    queue.append(neighbor)
+
+                if distances[neighbor] == distances[node] + 1:
+                    paths[neighbor] += paths[node]
+                    predecessors[neighbor].append(node)
+
+        dependencies = defaultdict(float)
+        while stack:
+            node = stack.pop()
+            for predecessor in predecessors[node]:
+                dependencies[predecessor] += paths[predecessor] / paths[node] * (1 + dependencies[node])
+
+            if node != source:
+                betweenness[node] += dependencies[node]
+
+    n = len(nodes)
+    scale = 1 / ((n - 1) * (n - 2)) if n > 2 else 1
+    scale *= len(nodes) / len(sources) if sources else 1
+
+    return {node: value * scale for node, value in betweenness.items()}
+
+class MetricsCache():
+    """metrics (or anything else made from a network), stored in the
+    datastore by the state of the network they were computed from. only the
+    most recent few are kept."""
+    max_entries = 8
+
+    def __init__(self, storage, file_name='network_metrics'):
+        self.storage = storage
+        self.path = storage.get_loc(file_name)
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return {}
+
+        with open(self.path, 'r') as f:
+            try:
+                return json.load(f)
+            except ValueError:
+                return {}
+
+    def get(self, cache_key):
+        return self.load().get(cache_key)
+
+    def set(self, cache_key, layers):
+        with self.storage.lock():
+            cache = self.load()
+            cache.pop(cache_key, None)
+            cache[cache_key] = layers
+
+            for old_key in list(cache)[:-self.max_entries]:
+                del cache[old_key]
+
+            with atomic_open(self.path) as f:
+                json.dump(cache, f)
@@ -2,35 +2,111 @@
 cache spacy
 @author: Carl Mueller
 """
-from functools import partial
-from cachetools import cached, Cache
-from cachetools.keys import hashkey
+import gc
+import json
+import threading
+from collections import OrderedDict
 import spacy
 
-@cached(Cache(1), key=partial(hashkey, 'spacy'))
-def load_spacy(model_name, **kwargs):
+from . profiling import get_memory_usage
+
+DEFAULT_MODEL = 'en_core_web_md'
+
+def get_model_version(model_name):
+    """the installed version of a model package, without loading it. None if
+    it isn't an installed package (eg, a path)."""
+    try:
+        return spacy.util.get_package_version(model_name)
+    except Exception:
+        return None
+
+class ModelRegistry():
+    """loaded spacy pipelines, keyed by name and loading options.
+
+    the least recently used pipeline is evicted when there are more than
+    `max_models`. when the process uses more than `max_bytes` of memory as
+    another pipeline is about to be loaded, one more is evicted first."""
+    def __init__(self, max_models=2, max_bytes=None):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self._models = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, key):
+        return key in self._models
+
+    @staticmethod
+    def get_key(model_name, **kwargs):
+        # options can be lists or dicts (eg, `disable`, `config`)
+        return (model_name, json.dumps(kwargs, sort_keys=True, default=str))
+
+    def load(self, model_name, **kwargs):
+        key = self.get_key(model_name, **kwargs)
+
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            # make room first, so the new pipeline doesn't have to fit
+            # alongside the ones it pushes out
+            self.evict(self.max_models - 1)
+            if self._models and self.over_budget():
+                self.evict(len(self._models) - 1)
+
+            print("Loading Spacy model '{}' into cache...".format(model_name))
+            nlp = spacy.load(model_name, **kwargs)
+            self._models[key] = nlp
+
+            return nlp
+
+    def evict(self, max_models):
+        """drops the least recently used pipelines until there are at most
+        `max_models`"""
+        with self._lock:
+            evicted = False
+            while len(self._models) > max(max_models, 0):
+                self._models.popitem(last=False)
+                evicted = True
+
+            # the pipelines' memory is only given back once their cycles
+            # are collected
+            if evicted:
+                gc.collect()
+
+    def over_budget(self):
+        if not self.max_bytes:
+            return False
+
+        memory_usage = get_memory_usage()
+        return memory_usage is not None and memory_usage > self.max_bytes
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+REGISTRY = ModelRegistry()
+
+def load_spacy(model_name=DEFAULT_MODEL, **kwargs):
     """
     Load a language-specific spaCy pipeline (collection of data, models, and
-    resources) for tokenizing, tagging, parsing, etc. text; the most recent
-    package loaded is cached.
+    resources) for tokenizing, tagging, parsing, etc. text; pipelines are
+    cached in `REGISTRY` by name and keyword arguments.
     Args:
-        name (str): standard 2-letter language abbreviation for a language;
-            currently, spaCy supports English ('en') and German ('de')
+        model_name (str): the name of (or path to) a spaCy pipeline, eg
+            'en_core_web_md' or 'es_core_news_md'
         **kwargs: keyword arguments passed to :func:`spacy.load`; see the
-            `spaCy docs <https://spacy.utils/docs#english>`_ for details
-            * via (str): non-default directory from which to load package data
-            * vocab
-            * tokenizer
-            * parser
-            * tagger
-            * entity
-            * matcher
-            * serializer
-            * vectors
+            `spaCy docs <https://spacy.io/api/top-level#spacy.load>`_ for
+            details
+            * disable
+            * exclude
+            * config
     Returns:
-        :class:`spacy.<lang>.<Language>`
+        :class:`spacy.language.Language`
     Raises:
-        RuntimeError: if package can't be loaded
+        OSError: if the pipeline can't be loaded
     """
-    print("Loading Spacy model into cache...")
-    return spacy.load(model_name, **kwargs)
+    return REGISTRY.load(model_name, **kwargs)
@@ -1,47 +1,408 @@
+import bisect
+import itertools
 import os
-from collections import defaultdict
+from collections import Counter, defaultdict
 import copy
+import hashlib
 import json
 import math
 import sys
 
+import numpy as np
+
+from . import attributes
 from . import entities
+from . profiling import PROFILER
+from . storage import atomic_open
 
 class TextNetwork():
-    def __init__(self, storage, file_names, entity_interface, accumulative=True, edge_threshold=50, edge_repeat_threshold=50, min_occurrences=3):
+    # how many states' spilled layers are kept in a datastore
+    max_spills = 8
+
+    def __init__(self, storage, file_names, entity_interface, accumulative=True, edge_threshold=50, edge_repeat_threshold=50, min_occurrences=3, build=True, weighting='count', decay_length=25, keep_matches=True, spill=False):
+        """
+        parameters:
+        - build: if False, the section networks aren't built (or kept) up
+          front; `iter_layers` makes them one at a time instead
+        - weighting: how edges are weighted (see `SectionNetwork`). every
+          weighting is swept when the network's built, so it can be switched
+          with `set_weighting` without resolving the matches again.
+        - decay_length: how many characters it takes the 'exponential'
+          weighting to decay by a factor of e
+        - keep_matches: if False, section networks don't copy (or hold on
+          to) their matches once their edges are made
+        - spill: if True, an unbuilt network's layers are written to the
+          datastore's `network_layers` directory as they're made, and read
+          back from there afterwards, so the matches aren't resolved again
+          and only one layer is in memory at a time
+        """
         self.storage = storage
+        self.file_names = list(file_names)
+        self.entity_interface = entity_interface
         self.accumulative = accumulative
         self.edge_threshold = edge_threshold
         self.edge_repeat_threshold = edge_repeat_threshold
+        self.weighting = weighting
+        self.decay_length = decay_length
+        self.build = build
+        self.keep_matches = keep_matches
+        self.spill = spill and not build
+
+        self._attributes = None
+        self._attribute_masks = None
+        self._node_keys = None
+        self._edge_arrays = {}
+
+        self.section_networks = None
+        self.built_source_state = None
+        if build:
+            self.rebuild()
+
+    def rebuild(self):
+        """(re)builds the section networks from the current annotations"""
+        self.section_networks = None
+        self._node_keys = None
+        self._edge_arrays = {}
 
-        self.section_networks = []
-        for file_name in file_names:
+        # the layers stay as they were built however the annotations (or
+        # matches) change afterwards, so they're identified by what they were
+        # built from
+        self.built_source_state = self.get_source_state()
+        self.section_networks = [section_network for _, section_network in self.iter_layers()]
+
+    def set_weighting(self, weighting):
+        """switches the weighting of the edges. built section networks have
+        already swept every weighting, so nothing is resolved again."""
+        if weighting not in WEIGHTINGS:
+            raise ValueError("unknown weighting '{}' (options: {})".format(weighting, ", ".join(WEIGHTINGS)))
+
+        self.weighting = weighting
+        for section_network in self.section_networks or []:
+            section_network.set_weighting(weighting)
+
+    def iter_layers(self):
+        """yields (file name, section network) for each section. if the
+        section networks weren't built up front, each one is made as it's
+        needed (or read back, if they were spilled) and only the previous one
+        is held on to."""
+        if self.section_networks is not None:
+            yield from zip(self.file_names, self.section_networks)
+        elif self.spill:
+            yield from self.iter_spilled_layers()
+        else:
+            yield from self.make_layers()
+
+    def make_layers(self):
+        """yields (file name, section network) for each section, made from
+        its matches"""
+        previous = None
+        for file_name in self.file_names:
             kwargs = {
                 'edge_threshold' : self.edge_threshold,
                 'edge_repeat_threshold' : self.edge_repeat_threshold,
+                'weighting' : self.weighting,
+                'decay_length' : self.decay_length,
+                'boundaries' : self.storage.boundaries.get(file_name),
+                'keep_matches' : self.keep_matches,
             }
 
-            if accumulative and bool(self.section_networks):
-                kwargs['existing_edges'] = self.section_networks[-1].edges
-                kwargs['existing_nodes'] = self.section_networks[-1].nodes
+            if self.accumulative and previous is not None:
+                kwargs['existing_nodes'] = previous.nodes
+                kwargs['previous'] = previous
 
             raw_matches = self.storage.raw_matches[file_name]
-            section_matches = entity_interface.add_entity_keys_to_matches(raw_matches)
+            section_matches = self.entity_interface.add_entity_keys_to_matches(
+                raw_matches,
+                section_name=file_name,
+            )
+
+            with PROFILER.stage('network.make_edges'):
+                previous = SectionNetwork(section_matches, **kwargs)
+
+            # unbuilt networks are remade for another weighting, so the
+            # sections before don't need to be kept
+            if not self.build:
+                previous.detach()
+
+            PROFILER.count('sections')
+            PROFILER.count('edges', len(previous.section_edges))
+            yield file_name, previous
+
+    @property
+    def spill_path(self):
+        return os.path.join(self.storage.get_loc('network_layers'), self.cache_key + '.jsonl')
+
+    def iter_spilled_layers(self):
+        """like `make_layers`, but the first time the layers are made they're
+        written to `spill_path` (one json line each), and after that they're
+        read from it as `SpilledLayer`s. spills of the most recent few states
+        are kept."""
+        path = self.spill_path
+        if os.path.isfile(path):
+            os.utime(path)
+            with open(path, 'r') as f:
+                nodes = set()
+                for line in f:
+                    layer = json.loads(line)
+                    nodes = (nodes if self.accumulative else set()) | set(layer['new_nodes'])
+                    yield layer['section'], SpilledLayer(nodes, layer['edges'], layer['section_edges'], self.weighting)
+
+            return
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        # if the layers aren't all made, nothing is written
+        with atomic_open(path) as f:
+            previous_nodes = set()
+            for file_name, section_network in self.make_layers():
+                f.write(json.dumps({
+                    'section' : file_name,
+                    'new_nodes' : sorted(section_network.nodes - previous_nodes),
+                    'edges' : section_network.edges,
+                    'section_edges' : section_network.section_edges,
+                }) + '\n')
+
+                if self.accumulative:
+                    previous_nodes = section_network.nodes
+
+                yield file_name, section_network
+
+        spills = sorted(
+            (os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.jsonl')),
+            key=os.path.getmtime,
+        )
+
+        for spill_path in spills[:-self.max_spills]:
+            os.remove(spill_path)
+
+    def get_layer(self, section=-1):
+        """(file name, section network) for a section's name or index"""
+        if not isinstance(section, int):
+            section = self.file_names.index(section)
+
+        section %= len(self.file_names)
+        if self.section_networks is not None:
+            return self.file_names[section], self.section_networks[section]
+
+        for i, layer in enumerate(self.iter_layers()):
+            if i == section:
+                return layer
 
-            self.section_networks.append(
-                SectionNetwork(section_matches, **kwargs)
+    @property
+    def node_keys(self):
+        """every node in any layer, sorted. edge arrays and attribute masks
+        index nodes by their position here."""
+        if self._node_keys is None or self.section_networks is None:
+            nodes = set()
+            for _, section_network in self.iter_layers():
+                nodes |= section_network.nodes
+
+            self._node_keys = sorted(nodes)
+
+        return self._node_keys
+
+    @property
+    def attributes(self):
+        """the entities' attributes (see `attributes.AttributeStore`)"""
+        if self._attributes is None:
+            self._attributes = attributes.AttributeStore(self.storage)
+
+        return self._attributes
+
+    @property
+    def attribute_masks(self):
+        """the attributes compiled over `node_keys`. recompiled if the
+        attributes or the nodes change (an unbuilt network's nodes follow the
+        annotations)."""
+        state = (self.attributes.attributes_file_contents, self.node_keys)
+        if self._attribute_masks is None or self._attribute_masks[0] != state:
+            self._attribute_masks = (state, self.attributes.compile(state[1]))
+
+        return self._attribute_masks[1]
+
+    def node_attributes(self):
+        """node -> {attribute: value} for the nodes with attributes. several
+        values are joined with commas."""
+        node_attributes = {}
+        for a in self.attributes.attributes:
+            values = node_attributes.setdefault(a.key, {})
+            values[a.attribute] = ", ".join(filter(None, [values.get(a.attribute), a.value]))
+
+        return node_attributes
+
+    def get_edge_arrays(self, section=-1, masks=None):
+        """a layer's edges (in the current weighting) as arrays of indexes
+        into `masks.keys` (the current `attribute_masks` if not given) and
+        weights: (ones, twos, weights)"""
+        file_name, section_network = self.get_layer(section)
+        cache_key = (file_name, self.weighting)
+
+        if cache_key not in self._edge_arrays or self.section_networks is None:
+            edges = section_network.edges
+            if masks is None:
+                masks = self.attribute_masks
+
+            self._edge_arrays[cache_key] = (
+                masks.get_indexes([one for one, _, _ in edges]),
+                masks.get_indexes([two for _, two, _ in edges]),
+                np.asarray([weight for _, _, weight in edges]),
             )
 
+        return self._edge_arrays[cache_key]
+
+    def subnetwork(self, section=-1, **filters):
+        """a layer's edges between entities which pass the attribute filters,
+        eg `subnetwork(gender='female', faction=['montagues', 'capulets'])`.
+        returns [one, two, weight] lists."""
+        # the edges are indexed over the same nodes as the masks, which an
+        # unbuilt network finds again each time
+        masks = self.attribute_masks
+        ones, twos, weights = self.get_edge_arrays(section, masks)
+        mask = masks.get_mask(filters)
+
+        keep = np.flatnonzero(mask[ones] & mask[twos])
+        node_keys = masks.keys
+        return [[node_keys[ones[i]], node_keys[twos[i]], weights[i].item()] for i in keep]
+
+    def attribute_network(self, attribute, section=-1, **filters):
+        """a layer's edges summed up by the values of an attribute: an edge
+        between 'montagues' and 'capulets' weighs as much as every edge
+        between a montague and a capulet. edges between entities with the
+        same value are summed into a self loop. entities can be filtered
+        first, like in `subnetwork`. returns [value, value, weight] lists."""
+        masks = self.attribute_masks
+        ones, twos, weights = self.get_edge_arrays(section, masks)
+        mask = masks.get_mask(filters)
+
+        keep = mask[ones] & mask[twos]
+        ones, twos, weights = ones[keep], twos[keep], weights[keep]
+
+        values = masks.values.get(attribute, [])
+        value_masks = masks.masks.get(attribute)
+
+        edges = []
+        for i, value_one in enumerate(values):
+            for j in range(i, len(values)):
+                both = value_masks[i][ones] & value_masks[j][twos]
+                if i != j:
+                    both |= value_masks[j][ones] & value_masks[i][twos]
+
+                if both.any():
+                    edges.append([value_one, values[j], weights[both].sum().item()])
+
+        return edges
+
+    def export(self, f, format='csv', **kwargs):
+        """writes the layers to the file handle `f`, one at a time. formats
+        (see `export`): csv, graphml, gexf, webweb"""
+        from . import export
+        export.EXPORTERS[format](self.iter_layers(), f, **kwargs)
+
+    def get_source_state(self):
+        """the annotations, what the matches were made with and how their
+        overlaps are resolved, and each section's content and matches, as
+        they are now. a section's match version changes whenever its raw
+        matches are saved (see `storage.TextDatastore.save_raw_matches`)."""
+        metadata = self.storage.metadata
+        match_hashes = metadata.get('file_match_hashes', {})
+        match_versions = metadata.get('file_match_versions', {})
+        return {
+            'annotations' : self.entity_interface.annotations_hash,
+            'matched_with' : metadata.get('matched_with'),
+            'overlap_policy' : self.storage.overlap_policy,
+            'sections' : [[f, match_hashes.get(f), match_versions.get(f)] for f in self.file_names],
+        }
+
+    @property
+    def cache_key(self):
+        """identifies the state this network was built from (see
+        `get_source_state`) and the network's settings. unbuilt
+        networks are made from the current annotations and matches."""
+        if self.section_networks is not None:
+            state = dict(self.built_source_state)
+        else:
+            state = self.get_source_state()
+
+        state.update({
+            'accumulative' : self.accumulative,
+            'edge_threshold' : self.edge_threshold,
+            'edge_repeat_threshold' : self.edge_repeat_threshold,
+            'weighting' : self.weighting,
+        })
+
+        if self.weighting == 'exponential':
+            state['decay_length'] = self.decay_length
+
+        return hashlib.sha224(json.dumps(state, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def metrics(self, betweenness=False, betweenness_samples=None, seed=0, use_cache=True):
+        """metrics for each section's layer (see `metrics.NetworkMetrics`).
+        results are cached in the datastore next to the network's state."""
+        from . import metrics
+        settings = {
+            'betweenness' : betweenness,
+            'betweenness_samples' : betweenness_samples,
+            'seed' : seed,
+        }
+
+        cache = metrics.MetricsCache(self.storage)
+        cache_key = self.cache_key + json.dumps(settings, sort_keys=True)
+
+        if use_cache:
+            layers = cache.get(cache_key)
+            if layers is not None:
+                return layers
+
+        layers = metrics.NetworkMetrics(self).compute(**settings)
+        cache.set(cache_key, layers)
+        return layers
+
+WEIGHTINGS = ['count', 'exponential', 'linear', 'sentence', 'paragraph', 'pmi']
+
 class SectionNetwork():
-    """a network of a text section."""
+    """a network of a text section.
+
+    every weighting is computed in the same sweep over the (sorted) matches,
+    so `set_weighting` only changes which one `edges` holds:
+    - count: co-occurrences within `edge_threshold` characters (repeats within
+      `edge_repeat_threshold` aren't counted twice)
+    - exponential: like count, but each co-occurrence adds
+      exp(-distance / decay_length)
+    - linear: like count, but each co-occurrence adds
+      1 - distance / (edge_threshold + 1)
+    - sentence/paragraph: how many sentences/paragraphs both are in. these
+      need the section's boundaries, which are recorded when it's matched.
+    - pmi: the count's pointwise mutual information, given how often each
+      entity is mentioned
+    """
     def __init__(self, matches, edge_threshold=50, edge_repeat_threshold=50,
                  existing_edges=list(),
-                 existing_nodes=set()
+                 existing_nodes=set(),
+                 weighting='count',
+                 decay_length=25,
+                 boundaries=None,
+                 previous=None,
+                 keep_matches=True,
                  ):
+        """
+        parameters:
+        - previous: the previous section's network, to accumulate the weights
+          of (rather than `existing_edges`, which only has one weighting's)
+        - keep_matches: if False, the matches aren't copied, and they're let
+          go of once the edges are made (`matches` is None)
+        """
+        if keep_matches:
+            matches = copy.deepcopy(matches)
 
-        self.matches = sorted(copy.deepcopy(matches), key=lambda m: m['start'])
-        self.edge_threshold = 50
-        self.edge_repeat_threshold = 50
+        self.matches = sorted(matches, key=lambda m: m['start'])
+        self.edge_threshold = edge_threshold
+        self.edge_repeat_threshold = edge_repeat_threshold
+        self.decay_length = decay_length
+        self.boundaries = boundaries or {}
+        self.weighting = weighting
+        self.previous = previous
+        self.detached = False
 
         self.nodes = {e.key for e in self.matches}
 
@@ -51,51 +412,226 @@ class SectionNetwork():
 
         self.edges = self.make_edges(self.matches, existing_edges)
 
-    def make_edges(self, matches, existing_edges):
-        edges_dict = defaultdict(defaultdict(int).copy)
+        if not keep_matches:
+            self.matches = None
+
+    @property
+    def additive(self):
+        """whether a section's edges can be added to the previous ones' (pmi
+        changes as mentions accumulate)"""
+        return self.weighting != 'pmi'
+
+    def make_edges(self, matches, existing_edges=list()):
+        """sweeps the matches once for every weighting and returns the edges
+        of this network's"""
+        self.section_weights, self.section_mentions = self.sweep(matches)
+
+        self.mentions = self.section_mentions
+        if self.previous is not None:
+            self.mentions = self.previous.mentions + self.section_mentions
+
+        # accumulated weights and edges, by weighting, made as they're needed
+        self._weights = {}
+        self._edges = {}
+        self._existing_edges = (self.weighting, existing_edges)
+
+        self.set_weighting(self.weighting)
+        return self.edges
+
+    def detach(self):
+        """lets go of the previous section's network. weightings that haven't
+        been used can't be switched to afterwards."""
+        self.previous = None
+        self.detached = True
+
+    def set_weighting(self, weighting):
+        """switches `edges` and `section_edges` to another weighting. each
+        weighting's edges are only made once."""
+        if weighting not in WEIGHTINGS:
+            raise ValueError("unknown weighting '{}' (options: {})".format(weighting, ", ".join(WEIGHTINGS)))
+
+        if weighting not in self._edges:
+            self._edges[weighting] = self.get_edges(weighting)
+
+        self.weighting = weighting
+
+        # the edges made from this section alone, as [one, two, weight]. for
+        # pmi, they're this section's pairs with their accumulated weight.
+        self.edges, self.section_edges = self._edges[weighting]
+
+    def get_weights(self, weighting):
+        """the weights of a (swept) weighting, accumulated over this section
+        and the previous ones, as {(one, two): weight}"""
+        # walk back to the last section that has them (or the first section)
+        # rather than recursing, since texts can have many sections
+        chain = [self]
+        while weighting not in chain[-1]._weights and chain[-1].previous is not None:
+            chain.append(chain[-1].previous)
+
+        for section_network in reversed(chain):
+            if weighting in section_network._weights:
+                continue
+
+            if section_network.detached:
+                raise ValueError("the '{}' weighting can't be made once the previous sections are gone".format(weighting))
+
+            if section_network.previous is not None:
+                weights = dict(section_network.previous._weights[weighting])
+            else:
+                existing_weighting, existing_edges = section_network._existing_edges
+                weights = {}
+                if existing_weighting == weighting:
+                    weights = {(one, two): weight for one, two, weight in existing_edges}
+
+            for pair, weight in section_network.section_weights[weighting].items():
+                weights[pair] = weights.get(pair, 0) + weight
 
-        # add edges in from previous sections if passed
-        for entity_one, entity_two, weight in existing_edges:
-            edges_dict[entity_one][entity_two] = weight
+            section_network._weights[weighting] = weights
+
+        return self._weights[weighting]
+
+    def get_edges(self, weighting):
+        """returns (edges, section edges) lists of [one, two, weight]"""
+        if weighting == 'pmi':
+            weights = self.get_pmi(self.get_weights('count'), self.mentions)
+            section_weights = {pair: weights[pair] for pair in self.section_weights['count']}
+        else:
+            weights = self.get_weights(weighting)
+            section_weights = self.section_weights[weighting]
+
+        def edge_list(weights):
+            edges = []
+            for (entity_one, entity_two), edge_weight in weights.items():
+                if edge_weight or weighting == 'pmi':
+                    if isinstance(edge_weight, float):
+                        edge_weight = round(edge_weight, 6)
+
+                    edges.append([entity_one, entity_two, edge_weight])
+
+            return edges
+
+        return edge_list(weights), edge_list(section_weights)
+
+    @staticmethod
+    def get_pmi(counts, mentions):
+        """log(p(one, two) / (p(one) * p(two))), with co-occurrences as the
+        joint and mentions as the marginal distribution"""
+        total_counts = sum(counts.values())
+        total_mentions = sum(mentions.values())
+
+        pmi = {}
+        for (one, two), count in counts.items():
+            if count:
+                pmi[(one, two)] = math.log(
+                    count * total_mentions * total_mentions / (total_counts * mentions[one] * mentions[two])
+                )
+
+        return pmi
+
+    def sweep(self, matches):
+        """returns ({weighting: {(one, two): weight}}, mentions) for the
+        matches, which must be sorted by start"""
+        counts = defaultdict(int)
+        exponential = defaultdict(float)
+        linear = defaultdict(float)
+        mentions = Counter()
+
+        sentences = CoPresence(self.boundaries.get('sentences'))
+        paragraphs = CoPresence(self.boundaries.get('paragraphs'))
 
         # dict for tracking edge thresholds for smoothing.
         # heuristic to avoid multi-counting
         block_until = defaultdict(defaultdict(int).copy)
 
-        for i, first in enumerate(matches[:-1]):
+        for i, first in enumerate(matches):
+            mentions[first.key] += 1
+            sentences.add(first)
+            paragraphs.add(first)
+
             for second in matches[i + 1:]:
                 match_start = min(first.start, second.start)
                 match_end = max(first.end, second.end)
+                distance = second.start - first.end
 
                 # don't make an edge out of the threshold
                 # don't evaluate further `seconds` for this `first` if the
                 # `second` is out of range
-                if second.start - first.end > self.edge_threshold:
+                if distance > self.edge_threshold:
                     break
 
                 # at this point, we have a possible edge, so to make the
-                # dictionaries easier, sort by key
-                if first.key > second.key:
-                    first, second = second, first
+                # dictionaries easier, sort by key (without rebinding
+                # `first`, which the rest of this sweep is still about)
+                one, two = sorted((first.key, second.key))
 
                 # don't repeat edges within a threshold
-                if match_start < block_until[first.key][second.key]:
+                if match_start < block_until[one][two]:
                     continue
 
                 # don't make edges between the same node
-                if first.key == second.key:
+                if one == two:
                     continue
-                
-                edges_dict[first.key][second.key] += 1
-                block_until[first.key][second.key] = match_end + self.edge_repeat_threshold
 
-        edges = []
-        for entity_one, entity_one_edges in edges_dict.items():
-            for entity_two, edge_weight in entity_one_edges.items():
-                if edge_weight:
-                    edges.append([entity_one, entity_two, edge_weight])
+                pair = (one, two)
+                distance = max(distance, 0)
+                counts[pair] += 1
+                exponential[pair] += math.exp(-distance / self.decay_length)
+                linear[pair] += 1 - distance / (self.edge_threshold + 1)
+                block_until[one][two] = match_end + self.edge_repeat_threshold
 
-        return edges
+        weights = {
+            'count' : counts,
+            'exponential' : exponential,
+            'linear' : linear,
+            'sentence' : sentences.finish(),
+            'paragraph' : paragraphs.finish(),
+        }
+
+        return weights, mentions
+
+class SpilledLayer():
+    """a section's layer as `TextNetwork` spilled it: a section network's
+    nodes and edges (in the weighting it was spilled in), without anything
+    to make them again from"""
+    def __init__(self, nodes, edges, section_edges, weighting):
+        self.nodes = nodes
+        self.edges = edges
+        self.section_edges = section_edges
+        self.weighting = weighting
+
+    @property
+    def additive(self):
+        return self.weighting != 'pmi'
+
+class CoPresence():
+    """counts how many units (sentences, paragraphs) each pair of keys shares.
+    matches are added in order, so the unit only ever moves forward."""
+    def __init__(self, starts):
+        self.starts = starts or []
+        self.weights = defaultdict(int)
+        self.unit = None
+        self.keys = set()
+
+    def add(self, match):
+        if not self.starts:
+            return
+
+        unit = bisect.bisect_right(self.starts, match.start, lo=self.unit or 0)
+        if unit != self.unit:
+            self.flush()
+            self.unit = unit
+
+        self.keys.add(match.key)
+
+    def flush(self):
+        for pair in itertools.combinations(sorted(self.keys), 2):
+            self.weights[pair] += 1
+
+        self.keys = set()
+
+    def finish(self):
+        self.flush()
+        return self.weights
 
 class Graphify:
     def should_regenerate(self):
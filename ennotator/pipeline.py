@@ -0,0 +1,126 @@
+"""
+matches sections in stages that run at the same time:
+
+    readers (threads) -> nlp (the calling thread) -> writer (a thread)
+
+the readers read (and parse the html of) sections ahead of the nlp stage,
+which parses them in batches with `nlp.pipe`, and the writer saves the
+matches while the next sections are parsed.
+
+the stages are connected by bounded queues, so only so many sections are
+held in memory however far one stage gets ahead of another, and the
+sections are written in the order they were given.
+"""
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+class Writer(threading.Thread):
+    """calls `write` with lists of items on its own thread. whatever has
+    queued up by the time the last write finishes is written together, so
+    a slow write doesn't hold the other stages up for long."""
+    DONE = object()
+
+    def __init__(self, write, queue_size=16):
+        super().__init__(daemon=True)
+        self.write = write
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+
+    def put(self, item):
+        if self.error is not None:
+            raise self.error
+
+        self.queue.put(item)
+
+    def run(self):
+        done = False
+        while not done:
+            items = [self.queue.get()]
+            while items[-1] is not self.DONE:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if items[-1] is self.DONE:
+                done = True
+                items.pop()
+
+            # after an error, keep taking items so nothing waits on the
+            # queue, but don't write them
+            if items and self.error is None:
+                try:
+                    self.write(items)
+                except BaseException as e:
+                    self.error = e
+
+    def finish(self, raise_error=True):
+        """waits for everything queued to be written"""
+        self.queue.put(self.DONE)
+        self.join()
+
+        if raise_error and self.error is not None:
+            raise self.error
+
+class MatchPipeline():
+    def __init__(self, entity_matcher, read, write, readers=2, batch_size=8, queue_size=16):
+        """
+        parameters:
+        - entity_matcher: a `matcher.EntityMatchObject`
+        - read: returns a section's text, given its name. called from reader
+          threads.
+        - write: saves a list of (name, matches, boundaries). called from
+          the writer thread.
+        - readers: how many sections are read at once
+        - batch_size: how many sections `nlp.pipe` parses together
+        - queue_size: how many sections can wait to be parsed, and how many
+          results can wait to be written
+        """
+        self.entity_matcher = entity_matcher
+        self.read = read
+        self.write = write
+        self.readers = readers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    def read_ahead(self, names):
+        """yields (text, name) in order, with up to `queue_size` sections
+        being read (or waiting) ahead"""
+        with ThreadPoolExecutor(max_workers=self.readers) as executor:
+            pending = deque()
+            try:
+                for name in names:
+                    pending.append((executor.submit(self.read, name), name))
+
+                    if len(pending) >= self.queue_size:
+                        future, pending_name = pending.popleft()
+                        yield future.result(), pending_name
+
+                while pending:
+                    future, pending_name = pending.popleft()
+                    yield future.result(), pending_name
+            finally:
+                for future, _ in pending:
+                    future.cancel()
+
+    def run(self, names):
+        """matches the named sections, writing them in order"""
+        writer = Writer(self.write, self.queue_size)
+        writer.start()
+
+        try:
+            results = self.entity_matcher.pipe_matches(
+                self.read_ahead(names),
+                batch_size=self.batch_size,
+            )
+
+            for matches, boundaries, name in results:
+                writer.put((name, matches, boundaries))
+        except BaseException:
+            # save what was matched, so it isn't redone
+            writer.finish(raise_error=False)
+            raise
+
+        writer.finish()
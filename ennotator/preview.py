@@ -0,0 +1,114 @@
+"""
+a first look at a text, from a sample of its sections.
+
+the sample is matched first, and a provisional network and candidate index
+are made from it. the rest of the sections are then matched in the
+background, in rounds that each double the sample, and the network and
+candidates are remade after each round.
+
+everything goes through `TextReader.load_matches`, so matches are saved to
+the datastore as usual: a section matched for the preview is never matched
+again, and an interrupted preview picks up where it left off. sections record
+the entities and aliases their matches were made from, so labeling while the
+preview refines (or exiting before it's done) doesn't leave any section's
+matches stale.
+
+the background matching shares the datastore and entities with the rest of
+the process, so both sides change them under `storage.lock()`.
+"""
+import threading
+
+from . import network
+
+class Preview():
+    def __init__(self, storage, reader, entity_interface, fraction=.2, network_kwargs=None, **match_kwargs):
+        """
+        parameters:
+        - fraction: how much of the text the first sample is, between 0 and 1
+        - network_kwargs: passed to `network.TextNetwork` (eg, a memory
+          budget's; see `budget.MemoryBudget.network_kwargs`)
+        - match_kwargs: passed to `TextReader.load_matches`
+        """
+        if not 0 < fraction <= 1:
+            raise ValueError("a preview's fraction has to be between 0 and 1, not {}".format(fraction))
+
+        self.storage = storage
+        self.reader = reader
+        self.entity_interface = entity_interface
+        self.fraction = fraction
+        self.network_kwargs = network_kwargs or {}
+        self.match_kwargs = match_kwargs
+
+        self.sections = []
+        self.network = None
+        self.candidates = None
+        self.error = None
+
+        self._thread = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def rounds(self):
+        """the sections to match in each round, as fractions of the text"""
+        fraction = self.fraction
+        while fraction < 1:
+            yield fraction
+            fraction *= 2
+
+        yield 1
+
+    def start(self):
+        """matches the first sample and starts refining in the background"""
+        rounds = self.rounds
+        self.match(self.reader.get_sample(self.reader.ordered_content_files, next(rounds)))
+
+        self._thread = threading.Thread(target=self.refine, args=(rounds,), daemon=True)
+        self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        """waits for every section to be matched. returns whether they were.
+        raises whatever stopped the refinement, if anything did."""
+        self._done.wait(timeout)
+
+        if self.error is not None:
+            raise self.error
+
+        return self.done
+
+    def refine(self, rounds):
+        try:
+            for fraction in rounds:
+                self.match(self.reader.get_sample(self.reader.ordered_content_files, fraction))
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._done.set()
+
+    def match(self, sections):
+        """matches the sections (those that aren't already) and remakes the
+        network and candidates from every section matched so far"""
+        sections = [f for f in sections if f not in self.sections]
+
+        # `load_matches` takes the datastore's lock for what it changes, but
+        # not while spacy parses
+        self.reader.load_matches(
+            entities_with_aliases=self.entity_interface.get_entities_with_aliases(),
+            sections=sections,
+            **self.match_kwargs
+        )
+
+        with self.storage.lock():
+            matched = set(self.sections) | set(sections)
+            sections = [f for f in self.reader.ordered_content_files if f in matched]
+
+            text_network = network.TextNetwork(self.storage, sections, self.entity_interface, **self.network_kwargs)
+            all_matches = [m for f in sections for m in self.storage.get_matches(f)]
+            candidates = self.entity_interface.candidate_index(all_matches)
+
+        # swapped in together, once they're made
+        self.sections, self.network, self.candidates = sections, text_network, candidates
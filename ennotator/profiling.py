@@ -0,0 +1,248 @@
+"""
+lightweight timers and counters for the stages of a run.
+
+    from . profiling import PROFILER
+
+    with PROFILER.stage('matcher.nlp'):
+        doc = nlp(text)
+
+    PROFILER.count('mentions', len(matches))
+
+when the profiler is disabled (the default) `stage` returns a shared do-nothing
+context manager and `count` returns immediately, so instrumentation costs a
+method call.
+
+stages can be timed from any thread (a stage's time adds up across threads).
+when enabled, it can also run cProfile and track peak memory per stage, for
+stages on the main thread: python's allocations with tracemalloc
+(`trace_memory`), and the process's resident memory (`track_rss`, which is
+cheap enough to leave on for a whole run). `write_report` puts a json report
+(and the cProfile stats) in the datastore's `reports` directory.
+"""
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+NULL_STAGE = nullcontext()
+
+def get_memory_usage():
+    """the process's resident memory in bytes, or None if it can't be told"""
+    if psutil:
+        return psutil.Process().memory_info().rss
+
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def get_peak_memory_usage():
+    """the process's peak resident memory in bytes since
+    `reset_peak_memory_usage`. where that isn't recorded (outside linux), it's
+    the current resident memory."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    return get_memory_usage()
+
+def reset_peak_memory_usage():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+class MemoryTracer():
+    """the peak of a measure of memory, per stage. the peak is for the whole
+    process, so it can only be split into nested stages on one thread.
+
+    parameters:
+    - field: what the peaks are called in the report
+    - get_peak: returns the peak since the last `reset_peak`
+    """
+    def __init__(self, field, get_peak, reset_peak):
+        self.field = field
+        self.get_peak = get_peak
+        self.reset_peak = reset_peak
+        self.peaks = {}
+        self._stack = []
+
+    def enter(self):
+        """the peak so far belongs to the enclosing stage; start a new one"""
+        if self._stack:
+            self._stack[-1] = max(self._stack[-1], self.get_peak() or 0)
+
+        self.reset_peak()
+        self._stack.append(0)
+
+    def exit(self, name):
+        peak = max(self._stack.pop(), self.get_peak() or 0)
+        self.peaks[name] = max(self.peaks.get(name, 0), peak)
+
+        # whatever this stage peaked at, its enclosing stage did too
+        if self._stack:
+            self._stack[-1] = max(self._stack[-1], peak)
+
+        self.reset_peak()
+
+class Profiler():
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.cprofile = None
+        self._started_tracemalloc = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.seconds = defaultdict(float)
+        self.calls = Counter()
+        self.counters = Counter()
+        self.memory_tracers = []
+
+    def enable(self, cprofile=False, trace_memory=False, track_rss=False):
+        """starts a new profile (the last one's timings and stats are
+        dropped)"""
+        if self.enabled:
+            self.disable()
+
+        self.reset()
+        self.enabled = True
+
+        # a fresh cProfile each time, so stats don't add up across runs
+        self.cprofile = cProfile.Profile() if cprofile else None
+        if self.cprofile:
+            self.cprofile.enable()
+
+        self.trace_memory = trace_memory
+        if trace_memory:
+            # tracemalloc is only stopped again if it's started here
+            self._started_tracemalloc = not tracemalloc.is_tracing()
+            if self._started_tracemalloc:
+                tracemalloc.start()
+
+            self.memory_tracers.append(MemoryTracer(
+                'peak_bytes',
+                lambda: tracemalloc.get_traced_memory()[1],
+                tracemalloc.reset_peak,
+            ))
+
+        if track_rss:
+            self.memory_tracers.append(MemoryTracer('peak_rss', get_peak_memory_usage, reset_peak_memory_usage))
+
+    def disable(self):
+        self.enabled = False
+
+        if self.cprofile:
+            self.cprofile.disable()
+
+        if self.trace_memory:
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+
+            self._started_tracemalloc = False
+            self.trace_memory = False
+
+    def stage(self, name):
+        """a context manager which times (and, if tracking memory, records the
+        peak memory of) a stage"""
+        if not self.enabled:
+            return NULL_STAGE
+
+        return Stage(self, name)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def report(self):
+        report = {
+            'stages' : {
+                name: {
+                    'seconds' : self.seconds[name],
+                    'calls' : self.calls[name],
+                } for name in self.seconds
+            },
+            'counters' : dict(self.counters),
+        }
+
+        for tracer in self.memory_tracers:
+            for name, peak in tracer.peaks.items():
+                report['stages'][name][tracer.field] = peak
+
+        return report
+
+    def write_report(self, storage, name=None):
+        """writes the report (and cProfile stats, if any) to the datastore's
+        `reports` directory. returns the report's path. reports are never
+        overwritten: a name that's taken gets a number after it."""
+        from . storage import atomic_open
+        directory = storage.get_loc('reports')
+        os.makedirs(directory, exist_ok=True)
+
+        name = name or '{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+
+        # the name is claimed by creating its file, so runs that finish at
+        # the same time can't both take it
+        base_name, number = name, 1
+        while True:
+            path = os.path.join(directory, name + '.json')
+            try:
+                open(path, 'x').close()
+                break
+            except FileExistsError:
+                number += 1
+                name = '{}-{}'.format(base_name, number)
+
+        with atomic_open(path) as f:
+            json.dump(self.report(), f, indent=4)
+
+        if self.cprofile:
+            self.cprofile.create_stats()
+            pstats.Stats(self.cprofile).dump_stats(os.path.join(directory, name + '.prof'))
+
+        return path
+
+class Stage():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+        self.memory_tracers = []
+        if threading.current_thread() is threading.main_thread():
+            self.memory_tracers = profiler.memory_tracers
+
+    def __enter__(self):
+        for tracer in self.memory_tracers:
+            tracer.enter()
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        seconds = time.perf_counter() - self.start
+        with self.profiler._lock:
+            self.profiler.seconds[self.name] += seconds
+            self.profiler.calls[self.name] += 1
+
+        for tracer in self.memory_tracers:
+            tracer.exit(self.name)
+
+PROFILER = Profiler()
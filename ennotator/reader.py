@@ -1,8 +1,15 @@
 import os
 import copy
+import hashlib
+import json
+import math
+import threading
 from pathlib import Path
 
+from . import automaton
 from . import matcher
+from . import pipeline
+from . profiling import PROFILER
 
 # - ordering: list of strings, which if supplied, will be used to
 #   determine the order the content is read in
@@ -25,14 +32,42 @@ class TextReader():
         """
         self.storage = storage
 
+        self._ebook = None
+        self._ebook_lock = threading.Lock()
+        self.sources = {}
+        self.section_hashes = {}
+
         stored_textobject = self.storage.metadata.get('TextObject')
         if stored_textobject:
             self.load_from_storage(stored_textobject)
+
+            # the source was replaced (eg, a new edition), so the file list
+            # might have changed too
+            if self.is_ebook and self.changed_sources:
+                self.load_from_path(path or self.absolute_files[0])
+            elif path and self.changed_sources:
+                self.load_from_path(path)
         else:
             self.load_from_path(path)
 
+        self.update_section_hashes()
         self.update_storage()
 
+    @staticmethod
+    def get_ordered_content_files(metadata):
+        """the ordered content files recorded in a datastore's metadata,
+        without a reader (or the text) and without changing the metadata"""
+        ordering = metadata['files']['ordering']
+        exclusions = metadata['files']['exclusions']
+        files = metadata.get('TextObject', {}).get('files', [])
+
+        ordered_content = list(ordering)
+        for file_name in files:
+            if file_name not in exclusions and file_name not in ordering:
+                ordered_content.append(file_name)
+
+        return ordered_content
+
     @property
     def ordered_content_files(self):
         ordered_content = self.storage.metadata['files']['ordering']
@@ -47,27 +82,203 @@ class TextReader():
 
         return ordered_content
 
-    def load_matches(self, reload=False, entities_with_aliases=None):
-        entity_matcher = matcher.EntityMatchObject(entities_with_aliases)
+    @staticmethod
+    def get_sample(file_names, fraction=.2, min_sections=1):
+        """a deterministic, stratified sample of the files: they're split into
+        equal runs, and the middle file of each run is taken. the sample is
+        in the files' order."""
+        file_names = list(file_names)
+        n = len(file_names)
+        k = min(n, max(min_sections, math.ceil(n * fraction)))
+
+        return [file_names[int((i + .5) * n / k)] for i in range(k)]
+
+    def track_match_hashes(self):
+        """records the content hash of sections that were matched before
+        their hashes were tracked. their matches are assumed to be current."""
+        match_hashes = self.storage.metadata.setdefault('file_match_hashes', {})
+
         for file_name in self.ordered_content_files:
-            raw_matches = self.storage.raw_matches.get(file_name, None)
-            if raw_matches is None or reload:
-                file_text = self.get_file_content(file_name)
-                raw_matches = entity_matcher.get_matches(file_text)
+            section_hash = self.section_hashes.get(file_name)
+            if section_hash is not None and match_hashes.get(file_name) is None and file_name in self.storage.raw_matches:
+                match_hashes[file_name] = section_hash
+
+    @property
+    def stale_sections(self):
+        """sections whose content changed since they were last matched.
+        sections whose match hash isn't tracked yet aren't stale (see
+        `track_match_hashes`)."""
+        match_hashes = self.storage.metadata.get('file_match_hashes', {})
+
+        stale_sections = []
+        for file_name in self.ordered_content_files:
+            section_hash = self.section_hashes.get(file_name)
+            match_hash = match_hashes.get(file_name)
+
+            # we can't read the section, so we can't tell
+            if section_hash is None:
+                continue
+
+            if match_hash is None and file_name in self.storage.raw_matches:
+                continue
+
+            if match_hash != section_hash:
+                stale_sections.append(file_name)
+
+        return stale_sections
+
+    def load_matches(self, reload=False, entities_with_aliases=None, rematch=False, overlap_policy='longest', sections=None, readers=2, batch_size=8, queue_size=16):
+        """matches the sections that need it:
+        - all of them if `reload` is True
+        - those without matches
+        - those whose content changed since they were matched
+        - those matched with another model
+
+        sections are read, parsed and saved in a pipeline (see
+        `pipeline.MatchPipeline` for the parameters).
+
+        the entity and alias matches of the other sections are remade without
+        spacy (see `rematch_entities`) if they were made from other entities
+        and aliases. each section records the ones its matches were made
+        from, so a section that wasn't reached is still remade next time.
+        sections matched before that was recorded are remade if `rematch` is
+        True.
+
+        overlapping matches are all saved, and resolved with `overlap_policy`
+        when they're read (see `matcher.resolve_overlaps`), so changing it
+        doesn't remake any matches.
+
+        if `sections` is given, only those sections are looked at.
+        """
+        if overlap_policy not in matcher.OVERLAP_POLICIES:
+            raise ValueError("unknown overlap policy '{}' (options: {})".format(overlap_policy, ", ".join(matcher.OVERLAP_POLICIES)))
+
+        entities_with_aliases = entities_with_aliases or {}
+        aliases_hash = self.get_aliases_hash(entities_with_aliases)
+        entity_matcher = matcher.EntityMatchObject(entities_with_aliases, self.storage.model_name)
+
+        # the metadata is shared with whatever else has the datastore open
+        # (eg, a preview's matching, or labeling)
+        with self.storage.lock():
+            self.track_match_hashes()
+            match_hashes = self.storage.metadata['file_match_hashes']
+            alias_hashes = self.storage.metadata.setdefault('file_alias_hashes', {})
+            self.storage.metadata['overlap_policy'] = overlap_policy
+
+            # matches made with another model (or version of the matcher) are
+            # remade. they're marked stale first, so if we're interrupted the
+            # rest are still remade. matches from before this was recorded
+            # were made by the first version of the matcher. the overlap
+            # policy used to be recorded with them, but doesn't change them.
+            signature = entity_matcher.signature
+            matched_with = self.storage.metadata.setdefault('matched_with', dict(signature, matcher=1))
+            matched_with = {k: v for k, v in matched_with.items() if k != 'overlap_policy'}
+            if matched_with != signature:
+                for file_name in self.ordered_content_files:
+                    match_hashes[file_name] = ''
+
+                self.storage.metadata['matched_with'] = signature
+
+            stale_sections = set(self.stale_sections)
+
+            file_names = []
+            rematch_file_names = []
+            for file_name in self.ordered_content_files:
+                if sections is not None and file_name not in sections:
+                    continue
+
+                if reload or file_name in stale_sections or file_name not in self.storage.raw_matches:
+                    file_names.append(file_name)
+                elif alias_hashes.get(file_name) is None and not rematch:
+                    # matched before this was recorded, from these aliases
+                    alias_hashes[file_name] = aliases_hash
+                elif alias_hashes.get(file_name) != aliases_hash:
+                    rematch_file_names.append(file_name)
+
+        if rematch_file_names:
+            self.rematch_entities(rematch_file_names, entities_with_aliases)
+
+        if not file_names:
+            return
+
+        pipeline.MatchPipeline(
+            entity_matcher,
+            read=self.get_file_content,
+            write=lambda results: self.save_matches(results, aliases_hash),
+            readers=readers,
+            batch_size=batch_size,
+            queue_size=queue_size,
+        ).run(file_names)
 
+    def rematch_entities(self, file_names, entities_with_aliases):
+        """remakes the entity and alias matches of sections with an
+        `automaton.AliasAutomaton`, which doesn't need a model. the matches
+        spacy's entity recognizer made (the ones without a key) are all kept,
+        and weighed against the new ones when they're read.
+
+        if the datastore only holds so many sections' raw matches in memory,
+        they're saved that many sections at a time."""
+        alias_automaton = automaton.AliasAutomaton(entities_with_aliases)
+        aliases_hash = self.get_aliases_hash(entities_with_aliases)
+        chunk_size = self.storage.max_raw_match_sections or len(file_names)
+
+        with PROFILER.stage('reader.rematch'), self.storage.lock():
+            alias_hashes = self.storage.metadata.setdefault('file_alias_hashes', {})
+
+            for i, file_name in enumerate(file_names, start=1):
+                matches = alias_automaton.get_matches(self.get_file_content(file_name))
+                matches += [m for m in self.storage.raw_matches[file_name] if m['key'] is None]
+
+                self.storage.raw_matches[file_name] = sorted(matches, key=lambda m: (m.start, m.end))
+                alias_hashes[file_name] = aliases_hash
+                PROFILER.count('sections rematched')
+
+                # a section's aliases are only recorded once its matches are
+                # saved
+                if i % chunk_size == 0 or i == len(file_names):
+                    self.storage.save_raw_matches()
+                    self.storage.save_metadata()
+
+    @staticmethod
+    def get_aliases_hash(entities_with_aliases):
+        """a hash of the entities and aliases that keyed matches are made
+        from"""
+        aliases = {key: sorted(set(strings)) for key, strings in entities_with_aliases.items()}
+        return hashlib.sha224(json.dumps(aliases, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def save_matches(self, results, aliases_hash=None):
+        """saves a list of (file name, raw matches, boundaries), made from the
+        entities and aliases with `aliases_hash`"""
+        with self.storage.lock():
+            match_hashes = self.storage.metadata['file_match_hashes']
+            alias_hashes = self.storage.metadata.setdefault('file_alias_hashes', {})
+
+            for file_name, raw_matches, boundaries in results:
                 self.storage.raw_matches[file_name] = raw_matches
-                self.storage.save_raw_matches()
+                self.storage.boundaries[file_name] = boundaries
+                match_hashes[file_name] = self.section_hashes.get(file_name)
+                if aliases_hash is not None:
+                    alias_hashes[file_name] = aliases_hash
+
+                PROFILER.count('sections matched')
+
+            self.storage.save_raw_matches()
+            self.storage.save_boundaries()
+            self.storage.save_metadata()
 
     def load_from_storage(self, stored_textobject):
         self.files = stored_textobject['files']
         self.absolute_files = stored_textobject['absolute_files']
         self.is_ebook = stored_textobject['is_ebook']
+        self.sources = stored_textobject.get('sources', {})
+        self.section_hashes = stored_textobject.get('section_hashes', {})
 
     def load_from_path(self, path):
         path = Path(path)
         self.is_ebook = False
         self.files = []
         self.absolute_files = []
+        self._ebook = None
 
         if path.suffix == '.epub':
             self.absolute_files = [path.resolve()]
@@ -85,25 +296,96 @@ class TextReader():
             'files' : self.files,
             'absolute_files' : [str(f) for f in self.absolute_files],
             'is_ebook': self.is_ebook,
+            'sources' : self.sources,
+            'section_hashes' : self.section_hashes,
         }
 
         self.storage.save_metadata()
 
-    def get_file_content(self, file_name):
+    def get_source(self, file_name):
+        """returns the path on disk that a section's content comes from"""
         if self.is_ebook:
-            content = self.read_epub_file(file_name)
-        else:
-            content = self.read_system_file(file_name)
+            return str(self.absolute_files[0])
+
+        return str(self.absolute_files[list(self.files).index(file_name)])
+
+    @staticmethod
+    def get_source_signature(source):
+        """the mtime and size of a source, which is a cheap check for whether
+        it has changed. None if the source doesn't exist."""
+        if not os.path.isfile(source):
+            return None
+
+        stat = os.stat(source)
+        return {
+            'mtime' : stat.st_mtime,
+            'size' : stat.st_size,
+        }
+
+    @property
+    def changed_sources(self):
+        """sources whose signature differs from the one we stored.
+        sources that can't be found aren't considered changed, because we
+        can't do anything about them anyway."""
+        changed_sources = []
+        for source in {str(f) for f in self.absolute_files}:
+            signature = self.get_source_signature(source)
+            if signature is not None and signature != self.sources.get(source):
+                changed_sources.append(source)
+
+        return changed_sources
+
+    def update_section_hashes(self):
+        """rehashes the content of sections whose source has changed (or which
+        haven't been hashed yet)"""
+        with PROFILER.stage('reader.hash'):
+            self._update_section_hashes()
+
+    def _update_section_hashes(self):
+        changed_sources = set(self.changed_sources)
+
+        section_hashes = {}
+        for file_name in self.files:
+            source = self.get_source(file_name)
+            section_hash = self.section_hashes.get(file_name)
+
+            if section_hash is None or source in changed_sources:
+                if self.get_source_signature(source) is not None:
+                    section_hash = self.get_content_hash(self.get_raw_file_content(file_name))
+
+            section_hashes[file_name] = section_hash
+
+        for source in changed_sources:
+            self.sources[source] = self.get_source_signature(source)
+
+        self.section_hashes = section_hashes
+
+    @staticmethod
+    def get_content_hash(content=b''):
+        return hashlib.sha224(content).hexdigest()
+
+    def get_raw_file_content(self, file_name):
+        """the content of a section as bytes, before any html parsing"""
+        if self.is_ebook:
+            return self.read_epub_file(file_name)
+
+        return Path(self.get_source(file_name)).read_bytes()
+
+    def get_file_content(self, file_name):
+        with PROFILER.stage('reader.read'):
+            if self.is_ebook:
+                content = self.read_epub_file(file_name)
+            else:
+                content = self.read_system_file(file_name)
 
         if os.path.splitext(file_name)[1] == '.html':
-            content = self.parse_text_from_html(content)
+            with PROFILER.stage('reader.parse_html'):
+                content = self.parse_text_from_html(content)
 
         return content
 
     def read_system_file(self, file_name):
-        for i, other_file_name in self.files:
-            if other_file_name == file_name:
-                return Path(self.absolute_files[i]).read_text()
+        return Path(self.get_source(file_name)).read_text()
 
     def read_epub_file(self, file_name):
         book = self.get_ebook()
@@ -115,9 +397,16 @@ class TextReader():
         return item.get_body_content()
 
     def get_ebook(self):
-        import ebooklib
-        from ebooklib import epub
-        return epub.read_epub(self.absolute_files[0])
+        """reads the epub once and holds on to it. sections can be read from
+        several threads, so only one of them opens it."""
+        with self._ebook_lock:
+            if self._ebook is None:
+                import ebooklib
+                from ebooklib import epub
+                with PROFILER.stage('reader.open_epub'):
+                    self._ebook = epub.read_epub(str(self.absolute_files[0]))
+
+        return self._ebook
 
     def read_ebook(self):
         import ebooklib
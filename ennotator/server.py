@@ -0,0 +1,311 @@
+"""
+a local, read-only http server for built datastores. datastores are opened
+read-only, so the server never writes to them (or replays a labeling
+session's journal into them); a session in progress is shown as it is.
+
+datastores are opened once, and built networks and responses are kept in an
+LRU cache keyed by the datastore's files, so a repeated request is answered
+from memory until something changes on disk. requests for the same text take
+turns (its datastore and network aren't shared between threads); requests
+for different texts are answered at the same time.
+
+run with:
+    python -m ennotator.server [--datastore .ennotator_data] [--port 8000]
+
+endpoints (all GET, all json):
+- /texts
+- /texts/TEXT/sections
+- /texts/TEXT/entities
+- /texts/TEXT/edges?section=SECTION (a name or an index; defaults to the last)
+- /texts/TEXT/contexts?source=KEY&target=KEY[&section=SECTION]
+- /texts/TEXT/metrics[?betweenness=1&samples=N]
+
+edges and metrics take a `weighting` (see `network.WEIGHTINGS`); the default
+is 'count'.
+"""
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from . import entities
+from . import metrics
+from . import network
+from . import reader
+from . import storage
+
+class LRUCache():
+    """can be shared between threads"""
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+class NotFound(Exception):
+    pass
+
+class BadRequest(Exception):
+    pass
+
+class OpenText():
+    """a datastore, opened once and reopened when its files change"""
+    watched_files = ['metadata', 'raw_entities', 'boundaries', 'entities', 'aliases', 'blacklist', 'journal']
+
+    def __init__(self, datastore_path, text_name):
+        self.datastore_path = datastore_path
+        self.text_name = text_name
+        self.signature = None
+
+        # held while the datastore (or a network made from it) is used
+        self.lock = threading.RLock()
+        self.refresh()
+
+    def get_signature(self):
+        """the mtime and size of each file the network depends on"""
+        signature = []
+        for file in self.watched_files:
+            path = os.path.join(self.datastore_path, self.text_name, file)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                signature.append((file, stat.st_mtime_ns, stat.st_size))
+
+        return tuple(signature)
+
+    def refresh(self):
+        """reopens the datastore if its files changed. returns the signature."""
+        signature = self.get_signature()
+        if signature != self.signature:
+            self.storage = storage.TextDatastore(self.text_name, self.datastore_path, read_only=True)
+            self.entity_interface = entities.TextEntities(self.storage)
+            self.signature = self.get_signature()
+
+        return self.signature
+
+    @property
+    def ordered_content_files(self):
+        """the sections, in order, that have been matched"""
+        return [
+            f for f in reader.TextReader.get_ordered_content_files(self.storage.metadata)
+            if f in self.storage.raw_matches
+        ]
+
+class DatastoreService():
+    """answers queries over the datastores in `datastore_path`"""
+    endpoints = ['sections', 'entities', 'edges', 'contexts', 'metrics']
+
+    def __init__(self, datastore_path='.ennotator_data', max_networks=8, max_responses=256):
+        self.datastore_path = datastore_path
+        self.texts = {}
+        self.networks = LRUCache(max_networks)
+        self.responses = LRUCache(max_responses)
+
+        # only guards `texts`; each text has its own lock
+        self.lock = threading.Lock()
+
+    @property
+    def text_names(self):
+        root = os.path.join(os.getcwd(), self.datastore_path)
+        return sorted(
+            name for name in os.listdir(root)
+            if os.path.isfile(os.path.join(root, name, 'metadata'))
+        )
+
+    def get_text(self, text_name):
+        if text_name not in self.text_names:
+            raise NotFound("no text named '{}'".format(text_name))
+
+        with self.lock:
+            if text_name not in self.texts:
+                self.texts[text_name] = OpenText(self.datastore_path, text_name)
+
+            return self.texts[text_name]
+
+    def get_network(self, text, params={}):
+        """the text's network, switched to the weighting in `params`"""
+        weighting = params.get('weighting', 'count')
+        if weighting not in network.WEIGHTINGS:
+            raise BadRequest("no weighting '{}' (options: {})".format(weighting, ", ".join(network.WEIGHTINGS)))
+
+        key = (text.text_name, text.signature)
+        text_network = self.networks.get(key)
+        if text_network is None:
+            text_network = network.TextNetwork(
+                text.storage,
+                text.ordered_content_files,
+                text.entity_interface,
+            )
+
+            self.networks.set(key, text_network)
+
+        text_network.set_weighting(weighting)
+        return text_network
+
+    def query(self, path, params):
+        """returns the (json-able) response for a request. raises `NotFound`
+        or `BadRequest` for requests that can't be answered."""
+        parts = [unquote(p) for p in path.strip('/').split('/') if p]
+
+        if parts == ['texts']:
+            return self.text_names
+
+        if len(parts) != 3 or parts[0] != 'texts':
+            raise NotFound("no endpoint at '{}'".format(path))
+
+        _, text_name, endpoint = parts
+        if endpoint not in self.endpoints:
+            raise NotFound("no endpoint '{}'".format(endpoint))
+
+        text = self.get_text(text_name)
+        with text.lock:
+            signature = text.refresh()
+
+            cache_key = (text_name, signature, endpoint, json.dumps(params, sort_keys=True))
+            response = self.responses.get(cache_key)
+            if response is None:
+                response = getattr(self, 'get_' + endpoint)(text, params)
+                self.responses.set(cache_key, response)
+
+            return response
+
+    def get_sections(self, text, params):
+        return text.ordered_content_files
+
+    def get_entities(self, text, params):
+        aliases = {}
+        for alias in text.entity_interface.aliases:
+            if alias.entity:
+                aliases.setdefault(alias.entity.key, []).append(alias.string)
+
+        return [
+            {'key' : entity.key, 'aliases' : sorted(aliases.get(entity.key, []))}
+            for entity in text.entity_interface.entities
+        ]
+
+    def get_section_index(self, text, params):
+        sections = text.ordered_content_files
+        section = params.get('section')
+
+        if section is None:
+            return len(sections) - 1
+        elif section in sections:
+            return sections.index(section)
+        elif section.lstrip('-').isdigit() and -len(sections) <= int(section) < len(sections):
+            return int(section) % len(sections)
+
+        raise NotFound("no section '{}'".format(section))
+
+    def get_edges(self, text, params):
+        text_network = self.get_network(text, params)
+        index = self.get_section_index(text, params)
+        return {
+            'section' : text_network.file_names[index],
+            'edges' : text_network.section_networks[index].edges,
+        }
+
+    def get_contexts(self, text, params):
+        """the mentions of `source` and `target` that are within the edge
+        threshold of each other"""
+        source, target = params.get('source'), params.get('target')
+        if not source or not target:
+            raise BadRequest("contexts need a `source` and a `target`")
+
+        text_network = self.get_network(text)
+        indexes = range(len(text_network.file_names))
+        if 'section' in params:
+            indexes = [self.get_section_index(text, params)]
+
+        contexts = []
+        for index in indexes:
+            matches = text_network.section_networks[index].matches
+            for i, first in enumerate(matches):
+                if first.key not in (source, target):
+                    continue
+
+                for second in matches[i + 1:]:
+                    if second.start - first.end > text_network.edge_threshold:
+                        break
+
+                    if {first.key, second.key} == {source, target}:
+                        contexts.append({
+                            'section' : text_network.file_names[index],
+                            'mentions' : [
+                                {'key' : m.key, 'text' : m.text, 'start' : m.start, 'end' : m.end}
+                                for m in (first, second)
+                            ],
+                        })
+
+        return contexts
+
+    def get_metrics(self, text, params):
+        samples = params.get('samples')
+        if samples and not samples.isdigit():
+            raise BadRequest("`samples` has to be a number, not '{}'".format(samples))
+
+        return metrics.NetworkMetrics(self.get_network(text, params)).compute(
+            betweenness=params.get('betweenness') in ('1', 'true'),
+            betweenness_samples=int(samples) if samples else None,
+        )
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+            try:
+                status, response = 200, service.query(url.path, params)
+            except NotFound as e:
+                status, response = 404, {'error' : str(e)}
+            except BadRequest as e:
+                status, response = 400, {'error' : str(e)}
+            except Exception as e:
+                # the client always gets an answer
+                self.log_error("error answering %s: %r", self.path, e)
+                status, response = 500, {'error' : "{}: {}".format(type(e).__name__, e)}
+
+            body = json.dumps(response).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+def serve(datastore_path='.ennotator_data', host='127.0.0.1', port=8000, **kwargs):
+    service = DatastoreService(datastore_path, **kwargs)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print("serving {} on http://{}:{}".format(datastore_path, host, port))
+    server.serve_forever()
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="serve datastores over http")
+    parser.add_argument('--datastore', default='.ennotator_data')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-networks', type=int, default=8)
+    args = parser.parse_args(args)
+
+    serve(args.datastore, host=args.host, port=args.port, max_networks=args.max_networks)
+
+if __name__ == '__main__':
+    main()
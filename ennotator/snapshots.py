@@ -0,0 +1,312 @@
+"""
+content-addressed snapshots of a text's annotations, with the matches and
+network caches that go with them.
+
+a snapshot records:
+- the blacklist, entities, aliases and attributes files
+- the raw matches and section boundaries
+- the metadata that says what the matches were made from (the annotation
+  hashes, the section hashes and the model)
+- the entries of the network metrics and summaries caches
+
+files are stored once in `snapshots/objects`, by the hash of their content,
+so snapshots that share (eg) raw matches don't store them twice. a
+snapshot's id is the hash of what it records, so saving the same state
+twice makes one snapshot.
+
+restoring a snapshot puts all of it back, with the match and alias hashes
+of each section, so only the sections whose matches weren't current when it
+was taken are rematched. the state being replaced is snapshotted first.
+
+`Ennotator` checkpoints the datastore when it's opened, before journaled
+decisions are written or anything is rematched. only the newest `keep`
+unnamed snapshots are kept; named ones are kept until they're deleted.
+
+run with:
+    python -m ennotator.snapshots TEXT list
+    python -m ennotator.snapshots TEXT save [--name NAME]
+    python -m ennotator.snapshots TEXT restore ID
+    python -m ennotator.snapshots TEXT diff ID [ID]
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+from . storage import TextDatastore, atomic_open
+
+class Snapshots():
+    annotation_files = ['blacklist', 'entities', 'aliases', 'attributes']
+    match_files = ['raw_entities', 'boundaries']
+    cache_files = ['network_metrics', 'network_summaries']
+    metadata_fields = [
+        'blacklist_hash',
+        'entities_hash',
+        'aliases_hash',
+        'file_match_hashes',
+        'file_alias_hashes',
+        'file_match_versions',
+        'matched_with',
+        'model_name',
+        'raw_matches',
+    ]
+
+    def __init__(self, storage, keep=20):
+        """
+        parameters:
+        - keep: how many unnamed snapshots are kept; older ones are pruned
+          each time one is saved. None keeps them all.
+        """
+        self.storage = storage
+        self.keep = keep
+        self.path = storage.get_loc('snapshots')
+        self.objects_path = os.path.join(self.path, 'objects')
+
+    def get_manifest_path(self, snapshot_id):
+        return os.path.join(self.path, snapshot_id + '.json')
+
+    def put_object(self, content):
+        """stores bytes by their hash. returns the hash."""
+        object_hash = hashlib.sha224(content).hexdigest()
+        path = os.path.join(self.objects_path, object_hash)
+        if not os.path.isfile(path):
+            os.makedirs(self.objects_path, exist_ok=True)
+            with atomic_open(path, 'wb') as f:
+                f.write(content)
+
+        return object_hash
+
+    def get_object(self, object_hash):
+        with open(os.path.join(self.objects_path, object_hash), 'rb') as f:
+            return f.read()
+
+    def read_file(self, file):
+        path = self.storage.get_loc(file)
+        if not os.path.isfile(path):
+            return None
+
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def get_metadata(self):
+        return {field: self.storage.metadata.get(field) for field in self.metadata_fields}
+
+    def checkpoint(self):
+        """snapshots the datastore, unless it has no annotations yet or the
+        newest snapshot is of the same state. the matches only change along
+        with the metadata, so they're only read if something else did.
+        returns the snapshot's id, if one was taken."""
+        with self.storage.lock():
+            if not any(self.storage.metadata.get(field) for field in ['blacklist_hash', 'entities_hash', 'aliases_hash']):
+                return None
+
+            manifests = self.list()
+            if manifests:
+                newest = manifests[-1]
+                unchanged = newest['metadata'] == self.get_metadata() and all(
+                    self.hash_file(file) == newest['files'].get(file)
+                    for file in self.annotation_files
+                )
+
+                if unchanged:
+                    return None
+
+            return self.save()
+
+    def hash_file(self, file):
+        content = self.read_file(file)
+        return None if content is None else hashlib.sha224(content).hexdigest()
+
+    def save(self, name=None):
+        """snapshots the datastore as it is on disk, and prunes the old ones.
+        returns the snapshot's id."""
+        with self.storage.lock():
+            files = {}
+            for file in self.annotation_files + self.match_files + self.cache_files:
+                content = self.read_file(file)
+                files[file] = None if content is None else self.put_object(content)
+
+            metadata = self.get_metadata()
+
+            state = {'files' : files, 'metadata' : metadata}
+            snapshot_id = hashlib.sha224(json.dumps(state, sort_keys=True).encode('utf-8')).hexdigest()
+
+            if self.exists(snapshot_id):
+                with open(self.get_manifest_path(snapshot_id), 'r') as f:
+                    manifest = json.load(f)
+            else:
+                manifest = dict(state, id=snapshot_id, created=time.time())
+
+            if name:
+                manifest['name'] = name
+
+            with atomic_open(self.get_manifest_path(snapshot_id)) as f:
+                json.dump(manifest, f)
+
+            if self.keep is not None:
+                self.prune(self.keep)
+
+        return snapshot_id
+
+    def exists(self, snapshot_id):
+        return os.path.isfile(self.get_manifest_path(snapshot_id))
+
+    def get(self, snapshot_id):
+        """a snapshot's manifest, by its id, a prefix of it, or its name"""
+        matches = [
+            manifest for manifest in self.list()
+            if manifest['id'].startswith(snapshot_id) or manifest.get('name') == snapshot_id
+        ]
+
+        if len(matches) != 1:
+            raise KeyError("{} snapshots match '{}'".format(len(matches) or 'no', snapshot_id))
+
+        return matches[0]
+
+    def list(self):
+        """manifests, oldest first"""
+        if not os.path.isdir(self.path):
+            return []
+
+        manifests = []
+        for file_name in os.listdir(self.path):
+            if file_name.endswith('.json'):
+                with open(os.path.join(self.path, file_name), 'r') as f:
+                    manifests.append(json.load(f))
+
+        return sorted(manifests, key=lambda m: m['created'])
+
+    def restore(self, snapshot_id):
+        """puts a snapshot back, after snapshotting the current state. any
+        `TextEntities` for the datastore should be remade afterwards."""
+        from . import entities
+        from . metrics import MetricsCache
+
+        manifest = self.get(snapshot_id)
+
+        with self.storage.lock():
+            # decisions still in the journal are written out first, so the
+            # snapshot of the current state has them
+            entities.TextEntities(self.storage).update_storage()
+            self.save()
+
+            self.storage.raw_matches.close()
+
+            for file in self.annotation_files + self.match_files:
+                object_hash = manifest['files'].get(file)
+                if object_hash is None:
+                    if os.path.isfile(self.storage.get_loc(file)):
+                        os.remove(self.storage.get_loc(file))
+
+                    continue
+
+                with atomic_open(self.storage.get_loc(file), 'wb') as f:
+                    f.write(self.get_object(object_hash))
+
+            # cache entries are merged in, rather than replacing newer ones
+            for file in self.cache_files:
+                object_hash = manifest['files'].get(file)
+                if object_hash is not None:
+                    cache = MetricsCache(self.storage, file)
+                    for cache_key, value in json.loads(self.get_object(object_hash).decode('utf-8')).items():
+                        if cache.get(cache_key) is None:
+                            cache.set(cache_key, value)
+
+            for field, value in manifest['metadata'].items():
+                if value is None:
+                    self.storage.metadata.pop(field, None)
+                else:
+                    self.storage.metadata[field] = value
+
+            self.storage.save_metadata()
+            self.storage.setup()
+            self.storage._boundaries = None
+
+    def get_lines(self, snapshot_id, file):
+        """a file's lines in a snapshot (or, for 'current', on disk)"""
+        if snapshot_id == 'current':
+            content = self.read_file(file)
+        else:
+            object_hash = self.get(snapshot_id)['files'].get(file)
+            content = None if object_hash is None else self.get_object(object_hash)
+
+        if not content:
+            return set()
+
+        return {line.strip() for line in content.decode('utf-8').splitlines() if line.strip()}
+
+    def diff(self, one, two='current'):
+        """what changed in each annotation file from `one` to `two`:
+        file -> {'added': [...], 'removed': [...]}"""
+        diff = {}
+        for file in self.annotation_files:
+            one_lines = self.get_lines(one, file)
+            two_lines = self.get_lines(two, file)
+            diff[file] = {
+                'added' : sorted(two_lines - one_lines),
+                'removed' : sorted(one_lines - two_lines),
+            }
+
+        return diff
+
+    def prune(self, keep=20):
+        """deletes all but the newest `keep` unnamed snapshots (and the
+        objects only they used). named snapshots are kept."""
+        with self.storage.lock():
+            manifests = self.list()
+            unnamed = [manifest for manifest in manifests if not manifest.get('name')]
+            removed = unnamed[:-keep] if keep else unnamed
+            kept = [manifest for manifest in manifests if manifest not in removed]
+
+            for manifest in removed:
+                os.remove(self.get_manifest_path(manifest['id']))
+
+            used = {h for manifest in kept for h in manifest['files'].values() if h}
+            if os.path.isdir(self.objects_path):
+                for object_hash in os.listdir(self.objects_path):
+                    if object_hash not in used and not object_hash.startswith('.'):
+                        os.remove(os.path.join(self.objects_path, object_hash))
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="snapshot, restore and diff a text's annotations")
+    parser.add_argument('text_name')
+    parser.add_argument('--datastore', default='.ennotator_data')
+    parser.add_argument('--keep', type=int, default=20, help="how many unnamed snapshots to keep")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('list', help="list snapshots, oldest first")
+
+    save_parser = subparsers.add_parser('save', help="snapshot the current state")
+    save_parser.add_argument('--name', default=None)
+
+    restore_parser = subparsers.add_parser('restore', help="restore a snapshot")
+    restore_parser.add_argument('snapshot')
+
+    diff_parser = subparsers.add_parser('diff', help="show what changed between snapshots")
+    diff_parser.add_argument('one')
+    diff_parser.add_argument('two', nargs='?', default='current')
+
+    args = parser.parse_args(args)
+    snapshots = Snapshots(TextDatastore(args.text_name, args.datastore), keep=args.keep)
+
+    if args.command == 'list':
+        for manifest in snapshots.list():
+            print("{id} {created} {name}".format(
+                id=manifest['id'][:12],
+                created=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manifest['created'])),
+                name=manifest.get('name', ''),
+            ))
+    elif args.command == 'save':
+        print(snapshots.save(name=args.name))
+    elif args.command == 'restore':
+        snapshots.restore(args.snapshot)
+    elif args.command == 'diff':
+        for file, changes in snapshots.diff(args.one, args.two).items():
+            for line in changes['removed']:
+                print("{}: - {}".format(file, line))
+            for line in changes['added']:
+                print("{}: + {}".format(file, line))
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,75 @@
+import copy
 import json
 import os
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
 from pathlib import Path
 
+from . import matchstore
+from . profiling import PROFILER
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks off of posix; we still write atomically
+    fcntl = None
+
+@contextmanager
+def atomic_open(path, mode='w'):
+    """opens a temporary file next to `path` and renames it over `path` once
+    the writing is done, so a crash mid-write never leaves a truncated file"""
+    directory, name = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.{}.'.format(name), suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+
+        if os.path.exists(path):
+            os.chmod(temp_path, os.stat(path).st_mode)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o666 & ~umask)
+
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+MISSING = object()
+
+def merge_changes(ours, base, theirs):
+    """applies the changes made from `base` to `theirs` to `ours`, in place.
+    where both changed something, ours wins; dicts both changed are merged
+    key by key."""
+    for key in set(base) | set(theirs):
+        base_value = base.get(key, MISSING)
+        their_value = theirs.get(key, MISSING)
+        if their_value == base_value:
+            continue
+
+        our_value = ours.get(key, MISSING)
+        if all(isinstance(value, dict) for value in (our_value, base_value, their_value)):
+            merge_changes(our_value, base_value, their_value)
+        elif our_value == base_value:
+            if their_value is MISSING:
+                ours.pop(key, None)
+            else:
+                ours[key] = copy.deepcopy(their_value)
+
+class ReadOnlyError(Exception):
+    pass
+
 class Datastore():
-    def __init__(self, path):
+    def __init__(self, path, create=True):
         self.path = path
 
-        if not os.path.isdir(path):
+        if create and not os.path.isdir(path):
             os.mkdir(path)
 
     def get_loc(self, path):
@@ -21,26 +84,73 @@ class TextDatastore():
         "matches",
     ]
 
-    def __init__(self, text_name, datastore_path='.ennotator_data'):
+    def __init__(self, text_name, datastore_path='.ennotator_data', max_raw_match_sections=None, read_only=False):
+        """
+        parameters:
+        - max_raw_match_sections: if set, at most this many sections' raw
+          matches are held in memory at once
+        - read_only: if True, an existing datastore is opened without
+          creating, touching or writing any of its files (saving raises
+          `ReadOnlyError`)
+        """
         self.text_name = text_name
+        self.max_raw_match_sections = max_raw_match_sections
+        self.read_only = read_only
         if not datastore_path:
             datastore_path = '.ennotator_data'
-        self.datastore = Datastore(os.path.join(os.getcwd(), datastore_path))
+
+        self.datastore = Datastore(os.path.join(os.getcwd(), datastore_path), create=not read_only)
 
         # sanitize the text's name to use as a path
         safe_text_path = "".join(_ for _ in self.text_name if _.isalnum())
 
         self.datastore_path = self.datastore.get_loc(safe_text_path)
 
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+
+        self._boundaries = None
+
+        # the metadata as it was last read or written, so what this instance
+        # changed can be told from what others did in the meantime
+        self._metadata_base = {}
+
         self.ready()
 
+    @classmethod
+    def at_path(cls, directory):
+        """the datastore of the text whose datastore directory is
+        `directory`, or None if it isn't one"""
+        directory = os.path.abspath(directory)
+        if not os.path.isfile(os.path.join(directory, 'metadata')):
+            return None
+
+        return cls(os.path.basename(directory), os.path.dirname(directory))
 
     def ready(self):
         """if the dataset exists, loads it
         otherwise, sets things up so we can work safely"""
+        if self.read_only:
+            if not os.path.isfile(self.metadata_path):
+                raise FileNotFoundError("no datastore at {}".format(self.datastore_path))
+
+            with self.lock():
+                self.load_metadata()
+
+                self.raw_matches = {}
+                if os.path.isfile(self.raw_matches_path):
+                    self.load_raw_matches()
+
+            return
+
         if not os.path.exists(self.datastore_path) or not os.path.isdir(self.datastore_path):
             os.mkdir(self.datastore_path)
 
+        with self.lock():
+            self.setup()
+
+    def setup(self):
         if not os.path.isfile(self.metadata_path):
             self.metadata = {
                 'text_name' : self.text_name,
@@ -48,6 +158,11 @@ class TextDatastore():
                 'blacklist_hash': None,
                 'entities_hash': None,
                 'aliases_hash': None,
+                'file_match_hashes' : {},
+                'raw_matches' : {
+                    'format' : 'binary',
+                    'compression' : None,
+                },
                 'files' : {
                     'ordering' : [],
                     'exclusions' : [],
@@ -56,6 +171,8 @@ class TextDatastore():
 
             self.save_metadata()
 
+        self.load_metadata()
+
         if not os.path.isfile(self.raw_matches_path):
             self.raw_matches = {}
             self.save_raw_matches()
@@ -63,7 +180,6 @@ class TextDatastore():
         for file in TextDatastore.files:
             Path(self.get_loc(file)).touch()
 
-        self.load_metadata()
         self.load_raw_matches()
 
 
@@ -73,10 +189,57 @@ class TextDatastore():
 
         return content
 
+    def read_lines(self, file):
+        """the lines of a file, or none if it doesn't exist (yet)"""
+        if not os.path.isfile(self.get_loc(file)):
+            return []
+
+        with open(self.get_loc(file), 'r') as f:
+            return f.readlines()
+
     def save_file_content(self, file, content):
-        with open(self.get_loc(file), 'w') as f:
+        self.check_writable()
+        with self.lock(), atomic_open(self.get_loc(file)) as f:
             f.write(content)
 
+    def check_writable(self):
+        if self.read_only:
+            raise ReadOnlyError("the datastore of '{}' is opened read-only".format(self.text_name))
+
+    @property
+    def lock_path(self):
+        return self.get_loc('lock')
+
+    @contextmanager
+    def lock(self):
+        """an advisory lock on this text's datastore, so that several
+        processes (or threads) can share it. reentrant.
+
+        read-only datastores take a shared lock, and only if the lock file is
+        already there."""
+        with self._lock:
+            if not self._lock_depth:
+                if not self.read_only:
+                    self._lock_file = open(self.lock_path, 'a')
+                elif os.path.isfile(self.lock_path):
+                    self._lock_file = open(self.lock_path, 'r')
+
+                if fcntl and self._lock_file is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_SH if self.read_only else fcntl.LOCK_EX)
+
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+
+                if not self._lock_depth and self._lock_file is not None:
+                    if fcntl:
+                        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+                    self._lock_file.close()
+                    self._lock_file = None
+
     @property
     def raw_matches_path(self):
         return self.get_loc('raw_entities')
@@ -85,37 +248,178 @@ class TextDatastore():
     def metadata_path(self):
         return self.get_loc('metadata')
 
+    @property
+    def raw_matches_format(self):
+        """the format (`json` or `binary`) and compression raw matches are
+        saved in. datastores from before the binary format stay json until
+        they're converted."""
+        settings = self.metadata.get('raw_matches', {})
+        return settings.get('format', 'json'), settings.get('compression')
+
+    def convert_raw_matches(self, format='binary', compression=None):
+        """switches the format raw matches are saved in"""
+        self.check_writable()
+        with self.lock():
+            self.metadata['raw_matches'] = {
+                'format' : format,
+                'compression' : compression,
+            }
+
+            self.save_raw_matches()
+            self.save_metadata()
+
+            # what's in memory was read from the old format
+            self.load_raw_matches()
+
     def save_raw_matches(self):
-        with open(self.raw_matches_path, 'w') as f:
-            json.dump(self.raw_matches, f)
+        """writes the raw matches. sections another process (or datastore)
+        saved since they were read are kept, unless they were set here too.
+
+        each section that changed gets a new version first (see
+        `save_match_versions`)."""
+        self.check_writable()
+        format, compression = self.raw_matches_format
+
+        with PROFILER.stage('storage.save_raw_matches'), self.lock():
+            if isinstance(self.raw_matches, matchstore.LazyRawMatches):
+                self.raw_matches.refresh()
+                changed_sections = self.raw_matches.changed_sections
+            else:
+                changed_sections = set(self.raw_matches)
+
+            if changed_sections:
+                self.save_match_versions(changed_sections)
+
+            if format == 'binary':
+                with atomic_open(self.raw_matches_path, 'wb') as f:
+                    matchstore.dump(self.raw_matches, f, compression=compression)
+            else:
+                with atomic_open(self.raw_matches_path) as f:
+                    json.dump(dict(self.raw_matches.items()), f)
+
+            if isinstance(self.raw_matches, matchstore.LazyRawMatches):
+                self.raw_matches.saved()
+
+    def save_match_versions(self, section_names):
+        """gives sections new versions in `metadata['file_match_versions']`,
+        so that whatever was made from their old raw matches (see
+        `network.TextNetwork.cache_key`) isn't mistaken for current. only the
+        versions are saved, so the rest of the metadata (eg, that the
+        sections were matched) still waits for the matches to be saved."""
+        versions = self.metadata.setdefault('file_match_versions', {})
+        for section_name in section_names:
+            versions[section_name] = uuid.uuid4().hex
+
+        with self.lock():
+            if not os.path.isfile(self.metadata_path):
+                return
+
+            with open(self.metadata_path, 'r') as f:
+                on_disk = json.load(f)
+
+            on_disk_versions = on_disk.setdefault('file_match_versions', {})
+            base_versions = self._metadata_base.setdefault('file_match_versions', {})
+            for section_name in section_names:
+                on_disk_versions[section_name] = base_versions[section_name] = versions[section_name]
+
+            with atomic_open(self.metadata_path) as f:
+                json.dump(on_disk, f)
 
     def save_metadata(self):
         """
         fields:
         - text_name: string, name of text
         - datastore_path: path to datastore (where this file is, lol)
+
+        whatever others saved since the metadata was read is merged in first
+        (see `merge_changes`), so concurrent sessions don't undo each other's
+        changes.
         """
-        with open(self.metadata_path, 'w') as f:
-            json.dump(self.metadata, f)
+        self.check_writable()
+        with PROFILER.stage('storage.save_metadata'), self.lock():
+            if os.path.isfile(self.metadata_path):
+                with open(self.metadata_path, 'r') as f:
+                    merge_changes(self.metadata, self._metadata_base, json.load(f))
+
+            with atomic_open(self.metadata_path) as f:
+                json.dump(self.metadata, f)
+
+            self._metadata_base = copy.deepcopy(self.metadata)
 
     def load_metadata(self):
-        with open(self.metadata_path, 'r') as f:
+        with self.lock(), open(self.metadata_path, 'r') as f:
             self.metadata = json.load(f)
 
+        self._metadata_base = copy.deepcopy(self.metadata)
+
+    @property
+    def overlap_policy(self):
+        """the policy overlapping raw matches are resolved with (see
+        `matcher.resolve_overlaps`). datastores from before it was its own
+        setting recorded it with the matcher."""
+        legacy_policy = self.metadata.get('matched_with', {}).get('overlap_policy', 'longest')
+        return self.metadata.get('overlap_policy', legacy_policy)
+
+    def get_matches(self, file_name):
+        """a section's raw matches, with overlapping ones resolved. the raw
+        matches keep every overlapping match, so the recognizer's aren't lost
+        when the user's entities and aliases change. (matches for the network
+        are resolved after they're keyed; see
+        `entities.TextEntities.add_entity_keys_to_matches`)"""
+        from . matcher import resolve_overlaps
+        return resolve_overlaps(self.raw_matches[file_name], self.overlap_policy)
+
     def load_raw_matches(self):
-        from . matcher import Match
-        with open(self.raw_matches_path, 'r') as f:
-            raw_matches = json.load(f)
-
-        self.raw_matches = {}
-        for file_name, file_raw_matches in raw_matches.items():
-            self.raw_matches[file_name] = [
-                Match(
-                    start=m['start'],
-                    end=m['end'],
-                    text=m['text'],
-                    key=m.get('key'),
-                ) for m in file_raw_matches]
+        """sections' raw matches are read the first time they're used"""
+        with PROFILER.stage('storage.load_raw_matches'), self.lock():
+            self.raw_matches = matchstore.LazyRawMatches(
+                self.raw_matches_path,
+                max_sections=self.max_raw_match_sections,
+            )
+
+    @property
+    def model_name(self):
+        """the spacy pipeline this text is matched with (None for the
+        default)"""
+        return self.metadata.get('model_name')
+
+    def set_model_name(self, model_name):
+        """switches the text's pipeline. its matches are remade the next time
+        they're loaded, since they were made with another."""
+        self.check_writable()
+        with self.lock():
+            self.metadata['model_name'] = model_name
+            self.save_metadata()
+
+    @property
+    def boundaries_path(self):
+        return self.get_loc('boundaries')
+
+    @property
+    def boundaries(self):
+        """section -> the character offsets its sentences and paragraphs start
+        at, as {'sentences': [...], 'paragraphs': [...]}. sections matched
+        before these were recorded don't have any."""
+        if self._boundaries is None:
+            self._boundaries = {}
+            if os.path.isfile(self.boundaries_path):
+                with self.lock(), open(self.boundaries_path, 'r') as f:
+                    self._boundaries = json.load(f)
+
+        return self._boundaries
+
+    def save_boundaries(self):
+        """writes the boundaries, keeping sections' that were saved by others
+        since they were read"""
+        self.check_writable()
+        with self.lock():
+            if os.path.isfile(self.boundaries_path):
+                with open(self.boundaries_path, 'r') as f:
+                    for section, boundaries in json.load(f).items():
+                        self.boundaries.setdefault(section, boundaries)
+
+            with atomic_open(self.boundaries_path) as f:
+                json.dump(self.boundaries, f)
 
     def get_loc(self, path):
         return os.path.join(self.datastore_path, path)
@@ -0,0 +1,131 @@
+"""
+suggests which existing entity an unlabeled string is an alias of.
+
+suggestions combine:
+- the cosine similarity of the string's word vectors to each entity key's
+- how many words the string shares with each entity key
+"""
+from collections import defaultdict
+
+import numpy as np
+
+from . import model
+
+class AliasSuggester():
+    """holds a matrix of (normalized) entity key vectors, so that suggesting
+    entities for many strings is a single matrix product"""
+    def __init__(self, keys=(), nlp=None, model_name=None, vector_weight=.5):
+        """
+        parameters:
+        - keys: entity keys to suggest from
+        - nlp: a spacy pipeline with word vectors. loaded from `model_name`
+          (or the default model) if not given.
+        - vector_weight: how much the vector similarity counts, compared to
+          the shared words (between 0 and 1)
+        """
+        self._nlp = nlp
+        self.model_name = model_name or model.DEFAULT_MODEL
+        self.vector_weight = vector_weight
+
+        self.keys = []
+        self.key_set = set()
+        self.token_index = defaultdict(set)
+        self._vectors = None
+
+        self.add(keys)
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            self._nlp = model.load_spacy(self.model_name)
+
+        return self._nlp
+
+    @property
+    def vectors(self):
+        """the (number of keys x vector width) matrix of key vectors"""
+        return self._vectors[:len(self.keys)]
+
+    @staticmethod
+    def get_tokens(string):
+        return set(string.lower().split())
+
+    def vectorize(self, strings):
+        """unit length vectors for each string (zeros if it has none). only the
+        tokenizer is run, not the whole pipeline."""
+        vectors = np.array(
+            [self.nlp.make_doc(string).vector for string in strings],
+            dtype=np.float32,
+        ).reshape(len(strings), -1)
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def add(self, keys):
+        """adds entity keys. the matrix grows by doubling, so adding keys one at
+        a time is cheap."""
+        keys = [k for k in dict.fromkeys(keys) if k not in self.key_set]
+        if not keys:
+            return
+
+        vectors = self.vectorize(keys)
+
+        if self._vectors is None:
+            self._vectors = np.zeros((max(len(keys), 16), vectors.shape[1]), dtype=np.float32)
+
+        needed = len(self.keys) + len(keys)
+        if needed > self._vectors.shape[0]:
+            capacity = max(needed, 2 * self._vectors.shape[0])
+            grown = np.zeros((capacity, self._vectors.shape[1]), dtype=np.float32)
+            grown[:len(self.keys)] = self.vectors
+            self._vectors = grown
+
+        self._vectors[len(self.keys):needed] = vectors
+
+        for key in keys:
+            for token in self.get_tokens(key):
+                self.token_index[token].add(len(self.keys))
+
+            self.keys.append(key)
+            self.key_set.add(key)
+
+    def string_scores(self, string):
+        """the fraction of words shared between `string` and each key. only
+        keys sharing a word are looked at."""
+        scores = np.zeros(len(self.keys), dtype=np.float32)
+        tokens = self.get_tokens(string)
+
+        shared = defaultdict(int)
+        for token in tokens:
+            for index in self.token_index.get(token, ()):
+                shared[index] += 1
+
+        for index, count in shared.items():
+            key_tokens = self.get_tokens(self.keys[index])
+            scores[index] = count / len(tokens.union(key_tokens))
+
+        return scores
+
+    def suggest_many(self, strings, k=5):
+        """the `k` best entity keys for each string, as lists of (key, score)"""
+        if not self.keys or not strings:
+            return [[] for _ in strings]
+
+        similarities = self.vectorize(strings) @ self.vectors.T
+        scores = self.vector_weight * similarities
+        for i, string in enumerate(strings):
+            scores[i] += (1 - self.vector_weight) * self.string_scores(string)
+
+        k = min(k, len(self.keys))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+        suggestions = []
+        for i, indexes in enumerate(top):
+            indexes = sorted(indexes, key=lambda j: -scores[i, j])
+            suggestions.append([(self.keys[j], float(scores[i, j])) for j in indexes])
+
+        return suggestions
+
+    def suggest(self, string, k=5):
+        return self.suggest_many([string], k=k)[0]
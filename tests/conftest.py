@@ -0,0 +1,17 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+FIXTURES = os.path.join(REPO, '.ennotator_data')
+
+@pytest.fixture
+def datastores(tmp_path, monkeypatch):
+    """a copy of the bundled datastores, in a temporary working directory"""
+    shutil.copytree(FIXTURES, tmp_path / '.ennotator_data', ignore=shutil.ignore_patterns('lock', 'journal', 'reports', 'snapshots', 'network_layers'))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / '.ennotator_data'
@@ -0,0 +1,49 @@
+from ennotator import attributes
+from ennotator import storage
+
+def load(text_name='DonQuixote'):
+    return attributes.AttributeStore(storage.TextDatastore(text_name))
+
+def test_attributes_are_written_and_read_back(datastores):
+    attribute_store = load()
+    attribute_store.add('SanchoPanza', 'faction', 'squires')
+    attribute_store.add('DonQuixote', 'faction', 'knights')
+    attribute_store.add('DonQuixote', 'faction', 'knights')
+    attribute_store.add('DonQuixote', 'faction', 'madmen')
+    attribute_store.remove('DonQuixote', 'faction', 'madmen')
+    attribute_store.update_storage()
+
+    reloaded = load()
+    assert reloaded.get('DonQuixote', 'faction') == ['knights']
+    assert reloaded.get_entity_attributes('SanchoPanza') == {'faction' : ['squires']}
+    assert reloaded.attributes_file_contents == attribute_store.attributes_file_contents
+
+    lines = reloaded.attributes_file_contents.splitlines()
+    assert lines == sorted(lines) == ['"DonQuixote","faction","knights"', '"SanchoPanza","faction","squires"']
+
+def test_removing_an_attribute_removes_all_its_values(datastores):
+    attribute_store = load()
+    attribute_store.add('DonQuixote', 'faction', 'knights')
+    attribute_store.add('DonQuixote', 'faction', 'madmen')
+    attribute_store.remove('DonQuixote', 'faction')
+
+    assert attribute_store.get('DonQuixote', 'faction') == []
+    assert attribute_store.attributes_file_contents == ''
+
+def test_masks_pick_keys_with_any_of_the_values():
+    masks = attributes.AttributeMasks([
+        attributes.Attribute('a', 'faction', 'x'),
+        attributes.Attribute('b', 'faction', 'y'),
+        attributes.Attribute('b', 'gender', 'f'),
+        attributes.Attribute('z', 'faction', 'x'),
+    ], ['a', 'b', 'c'])
+
+    assert masks.get_mask({'faction' : 'x'}).tolist() == [True, False, False]
+    assert masks.get_mask({'faction' : ['x', 'y']}).tolist() == [True, True, False]
+    assert masks.get_mask({'faction' : ['x', 'y'], 'gender' : 'f'}).tolist() == [False, True, False]
+    assert masks.get_mask({'faction' : 'w'}).tolist() == [False, False, False]
+    assert masks.get_mask({'height' : 'tall'}).tolist() == [False, False, False]
+    assert masks.get_mask({}).tolist() == [True, True, True]
+
+    # keys that aren't indexed have no position
+    assert masks.get_indexes(['b', 'z']).tolist() == [1, -1]
@@ -0,0 +1,118 @@
+import pytest
+
+from ennotator import automaton
+from ennotator import entities
+from ennotator import matcher
+from ennotator import reader
+from ennotator import storage
+
+def find(strings, text):
+    alias_automaton = automaton.AliasAutomaton(strings)
+    return [(m.start, m.end, m.key) for m in alias_automaton.get_matches(text)]
+
+def test_matches_start_and_end_on_word_boundaries():
+    strings = {'sancho': ['Sancho']}
+    assert find(strings, "Sancho's ass") == [(0, 6, 'sancho')]
+    assert find(strings, "the Sanchos") == []
+    assert find(strings, "Sanchopanza") == []
+    assert find(strings, "(Sancho)") == [(1, 7, 'sancho')]
+
+def test_matching_is_case_sensitive():
+    assert find({'sancho': ['Sancho']}, "sancho") == []
+
+def test_whitespace_is_collapsed():
+    strings = {'quixote': ['Don  Quixote']}
+    text = "said Don\n   Quixote, and"
+    assert find(strings, text) == [(5, 19, 'quixote')]
+
+def test_overlapping_strings_are_all_found():
+    strings = {'quixote': ['Don Quixote', 'Quixote'], 'mancha': ['Quixote of La Mancha']}
+    text = "Don Quixote of La Mancha"
+    assert find(strings, text) == [
+        (0, 11, 'quixote'),
+        (4, 11, 'quixote'),
+        (4, 24, 'mancha'),
+    ]
+
+def make_matches():
+    return [
+        matcher.Match(0, 4, 'Adam', key='adam'),
+        matcher.Match(0, 10, 'Adam Smith'),
+        matcher.Match(20, 25, 'Sally', key='sally'),
+        matcher.Match(20, 25, 'Sally'),
+    ]
+
+def spans(matches):
+    return [(m.start, m.end, m['key']) for m in matches]
+
+def test_the_longest_overlapping_match_wins():
+    assert spans(matcher.resolve_overlaps(make_matches(), 'longest')) == [
+        (0, 10, None),
+        (20, 25, 'sally'),
+    ]
+
+def test_the_users_overlapping_match_wins():
+    assert spans(matcher.resolve_overlaps(make_matches(), 'user')) == [
+        (0, 4, 'adam'),
+        (20, 25, 'sally'),
+    ]
+
+def test_unknown_overlap_policies_are_refused():
+    with pytest.raises(ValueError):
+        matcher.resolve_overlaps(make_matches(), 'shortest')
+
+def test_recognized_matches_survive_a_rematch(datastores, monkeypatch):
+    text_storage = storage.TextDatastore('DonQuixote')
+    text_storage.metadata['overlap_policy'] = 'longest'
+    section = next(iter(text_storage.raw_matches))
+
+    text = "Adam Smith met Sally."
+    text_storage.raw_matches[section] = [matcher.Match(0, 10, 'Adam Smith')]
+
+    text_reader = reader.TextReader(text_storage)
+    monkeypatch.setattr(text_reader, 'get_file_content', lambda file_name: text)
+
+    # an alias that would win under the user policy...
+    text_reader.rematch_entities([section], {'adam': ['Adam']})
+    assert spans(text_storage.get_matches(section)) == [(0, 10, None)]
+
+    # ...doesn't cost the recognized match once it's removed again
+    text_reader.rematch_entities([section], {'sally': ['Sally']})
+    assert spans(text_storage.get_matches(section)) == [(0, 10, None), (15, 20, 'sally')]
+
+    text_storage.metadata['overlap_policy'] = 'user'
+    text_reader.rematch_entities([section], {'adam': ['Adam']})
+    assert spans(text_storage.get_matches(section)) == [(0, 4, 'adam')]
+    assert (0, 10, None) in spans(text_storage.raw_matches[section])
+
+def test_matches_without_an_entity_dont_cost_keyed_ones(datastores):
+    entity_interface = entities.TextEntities(storage.TextDatastore('DonQuixote'))
+    raw_matches = [
+        matcher.Match(0, 13, 'Sancho Pancho'),
+        matcher.Match(0, 6, 'Sancho', key='SanchoPanza'),
+    ]
+
+    # the longer recognized match has no entity, so it's dropped before
+    # overlaps are resolved
+    keyed = entity_interface.add_entity_keys_to_matches(raw_matches)
+    assert [(m.start, m.end, m.key) for m in keyed] == [(0, 6, 'SanchoPanza')]
+
+    # unless unlabeled matches are wanted
+    unlabeled = entity_interface.add_entity_keys_to_matches(raw_matches, include_unlabeled=True)
+    assert [(m.start, m.end) for m in unlabeled] == [(0, 13)]
+
+def test_changing_the_overlap_policy_doesnt_remake_matches(datastores, monkeypatch):
+    text_storage = storage.TextDatastore('DonQuixote')
+    text_reader = reader.TextReader(text_storage)
+    monkeypatch.setattr(text_reader, 'get_file_content', lambda file_name: "Sancho")
+
+    # as recorded before the policy was its own setting
+    signature = matcher.EntityMatchObject({}, text_storage.model_name).signature
+    text_storage.metadata['matched_with'] = dict(signature, overlap_policy='longest')
+    assert text_storage.overlap_policy == 'longest'
+
+    text_reader.load_matches(overlap_policy='user')
+
+    # sections matched with another matcher are marked stale with ''
+    assert '' not in text_storage.metadata['file_match_hashes'].values()
+    assert text_storage.overlap_policy == 'user'
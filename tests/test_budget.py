@@ -0,0 +1,45 @@
+import pytest
+
+from ennotator import budget
+from ennotator import matchstore
+from ennotator import model
+from ennotator import storage
+
+@pytest.mark.parametrize('size, expected', [
+    (1024, 1024),
+    ('512', 512),
+    ('2KB', 2 * 2**10),
+    ('512M', 512 * 2**20),
+    ('512mb', 512 * 2**20),
+    ('1.5GB', int(1.5 * 2**30)),
+    ('1G', 2**30),
+    ('.5 G', 2**29),
+])
+def test_sizes_are_parsed(size, expected):
+    assert budget.parse_bytes(size) == expected
+
+@pytest.mark.parametrize('size', ['.', '', 'GB', '1.2.3GB', '12TB', '-1GB'])
+def test_unreadable_sizes_are_refused(size):
+    with pytest.raises(ValueError, match="can't read"):
+        budget.parse_bytes(size)
+
+def test_model_limits_only_last_for_the_budget():
+    registry = model.ModelRegistry(max_models=3)
+    memory_budget = budget.MemoryBudget('2GB')
+
+    with memory_budget.applied_to_models(registry):
+        assert registry.max_models == 1
+
+    assert registry.max_models == 3
+
+def test_json_raw_matches_are_converted_to_be_read_by_section(datastores):
+    text_storage = storage.TextDatastore('DonQuixote', max_raw_match_sections=2)
+    sections = list(text_storage.raw_matches)
+    matches = {f: [dict(m) for m in text_storage.raw_matches[f]] for f in sections}
+
+    budget.MemoryBudget('1GB').prepare_storage(text_storage)
+
+    assert text_storage.raw_matches_format[0] == 'binary'
+    assert matchstore.is_binary_file(text_storage.raw_matches_path)
+    assert {f: [dict(m) for m in text_storage.raw_matches[f]] for f in sections} == matches
+    assert len(text_storage.raw_matches.loaded_sections) <= 2
@@ -0,0 +1,57 @@
+from ennotator.candidates import CandidateIndex
+from ennotator.matcher import Match
+
+def make_index():
+    index = CandidateIndex()
+    index.add('Adam', 5)
+    index.add('Adam Smith', 2)
+    index.add('Smith', 1)
+    index.add('Eve', 4)
+    return index
+
+def test_contained_strings_are_grouped_with_their_container():
+    index = make_index()
+    assert index.get_root('Adam') == 'Adam Smith'
+    assert index.get_root('Smith') == 'Adam Smith'
+    assert index.get_root('Eve') == 'Eve'
+
+def test_groups_are_ordered_by_mentions_and_longest_first():
+    assert make_index().groups() == [['Adam Smith', 'Adam', 'Smith'], ['Eve']]
+
+def test_containment_is_by_contiguous_tokens():
+    index = CandidateIndex(['John Smith', 'John Paul Smith'])
+    assert index.containers('John Smith') == set()
+    assert index.containers('Smith John') == set()
+    assert index.containers('Paul Smith') == {'John Paul Smith'}
+    assert index.containers('Paul') == {'John Paul Smith'}
+
+def test_removing_a_parent_regroups_its_children():
+    index = make_index()
+    index.remove('Adam Smith')
+    assert index.get_root('Adam') == 'Adam'
+    assert 'Adam Smith' not in index
+    assert index.groups() == [['Adam'], ['Eve'], ['Smith']]
+
+def test_next_candidate_finishes_a_group_first():
+    index = make_index()
+    assert index.next_candidate() == 'Adam Smith'
+
+    index.remove('Adam Smith')
+    # the rest of the group comes before 'Eve', though 'Eve' has more mentions
+    assert index.next_candidate() == 'Adam'
+    index.remove('Adam')
+    assert index.next_candidate() == 'Smith'
+    index.remove('Smith')
+    assert index.next_candidate() == 'Eve'
+    index.remove('Eve')
+    assert index.next_candidate() is None
+
+def test_from_matches_counts_mentions_and_skips_labeled():
+    matches = [
+        Match(start=0, end=4, text='Adam', key=None),
+        Match(start=10, end=14, text='Adam', key=None),
+        Match(start=20, end=23, text='Eve', key=None),
+    ]
+
+    index = CandidateIndex.from_matches(matches, labeled={'Eve'})
+    assert index.counts == {'Adam' : 2}
@@ -0,0 +1,40 @@
+import pytest
+
+from ennotator import compare
+from ennotator import entities
+from ennotator import storage
+
+def open_text(text_name='DonQuixote'):
+    text_storage = storage.TextDatastore(text_name)
+    return text_storage, entities.TextEntities(text_storage)
+
+def test_cached_summaries_dont_open_the_matches(datastores):
+    summary = compare.summarize(*open_text())
+    assert summary['nodes']
+
+    text_storage, entity_interface = open_text()
+    assert compare.summarize(text_storage, entity_interface) == summary
+    assert not text_storage.raw_matches.is_open
+
+def test_summaries_follow_the_annotations(datastores):
+    summary = compare.summarize(*open_text())
+
+    text_storage, entity_interface = open_text()
+    entity_interface.add_to_blacklist(summary['nodes'][0])
+    entity_interface.update_storage()
+
+    assert summary['nodes'][0] not in compare.summarize(*open_text())['nodes']
+
+def test_a_text_compared_with_itself(datastores):
+    comparison = compare.Comparison(['DonQuixote', 'DonQuixote'])
+    assert comparison.edge_jaccard('DonQuixote', 'DonQuixote') == 1
+    assert comparison.edge_jaccard('DonQuixote', 'DonQuixote', weighted=True) == 1
+    assert comparison.degree_correlation('DonQuixote', 'DonQuixote') == pytest.approx(1)
+
+def test_texts_are_aligned_through_the_alias_map(datastores):
+    nodes = compare.summarize(*open_text())['nodes']
+    comparison = compare.Comparison(['DonQuixote', 'Asymmetry'], alias_map={nodes[0]: 'shared'})
+
+    assert comparison.get_alignment('DonQuixote')[nodes[0]] == 'shared'
+    assert 'shared' in comparison.node_index
+    assert comparison.edge_jaccard('DonQuixote', 'Asymmetry') < 1
@@ -0,0 +1,31 @@
+from ennotator import entities
+from ennotator import storage
+
+def load(text_name='DonQuixote'):
+    return entities.TextEntities(storage.TextDatastore(text_name))
+
+def test_direct_changes_are_written(datastores):
+    entity_interface = load()
+    entity_interface.blacklist.append('Rocinante')
+    entity_interface.entities.append(entities.Entity(key='Maritornes'))
+    removed = entity_interface.aliases.pop()
+    entity_interface.update_storage()
+
+    reloaded = load()
+    assert 'Rocinante' in reloaded.blacklist
+    assert entities.TextEntities.find_entity_with_key(reloaded.entities, 'Maritornes')
+    assert removed.get_storage_representation() not in {a.get_storage_representation() for a in reloaded.aliases}
+
+def test_journaled_decisions_are_replayed(datastores):
+    entity_interface = load()
+    entity = entity_interface.add_entity('Maritornes')
+    entity_interface.add_alias('the Asturian', entity)
+    entity_interface.add_to_blacklist('Rocinante')
+    entity_interface.close_journal()
+
+    # a crash before update_storage: the next session replays the journal
+    reloaded = load()
+    assert entities.TextEntities.find_entity_with_key(reloaded.entities, 'Maritornes')
+    assert 'the Asturian' in {a.string for a in reloaded.aliases}
+    assert 'Rocinante' in reloaded.blacklist
+    assert not reloaded.matches_are_not_up_to_date
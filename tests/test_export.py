@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from ennotator import export
+
+class Layer():
+    def __init__(self, nodes, edges):
+        self.nodes = set(nodes)
+        self.edges = edges
+
+LAYERS = [
+    ('chapter-1', Layer(['Don', 'Sancho'], [['Don', 'Sancho', 2]])),
+    ('chapter-2', Layer(['Don', 'Sancho', 'Dulcinea & co'], [['Don', 'Sancho', 3], ['Don', 'Dulcinea & co', 1]])),
+]
+
+GRAPHML = '{http://graphml.graphdrawing.org/xmlns}'
+
+def write(exporter, **kwargs):
+    f = io.StringIO()
+    exporter(iter(LAYERS), f, **kwargs)
+    return f.getvalue()
+
+def test_csv_has_a_row_per_edge_per_layer():
+    rows = list(csv.reader(io.StringIO(write(export.write_csv))))
+    assert rows[0] == ['section', 'source', 'target', 'weight']
+    assert rows[1:] == [
+        ['chapter-1', 'Don', 'Sancho', '2'],
+        ['chapter-2', 'Don', 'Sancho', '3'],
+        ['chapter-2', 'Don', 'Dulcinea & co', '1'],
+    ]
+
+def test_graphml_ids_are_unique_across_layers():
+    root = ET.fromstring(write(export.write_graphml))
+    graphs = root.findall(GRAPHML + 'graph')
+    assert [g.get('id') for g in graphs] == ['chapter-1', 'chapter-2']
+
+    ids = [element.get('id') for element in root.iter() if element.tag in (GRAPHML + 'node', GRAPHML + 'edge')]
+    assert len(ids) == len(set(ids))
+
+    for graph, (_, layer) in zip(graphs, LAYERS):
+        nodes = {n.get('id'): n.find(GRAPHML + 'data').text for n in graph.findall(GRAPHML + 'node')}
+        assert set(nodes.values()) == layer.nodes
+
+        edges = [(nodes[e.get('source')], nodes[e.get('target')]) for e in graph.findall(GRAPHML + 'edge')]
+        assert edges == [(one, two) for one, two, _ in layer.edges]
+
+def test_graphml_can_be_read_by_networkx():
+    networkx = pytest.importorskip('networkx')
+    graph = networkx.parse_graphml(write(export.write_graphml))
+    assert {data['label'] for _, data in graph.nodes(data=True)} == {'Don', 'Sancho'}
+
+def test_gexf_spells_cover_the_layers_things_are_in():
+    root = ET.fromstring(write(export.write_gexf))
+    ns = '{http://www.gexf.net/1.2draft}'
+
+    nodes = {n.get('id'): [(s.get('start'), s.get('end')) for s in n.iter(ns + 'spell')] for n in root.iter(ns + 'node')}
+    assert nodes == {'Don' : [('0', '1')], 'Sancho' : [('0', '1')], 'Dulcinea & co' : [('1', '1')]}
+
+    weights = {
+        (e.get('source'), e.get('target')): [(a.get('value'), a.get('start'), a.get('end')) for a in e.iter(ns + 'attvalue')]
+        for e in root.iter(ns + 'edge')
+    }
+    assert weights[('Don', 'Sancho')] == [('2', '0', '0'), ('3', '1', '1')]
+
+def test_webweb_has_a_layer_per_section():
+    data = json.loads(write(export.write_webweb, node_attributes={'Don' : {'faction' : 'knights'}}))
+    layers = data['networks']['network']['layers']
+    assert [layer['edgeList'] for layer in layers] == [layer.edges for _, layer in LAYERS]
+    assert layers[0]['nodes']['Don'] == {'faction' : 'knights'}
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from ennotator import matchstore
+from ennotator import storage
+from ennotator.matcher import Match
+
+RAW_MATCHES = {
+    'one' : [
+        Match(start=0, end=6, text='Sancho', key='SanchoPanza'),
+        Match(start=10, end=16, text='Quixote', key=None),
+    ],
+    'two' : [],
+    'three; with punctuation' : [Match(start=3, end=9, text='Dulcinea', key='Dulcinea')],
+}
+
+def as_dicts(raw_matches):
+    return {name: [dict(m) for m in matches] for name, matches in raw_matches.items()}
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_binary_round_trip(tmp_path, compression):
+    path = tmp_path / 'raw_entities'
+    with open(path, 'wb') as f:
+        matchstore.dump(RAW_MATCHES, f, compression=compression)
+
+    assert matchstore.is_binary_file(path)
+    assert as_dicts(matchstore.load(path)) == as_dicts(RAW_MATCHES)
+
+def test_file_is_little_endian(tmp_path):
+    path = tmp_path / 'raw_entities'
+    with open(path, 'wb') as f:
+        matchstore.dump({'one' : [Match(start=1, end=2, text='a', key=None)]}, f)
+
+    # the string count comes straight after the header
+    with open(path, 'rb') as f:
+        f.seek(matchstore.HEADER.size)
+        assert f.read(4) == b'\x02\x00\x00\x00'
+
+def test_json_round_trip(tmp_path):
+    path = tmp_path / 'raw_entities'
+    with open(path, 'w') as f:
+        json.dump(as_dicts(RAW_MATCHES), f)
+
+    assert as_dicts(matchstore.load(path)) == as_dicts(RAW_MATCHES)
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_datastore_converts_and_keeps_format(datastores, compression):
+    text_storage = storage.TextDatastore('DonQuixote')
+    before = as_dicts(dict(text_storage.raw_matches.items()))
+    assert not matchstore.is_binary_file(text_storage.raw_matches_path)
+
+    text_storage.convert_raw_matches('binary', compression)
+    assert matchstore.is_binary_file(text_storage.raw_matches_path)
+
+    reopened = storage.TextDatastore('DonQuixote')
+    assert reopened.raw_matches_format == ('binary', compression)
+    assert as_dicts(dict(reopened.raw_matches.items())) == before
+
+    reopened.convert_raw_matches('json')
+    assert not matchstore.is_binary_file(reopened.raw_matches_path)
+    assert as_dicts(matchstore.load(reopened.raw_matches_path)) == before
+
+def test_in_place_conversion_records_the_format(datastores):
+    text_storage = storage.TextDatastore('DonQuixote')
+    matchstore.main(['convert', text_storage.raw_matches_path, '--compression', 'gzip'])
+
+    reopened = storage.TextDatastore('DonQuixote')
+    assert reopened.raw_matches_format == ('binary', 'gzip')
+
+    # saving again keeps the binary format
+    reopened.save_raw_matches()
+    assert matchstore.is_binary_file(reopened.raw_matches_path)
+
+@pytest.mark.parametrize('format', ['json', 'binary'])
+def test_saving_keeps_sections_without_rereading(datastores, format):
+    text_storage = storage.TextDatastore('DonQuixote', max_raw_match_sections=2)
+    text_storage.convert_raw_matches(format)
+    section_names = list(text_storage.raw_matches)
+
+    new_matches = [Match(start=1, end=7, text='Sancho', key='SanchoPanza')]
+    text_storage.raw_matches[section_names[0]] = new_matches
+    text_storage.save_raw_matches()
+
+    # every other section is still readable, and the new one is what was set
+    reopened = storage.TextDatastore('DonQuixote')
+    for section_name in section_names[1:]:
+        assert as_dicts({0 : text_storage.raw_matches[section_name]}) == as_dicts({0 : reopened.raw_matches[section_name]})
+
+    assert as_dicts({0 : text_storage.raw_matches[section_names[0]]}) == as_dicts({0 : new_matches})
+    assert as_dicts({0 : reopened.raw_matches[section_names[0]]}) == as_dicts({0 : new_matches})
@@ -0,0 +1,66 @@
+from ennotator import model
+
+def make_registry(monkeypatch, **kwargs):
+    monkeypatch.setattr(model.spacy, 'load', lambda name, **kwargs: object())
+    return model.ModelRegistry(**kwargs)
+
+def test_least_recently_used_pipelines_are_evicted(monkeypatch):
+    registry = make_registry(monkeypatch, max_models=2)
+    registry.load('one')
+    registry.load('two')
+    registry.load('one')
+    registry.load('three')
+
+    assert registry.get_key('one') in registry
+    assert registry.get_key('two') not in registry
+    assert len(registry) == 2
+
+def test_one_pipeline_is_evicted_per_load_when_over_budget(monkeypatch):
+    registry = make_registry(monkeypatch, max_models=4, max_bytes=1)
+    monkeypatch.setattr(model, 'get_memory_usage', lambda: 2)
+
+    registry.load('one')
+    registry.load('two')
+    assert len(registry) == 1
+
+    registry.max_bytes = None
+    registry.load('three')
+    registry.load('four')
+
+    # memory measured right after an eviction doesn't drop the rest
+    registry.max_bytes = 1
+    registry.load('five')
+    assert len(registry) == 3
+    assert registry.get_key('two') not in registry
+    assert registry.get_key('five') in registry
+
+def test_over_budget_pipelines_are_evicted_before_another_is_loaded(monkeypatch):
+    registry = make_registry(monkeypatch, max_models=2, max_bytes=1)
+    monkeypatch.setattr(model, 'get_memory_usage', lambda: 2)
+    registry.load('one')
+
+    loaded_alongside = []
+    def load(name, **kwargs):
+        loaded_alongside.append(len(registry))
+        return object()
+
+    monkeypatch.setattr(model.spacy, 'load', load)
+    registry.load('two')
+
+    assert loaded_alongside == [0]
+    assert registry.get_key('two') in registry
+
+def test_a_single_pipeline_is_let_go_of_before_the_next_is_loaded(monkeypatch):
+    registry = make_registry(monkeypatch, max_models=1)
+    registry.load('one')
+
+    loaded_alongside = []
+    def load(name, **kwargs):
+        loaded_alongside.append(len(registry))
+        return object()
+
+    monkeypatch.setattr(model.spacy, 'load', load)
+    registry.load('two')
+
+    assert loaded_alongside == [0]
+    assert len(registry) == 1
@@ -0,0 +1,170 @@
+import os
+import random
+
+import pytest
+
+from ennotator import entities
+from ennotator import matcher
+from ennotator import metrics
+from ennotator import network
+from ennotator import reader
+from ennotator import storage
+
+def load_network(text_name='DonQuixote', **kwargs):
+    text_storage = storage.TextDatastore(text_name)
+    entity_interface = entities.TextEntities(text_storage)
+    file_names = [
+        f for f in reader.TextReader.get_ordered_content_files(text_storage.metadata)
+        if f in text_storage.raw_matches
+    ]
+
+    return network.TextNetwork(text_storage, file_names, entity_interface, **kwargs)
+
+def test_built_networks_keep_the_cache_key_of_their_annotations(datastores):
+    text_network = load_network()
+    cache_key = text_network.cache_key
+
+    # labeling after the layers were built doesn't change what they are
+    text_network.entity_interface.add_entity('Maritornes')
+    assert text_network.cache_key == cache_key
+
+    text_network.rebuild()
+    assert text_network.cache_key != cache_key
+
+def test_unbuilt_networks_follow_the_annotations(datastores):
+    text_network = load_network(build=False)
+    cache_key = text_network.cache_key
+
+    text_network.entity_interface.add_entity('Maritornes')
+    assert text_network.cache_key != cache_key
+
+def test_sweep_pairs_every_match_within_the_threshold():
+    matches = [
+        matcher.Match(0, 1, 'z'),
+        matcher.Match(2, 3, 'a'),
+        matcher.Match(40, 41, 'm'),
+    ]
+    section_network = network.SectionNetwork(matches, edge_threshold=50)
+
+    counts = section_network.section_weights['count']
+    assert dict(counts) == {('a', 'z'): 1, ('a', 'm'): 1, ('m', 'z'): 1}
+
+    # z-m is 39 characters apart, measured from z (not from a)
+    linear = section_network.section_weights['linear']
+    assert linear[('m', 'z')] == pytest.approx(1 - 39 / 51)
+    assert linear[('a', 'm')] == pytest.approx(1 - 37 / 51)
+
+def test_betweenness_of_a_path():
+    adjacency = {'a' : {'b'}, 'b' : {'a', 'c'}, 'c' : {'b'}}
+    assert metrics.get_betweenness(adjacency, adjacency) == {'a' : 0.0, 'b' : 1.0, 'c' : 0.0}
+
+def test_betweenness_matches_networkx():
+    networkx = pytest.importorskip('networkx')
+
+    graph = networkx.gnp_random_graph(30, .15, seed=1)
+    graph.add_nodes_from(range(30))
+    adjacency = {node: set(graph.neighbors(node)) for node in graph.nodes}
+
+    expected = networkx.betweenness_centrality(graph)
+    betweenness = metrics.get_betweenness(adjacency, graph.nodes)
+    for node in graph.nodes:
+        assert betweenness[node] == pytest.approx(expected[node])
+
+def test_incremental_metrics_match_each_layer_computed_alone(datastores):
+    text_network = load_network()
+    layers = text_network.metrics(use_cache=False)
+
+    for layer, (_, section_network) in zip(layers, text_network.iter_layers()):
+        degree = {node: 0 for node in section_network.nodes}
+        for one, two, _ in section_network.edges:
+            degree[one] += 1
+            degree[two] += 1
+
+        assert layer['degree'] == degree
+        assert layer['edges'] == len(section_network.edges)
+
+def layer_summaries(text_network):
+    return [
+        (file_name, sorted(layer.nodes), sorted(map(tuple, layer.edges)))
+        for file_name, layer in text_network.iter_layers()
+    ]
+
+def test_spilled_layers_are_read_back_as_they_were_made(datastores):
+    built = layer_summaries(load_network())
+
+    spilled_network = load_network(build=False, spill=True, keep_matches=False)
+    assert not os.path.isfile(spilled_network.spill_path)
+
+    # a layer that's only partly made isn't spilled
+    next(spilled_network.iter_layers())
+    assert not os.path.isfile(spilled_network.spill_path)
+
+    assert layer_summaries(spilled_network) == built
+    assert os.path.isfile(spilled_network.spill_path)
+    assert layer_summaries(spilled_network) == built
+    assert all(isinstance(layer, network.SpilledLayer) for _, layer in spilled_network.iter_layers())
+
+def test_rematched_sections_arent_served_cached_metrics(datastores):
+    before = load_network(build=False).metrics()
+    assert before[0]['edges']
+
+    # the section's matches are remade (eg, with another model) without its
+    # content or the annotations changing
+    text_storage = storage.TextDatastore('DonQuixote')
+    section = load_network().file_names[0]
+    text_storage.raw_matches[section] = []
+    text_storage.save_raw_matches()
+
+    after = load_network(build=False).metrics()
+    assert after[0]['edges'] == 0
+    assert after == load_network(build=False).metrics(use_cache=False)
+
+def test_the_overlap_policy_and_matcher_are_part_of_the_cache_key(datastores):
+    text_network = load_network(build=False)
+    cache_key = text_network.cache_key
+
+    text_network.storage.metadata['overlap_policy'] = 'user'
+    assert text_network.cache_key != cache_key
+    cache_key = text_network.cache_key
+
+    text_network.storage.metadata['matched_with'] = {'name' : 'blank:en', 'version' : None, 'matcher' : 2}
+    assert text_network.cache_key != cache_key
+
+def test_subnetworks_keep_the_edges_between_entities_that_pass_the_filters(datastores):
+    text_network = load_network()
+    edges = text_network.get_layer(-1)[1].edges
+    assert len(text_network.subnetwork()) == len(edges)
+
+    text_network.attributes.add('DonQuixote', 'faction', 'knights')
+    text_network.attributes.add('SanchoPanza', 'faction', 'squires')
+    expected = [list(edge) for edge in edges if set(edge[:2]) == {'DonQuixote', 'SanchoPanza'}]
+
+    assert text_network.subnetwork(faction=['knights', 'squires']) == expected
+    assert text_network.subnetwork(faction='knights') == []
+
+def test_attribute_networks_sum_the_edges_between_values(datastores):
+    text_network = load_network()
+    for i, key in enumerate(text_network.node_keys):
+        text_network.attributes.add(key, 'half', 'even' if i % 2 == 0 else 'odd')
+
+    half = {key: 'even' if i % 2 == 0 else 'odd' for i, key in enumerate(text_network.node_keys)}
+    expected = {}
+    for one, two, weight in text_network.get_layer(-1)[1].edges:
+        values = tuple(sorted((half[one], half[two])))
+        expected[values] = expected.get(values, 0) + weight
+
+    summed = {(one, two): weight for one, two, weight in text_network.attribute_network('half')}
+    assert summed == pytest.approx(expected)
+
+def test_unbuilt_subnetworks_follow_the_entities(datastores):
+    text_network = load_network(build=False)
+    text_network.attributes.add('DonQuixote', 'faction', 'knights')
+    text_network.attributes.add('SanchoPanza', 'faction', 'squires')
+    before = text_network.subnetwork(faction=['knights', 'squires'])
+
+    # a new node comes before SanchoPanza in the index
+    text_network.entity_interface.add_entity('Maritornes')
+    assert 'Maritornes' in text_network.node_keys
+
+    after = text_network.subnetwork(faction=['knights', 'squires'])
+    assert [edge[:2] for edge in after] == [edge[:2] for edge in before] == [['DonQuixote', 'SanchoPanza']]
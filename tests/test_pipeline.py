@@ -0,0 +1,140 @@
+import random
+import threading
+import time
+
+import pytest
+
+from ennotator import pipeline
+
+class FakeMatcher():
+    """matches every text as a single match, without a model. counts how many
+    sections it has taken from the readers."""
+    def __init__(self):
+        self.taken = 0
+
+    def pipe_matches(self, texts, batch_size=8):
+        for text, name in texts:
+            self.taken += 1
+            yield [text], {'sentences' : [], 'paragraphs' : [0]}, name
+
+class Sections():
+    """reads and writes sections, recording what happened"""
+    def __init__(self, fail_reading=None, fail_writing=False, delay=0):
+        self.fail_reading = fail_reading
+        self.fail_writing = fail_writing
+        self.delay = delay
+        self.started = 0
+        self.written = []
+        self.lock = threading.Lock()
+
+    def read(self, name):
+        with self.lock:
+            self.started += 1
+
+        time.sleep(random.uniform(0, self.delay))
+        if name == self.fail_reading:
+            raise IOError("can't read {}".format(name))
+
+        return name.upper()
+
+    def write(self, results):
+        if self.fail_writing:
+            raise IOError("can't write")
+
+        time.sleep(self.delay)
+        self.written.extend(results)
+
+def run_within(seconds, function, *args):
+    """runs `function`, failing the test if it doesn't return in time"""
+    outcome = {}
+    def target():
+        try:
+            outcome['value'] = function(*args)
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), "deadlocked"
+
+    if 'error' in outcome:
+        raise outcome['error']
+
+    return outcome.get('value')
+
+def make_pipeline(sections, entity_matcher=None, **kwargs):
+    return pipeline.MatchPipeline(
+        entity_matcher or FakeMatcher(),
+        read=sections.read,
+        write=sections.write,
+        **kwargs
+    )
+
+def test_sections_are_written_in_order_with_several_readers():
+    names = ['section-{}'.format(i) for i in range(40)]
+    sections = Sections(delay=.005)
+    run_within(10, make_pipeline(sections, readers=4, queue_size=4).run, names)
+
+    assert [name for name, _, _ in sections.written] == names
+    assert all(matches == [name.upper()] for name, matches, _ in sections.written)
+
+def test_readers_only_get_so_far_ahead():
+    names = ['section-{}'.format(i) for i in range(30)]
+    sections = Sections()
+    entity_matcher = FakeMatcher()
+
+    ahead = []
+    original_read = sections.read
+    def read(name):
+        ahead.append(sections.started - entity_matcher.taken)
+        return original_read(name)
+
+    sections.read = read
+    run_within(10, make_pipeline(sections, entity_matcher, readers=3, queue_size=4).run, names)
+
+    assert len(sections.written) == len(names)
+    assert max(ahead) <= 4
+
+def test_a_full_writer_holds_up_whatever_puts_to_it():
+    release = threading.Event()
+    writer = pipeline.Writer(lambda items: release.wait(), queue_size=2)
+    writer.start()
+
+    put = []
+    def put_all():
+        for i in range(10):
+            writer.put(i)
+            put.append(i)
+
+    thread = threading.Thread(target=put_all, daemon=True)
+    thread.start()
+    time.sleep(.2)
+
+    # one item is being written, two are queued, and the next one waits
+    assert thread.is_alive()
+    assert len(put) <= 4
+    assert writer.queue.qsize() == 2
+
+    release.set()
+    thread.join(5)
+    run_within(5, writer.finish)
+
+def test_a_reading_error_reaches_the_caller():
+    names = ['section-{}'.format(i) for i in range(20)]
+    sections = Sections(fail_reading='section-12', delay=.002)
+
+    with pytest.raises(IOError, match='section-12'):
+        run_within(10, make_pipeline(sections, readers=3, queue_size=4).run, names)
+
+    # what was matched before the error is saved
+    assert [name for name, _, _ in sections.written] == names[:12]
+
+def test_a_writing_error_reaches_the_caller():
+    names = ['section-{}'.format(i) for i in range(50)]
+    sections = Sections(fail_writing=True)
+
+    with pytest.raises(IOError, match="can't write"):
+        run_within(10, make_pipeline(sections, queue_size=2).run, names)
+
+    assert sections.written == []
@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+from ennotator import Ennotator
+from ennotator import entities
+from ennotator import preview
+from ennotator import reader
+from ennotator import storage
+
+def test_rounds_double_the_sample():
+    assert list(preview.Preview(None, None, None, fraction=.2).rounds) == [.2, .4, .8, 1]
+    assert list(preview.Preview(None, None, None, fraction=1).rounds) == [1]
+
+@pytest.mark.parametrize('fraction', [0, -.5, 1.5])
+def test_fractions_outside_the_text_are_refused(fraction):
+    with pytest.raises(ValueError):
+        preview.Preview(None, None, None, fraction=fraction)
+
+class StubReader():
+    """stands in for `TextReader`: the sections are those with raw matches
+    already, so "matching" one just records it. matching can be held up
+    after the first sample, or made to fail."""
+    def __init__(self, text_storage, fail=False):
+        self.ordered_content_files = [
+            f for f in reader.TextReader.get_ordered_content_files(text_storage.metadata)
+            if f in text_storage.raw_matches
+        ]
+        self.fail = fail
+        self.matched = []
+        self.release = threading.Event()
+
+    get_sample = staticmethod(reader.TextReader.get_sample)
+
+    def load_matches(self, entities_with_aliases=None, sections=None, **kwargs):
+        if self.matched:
+            self.release.wait(5)
+            if self.fail:
+                raise IOError("can't read the text")
+
+        self.matched.append(sections)
+
+def start_preview(fraction=.25, fail=False, **kwargs):
+    text_storage = storage.TextDatastore('DonQuixote')
+    stub_reader = StubReader(text_storage, fail=fail)
+    entity_interface = entities.TextEntities(text_storage)
+    return preview.Preview(text_storage, stub_reader, entity_interface, fraction=fraction, **kwargs).start()
+
+def test_samples_are_spread_over_the_text_in_order():
+    names = ['section-{}'.format(i) for i in range(10)]
+    assert reader.TextReader.get_sample(names, .2) == ['section-2', 'section-7']
+    assert reader.TextReader.get_sample(names, .01) == ['section-5']
+    assert reader.TextReader.get_sample(names, .01, min_sections=3) == ['section-1', 'section-5', 'section-8']
+    assert reader.TextReader.get_sample(names, 1) == names
+
+def test_the_preview_starts_from_the_sample_and_refines_to_the_whole_text(datastores):
+    text_preview = start_preview()
+    all_sections = text_preview.reader.ordered_content_files
+    sample = reader.TextReader.get_sample(all_sections, .25)
+
+    assert text_preview.sections == sample
+    assert text_preview.network.file_names == sample
+    assert not text_preview.wait(timeout=.05)
+
+    text_preview.reader.release.set()
+    assert text_preview.wait(timeout=5)
+
+    # the whole text's network is swapped in, and no section is matched twice
+    assert text_preview.sections == all_sections
+    assert text_preview.network.file_names == all_sections
+    matched = [f for sections in text_preview.reader.matched for f in sections]
+    assert sorted(matched) == sorted(all_sections)
+
+def test_refinement_errors_are_raised_by_wait(datastores):
+    text_preview = start_preview(fail=True)
+    text_preview.reader.release.set()
+
+    with pytest.raises(IOError):
+        text_preview.wait(timeout=5)
+
+    # the sample's network is still there
+    assert text_preview.network.file_names == text_preview.sections
+
+def test_the_preview_network_is_made_with_the_network_kwargs(datastores):
+    text_preview = start_preview(network_kwargs={'build' : False, 'spill' : True, 'keep_matches' : False})
+    assert text_preview.network.section_networks is None
+    assert text_preview.network.spill
+
+    text_preview.reader.release.set()
+    text_preview.wait(timeout=5)
+    assert text_preview.network.section_networks is None
+
+def test_finishing_a_preview_uses_the_whole_texts_network(datastores):
+    text_preview = start_preview()
+    ennotator = Ennotator.__new__(Ennotator)
+    ennotator.preview = text_preview
+    ennotator.network = text_preview.network
+
+    text_preview.reader.release.set()
+    ennotator.finish_preview()
+
+    assert ennotator.preview is None
+    assert ennotator.network is text_preview.network
+    assert ennotator.network.file_names == text_preview.reader.ordered_content_files
@@ -0,0 +1,63 @@
+import json
+import os
+import tracemalloc
+
+from ennotator import profiling
+from ennotator import storage
+
+def test_stages_are_timed_and_counted():
+    profiler = profiling.Profiler()
+    with profiler.stage('off'):
+        pass
+
+    profiler.enable()
+    with profiler.stage('on'):
+        profiler.count('things', 3)
+    profiler.disable()
+
+    report = profiler.report()
+    assert set(report['stages']) == {'on'}
+    assert report['stages']['on']['calls'] == 1
+    assert report['counters'] == {'things': 3}
+
+def test_tracemalloc_is_left_as_it_was():
+    profiler = profiling.Profiler()
+
+    profiler.enable(trace_memory=True)
+    assert tracemalloc.is_tracing()
+    profiler.disable()
+    assert not tracemalloc.is_tracing()
+
+    tracemalloc.start()
+    try:
+        profiler.enable(trace_memory=True)
+        profiler.disable()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+def test_each_profile_starts_fresh():
+    profiler = profiling.Profiler()
+
+    profiler.enable(cprofile=True)
+    first = profiler.cprofile
+    profiler.disable()
+
+    profiler.enable(cprofile=True)
+    assert profiler.cprofile is not first
+    profiler.disable()
+
+    profiler.enable()
+    assert profiler.cprofile is None
+    profiler.disable()
+
+def test_reports_dont_overwrite_each_other(datastores):
+    text_storage = storage.TextDatastore('DonQuixote')
+    profiler = profiling.Profiler()
+
+    paths = [profiler.write_report(text_storage, name='run') for _ in range(3)]
+    paths += [profiler.write_report(text_storage) for _ in range(2)]
+
+    assert len(set(paths)) == 5
+    assert [os.path.basename(p) for p in paths[:3]] == ['run.json', 'run-2.json', 'run-3.json']
+    assert all(json.load(open(p))['stages'] == {} for p in paths)
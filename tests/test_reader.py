@@ -0,0 +1,91 @@
+from ennotator import matcher
+from ennotator import reader
+from ennotator import storage
+
+def load_reader(monkeypatch, text):
+    text_storage = storage.TextDatastore('DonQuixote')
+    text_reader = reader.TextReader(text_storage)
+    monkeypatch.setattr(text_reader, 'get_file_content', lambda file_name: text)
+
+    # as if every section was matched with this model and matcher
+    entity_matcher = matcher.EntityMatchObject({}, text_storage.model_name)
+    text_storage.metadata['matched_with'] = entity_matcher.signature
+
+    return text_reader
+
+def keys(text_storage, file_name):
+    return {m['key'] for m in text_storage.raw_matches[file_name] if m['key']}
+
+def test_sections_are_rematched_until_they_have_the_current_aliases(datastores, monkeypatch):
+    text_reader = load_reader(monkeypatch, "Sancho said to Dapple")
+    text_storage = text_reader.storage
+    sections = [f for f in text_reader.ordered_content_files if f in text_storage.raw_matches]
+    first, rest = sections[:1], sections[1:]
+
+    # matches from before aliases were recorded are taken to be current
+    text_reader.load_matches(entities_with_aliases={'sancho': ['Sancho']})
+    assert 'dapple' not in keys(text_storage, first[0])
+
+    # only some sections get to be rematched (eg, a preview's sample) ...
+    aliases = {'sancho': ['Sancho'], 'dapple': ['Dapple']}
+    text_reader.load_matches(entities_with_aliases=aliases, sections=first)
+    assert keys(text_storage, first[0]) == {'sancho', 'dapple'}
+    assert all('dapple' not in keys(text_storage, f) for f in rest)
+
+    # ... and the rest are the next time, from a fresh session
+    text_storage = storage.TextDatastore('DonQuixote')
+    text_reader = reader.TextReader(text_storage)
+    monkeypatch.setattr(text_reader, 'get_file_content', lambda file_name: "Sancho said to Dapple")
+    text_reader.load_matches(entities_with_aliases=aliases)
+    assert all(keys(text_storage, f) == {'sancho', 'dapple'} for f in sections)
+
+def write_text(directory, sections):
+    directory.mkdir(exist_ok=True)
+    for name, content in sections.items():
+        (directory / name).write_text(content)
+
+def open_small_text(directory):
+    text_storage = storage.TextDatastore('Small')
+    return reader.TextReader(text_storage, directory)
+
+def test_only_edited_sections_are_stale(datastores):
+    directory = datastores.parent / 'small'
+    write_text(directory, {'a.txt': "Sancho met Quixote.", 'b.txt': "Quixote rode on."})
+
+    text_reader = open_small_text(directory)
+    match_hashes = text_reader.storage.metadata.setdefault('file_match_hashes', {})
+    for file_name in text_reader.files:
+        text_reader.storage.raw_matches[file_name] = []
+        match_hashes[file_name] = text_reader.section_hashes[file_name]
+
+    text_reader.storage.save_raw_matches()
+    text_reader.storage.save_metadata()
+    assert text_reader.stale_sections == []
+
+    write_text(directory, {'b.txt': "Quixote rode on, and on."})
+    text_reader = open_small_text(directory)
+    assert text_reader.stale_sections == ['b.txt']
+
+    # asking doesn't change anything
+    assert text_reader.storage.metadata['file_match_hashes'] == match_hashes
+    assert text_reader.stale_sections == ['b.txt']
+
+def test_unchanged_sources_arent_rehashed(datastores, monkeypatch):
+    directory = datastores.parent / 'small'
+    write_text(directory, {'a.txt': "Sancho met Quixote.", 'b.txt': "Quixote rode on."})
+    section_hashes = open_small_text(directory).section_hashes
+
+    read = []
+    get_raw_file_content = reader.TextReader.get_raw_file_content
+    def counting_get_raw_file_content(self, file_name):
+        read.append(file_name)
+        return get_raw_file_content(self, file_name)
+
+    monkeypatch.setattr(reader.TextReader, 'get_raw_file_content', counting_get_raw_file_content)
+
+    assert open_small_text(directory).section_hashes == section_hashes
+    assert read == []
+
+    write_text(directory, {'a.txt': "Sancho met Quixote again."})
+    assert open_small_text(directory).section_hashes['a.txt'] != section_hashes['a.txt']
+    assert read == ['a.txt']
@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+from ennotator.entities import Alias, Entity, IntervalIndex, Resolver, Scope
+
+def first_covering(intervals, position):
+    for start, end, value in intervals:
+        if start <= position < end:
+            return value
+
+    return None
+
+def test_interval_index_finds_the_earliest_covering_interval():
+    intervals = [(10, 20, 'a'), (0, 100, 'b'), (15, 30, 'c')]
+    index = IntervalIndex(intervals)
+
+    assert index.find(5) == 'b'
+    assert index.find(10) == 'a'
+    assert index.find(19) == 'a'
+    assert index.find(20) == 'b'
+    assert index.find(100) is None
+    assert index.find(-1) is None
+
+def test_interval_index_matches_a_linear_scan():
+    rng = random.Random(0)
+    for _ in range(50):
+        intervals = []
+        for value in range(rng.randint(0, 12)):
+            start = rng.randint(0, 50)
+            intervals.append((start, start + rng.randint(1, 30), value))
+
+        index = IntervalIndex(intervals)
+        for position in range(-1, 85):
+            assert index.find(position) == first_covering(intervals, position)
+
+def test_interval_index_merges_segments():
+    index = IntervalIndex([(0, 10, 'a'), (5, 15, 'a'), (20, float('inf'), 'b')])
+    assert (index.starts, index.ends, index.values) == ([0, 20], [15, float('inf')], ['a', 'b'])
+
+@pytest.mark.parametrize('scope', [
+    Scope(['chapter-1']),
+    Scope(['part 1; chapter 2', 'a:b', 'back\\slash'], [('ch:3', 5, 10), ('x;y', 0, 1)]),
+    Scope([], [('chapter-1', 0, 40)]),
+])
+def test_scope_storage_round_trip(scope):
+    loaded = Scope.load_from_storage(scope.get_storage_representation())
+    assert loaded.sections_list == scope.sections_list
+    assert loaded.ranges == scope.ranges
+
+def test_old_scope_representations_still_load():
+    scope = Scope.load_from_storage('chapter-1;chapter-2:10-20')
+    assert scope.sections_list == ['chapter-1']
+    assert scope.ranges == [('chapter-2', 10, 20)]
+
+def test_scoped_aliases_take_precedence_in_their_scope():
+    don = Entity('DonQuixote')
+    sancho = Entity('SanchoPanza')
+    aliases = [
+        Alias('the squire', sancho),
+        Alias('the squire', don, scope=Scope([], [('chapter-2', 100, 200)])),
+    ]
+
+    resolver = Resolver([don, sancho], aliases)
+    assert resolver.resolve('the squire', 'chapter-1', 150) == 'SanchoPanza'
+    assert resolver.resolve('the squire', 'chapter-2', 150) == 'DonQuixote'
+    assert resolver.resolve('the squire', 'chapter-2', 200) == 'SanchoPanza'
+    assert resolver.resolve('DonQuixote') == 'DonQuixote'
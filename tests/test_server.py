@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from ennotator import entities
+from ennotator import server
+from ennotator import storage
+
+def datastore_files(directory):
+    return {
+        name: (os.stat(os.path.join(directory, name)).st_mtime_ns, os.path.getsize(os.path.join(directory, name)))
+        for name in os.listdir(directory)
+    }
+
+def test_server_does_not_write_to_datastores(datastores):
+    # a labeling session in progress, with a decision not yet saved
+    entity_interface = entities.TextEntities(storage.TextDatastore('DonQuixote'))
+    entity_interface.add_entity('Maritornes')
+    entity_interface.close_journal()
+
+    directory = datastores / 'DonQuixote'
+    before = datastore_files(directory)
+
+    service = server.DatastoreService()
+    keys = {entity['key'] for entity in service.query('/texts/DonQuixote/entities', {})}
+    service.query('/texts/DonQuixote/edges', {})
+
+    assert 'Maritornes' in keys
+    assert datastore_files(directory) == before
+
+def test_read_only_datastores_refuse_to_save(datastores):
+    text_storage = storage.TextDatastore('DonQuixote', read_only=True)
+    with pytest.raises(storage.ReadOnlyError):
+        text_storage.save_metadata()
+
+def test_bad_requests(datastores):
+    service = server.DatastoreService()
+
+    with pytest.raises(server.BadRequest):
+        service.query('/texts/DonQuixote/metrics', {'samples': 'many'})
+
+    with pytest.raises(server.BadRequest):
+        service.query('/texts/DonQuixote/contexts', {'source': 'quixote'})
+
+    with pytest.raises(server.NotFound):
+        service.query('/texts/DonQuixote/edges', {'section': 'no such section'})
+
+    with pytest.raises(server.NotFound):
+        service.query('/texts/NoSuchText/edges', {})
+
+def test_sections_are_the_matched_ones(datastores):
+    service = server.DatastoreService()
+    text = service.get_text('DonQuixote')
+    assert text.ordered_content_files
+    assert all(f in text.storage.raw_matches for f in text.ordered_content_files)
+
+@pytest.fixture
+def http_service(datastores):
+    """a service, served on a free port. yields (service, get), where get
+    returns the status and json of a request."""
+    service = server.DatastoreService()
+    http_server = server.ThreadingHTTPServer(('127.0.0.1', 0), server.make_handler(service))
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+
+    def get(path):
+        url = 'http://127.0.0.1:{}{}'.format(http_server.server_address[1], path)
+        try:
+            with urllib.request.urlopen(url, timeout=10) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    yield service, get
+
+    http_server.shutdown()
+    http_server.server_close()
+
+def test_errors_get_their_status(http_service, monkeypatch):
+    service, get = http_service
+
+    assert get('/texts/DonQuixote/sections')[0] == 200
+    assert get('/texts/DonQuixote/edges?section=nowhere')[0] == 404
+    assert get('/texts/DonQuixote/edges?weighting=heaviest')[0] == 400
+
+    # methods that aren't endpoints aren't reachable
+    assert get('/texts/DonQuixote/network')[0] == 404
+
+    # a bug isn't passed off as a bad request
+    def broken(text, params):
+        raise KeyError('entity')
+
+    monkeypatch.setattr(service, 'get_entities', broken)
+    status, response = get('/texts/DonQuixote/entities')
+    assert status == 500
+    assert 'KeyError' in response['error']
+
+def test_texts_are_answered_at_the_same_time(datastores, monkeypatch):
+    service = server.DatastoreService()
+    started, release = threading.Event(), threading.Event()
+
+    get_sections = service.get_sections
+    def slow_sections(text, params):
+        if text.text_name == 'DonQuixote':
+            started.set()
+            release.wait(5)
+
+        return get_sections(text, params)
+
+    monkeypatch.setattr(service, 'get_sections', slow_sections)
+    thread = threading.Thread(target=service.query, args=('/texts/DonQuixote/sections', {}), daemon=True)
+    thread.start()
+    assert started.wait(5)
+
+    # another text isn't held up by the slow one
+    assert service.query('/texts/Asymmetry/sections', {})
+    assert thread.is_alive()
+
+    release.set()
+    thread.join(5)
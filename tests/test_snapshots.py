@@ -0,0 +1,67 @@
+from ennotator import entities
+from ennotator import snapshots
+from ennotator import storage
+
+def open_text():
+    text_storage = storage.TextDatastore('DonQuixote')
+    return text_storage, entities.TextEntities(text_storage)
+
+def test_save_diff_and_restore(datastores):
+    text_storage, entity_interface = open_text()
+    text_snapshots = snapshots.Snapshots(text_storage)
+    snapshot_id = text_snapshots.save(name='before')
+    entities_before = text_storage.get_file_content('entities')
+    metadata_before = text_snapshots.get_metadata()
+
+    entity_interface.add_entity('Maritornes')
+    entity_interface.add_to_blacklist('Rocinante')
+    entity_interface.update_storage()
+
+    diff = text_snapshots.diff('before')
+    assert diff['entities'] == {'added': ['"Maritornes"'], 'removed': []}
+    assert diff['blacklist']['added'] == ['Rocinante']
+    assert not diff['aliases']['added'] and not diff['aliases']['removed']
+
+    text_snapshots.restore(snapshot_id[:8])
+    assert text_storage.get_file_content('entities') == entities_before
+    assert text_snapshots.get_metadata() == metadata_before
+    assert not any(change['added'] or change['removed'] for change in text_snapshots.diff('before').values())
+
+    # the state that was replaced was snapshotted first
+    restored = text_snapshots.list()[-1]
+    assert '"Maritornes"' in text_snapshots.get_lines(restored['id'], 'entities')
+
+    # and the restored annotations are the ones that are loaded
+    _, reloaded = open_text()
+    assert not entities.TextEntities.find_entity_with_key(reloaded.entities, 'Maritornes')
+    assert not reloaded.matches_are_not_up_to_date
+
+def test_checkpoints_are_only_taken_when_something_changed(datastores):
+    text_storage, entity_interface = open_text()
+    text_snapshots = snapshots.Snapshots(text_storage)
+
+    assert text_snapshots.checkpoint() is not None
+    assert text_snapshots.checkpoint() is None
+
+    entity_interface.add_entity('Maritornes')
+    entity_interface.update_storage()
+    assert text_snapshots.checkpoint() is not None
+    assert len(text_snapshots.list()) == 2
+
+def test_old_unnamed_snapshots_are_pruned(datastores):
+    text_storage, entity_interface = open_text()
+    text_snapshots = snapshots.Snapshots(text_storage, keep=2)
+    text_snapshots.save(name='named')
+
+    for key in ['one', 'two', 'three']:
+        entity_interface.add_entity(key)
+        entity_interface.update_storage()
+        text_snapshots.save()
+
+    manifests = text_snapshots.list()
+    assert [m.get('name') for m in manifests] == ['named', None, None]
+    assert '"three"' in text_snapshots.get_lines(manifests[-1]['id'], 'entities')
+
+    # the named snapshot's objects weren't pruned with the others
+    text_snapshots.restore('named')
+    assert '"one"' not in text_snapshots.get_lines('current', 'entities')
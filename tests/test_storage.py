@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+
+import pytest
+
+from ennotator import entities
+from ennotator import matcher
+from ennotator import storage
+
+def test_atomic_open_leaves_the_old_file_on_an_error(tmp_path):
+    path = tmp_path / 'file'
+    path.write_text('old')
+
+    with pytest.raises(RuntimeError):
+        with storage.atomic_open(str(path)) as f:
+            f.write('new, but not all of it')
+            raise RuntimeError
+
+    assert path.read_text() == 'old'
+    assert os.listdir(tmp_path) == ['file']
+
+    with storage.atomic_open(str(path)) as f:
+        f.write('new')
+
+    assert path.read_text() == 'new'
+    assert os.listdir(tmp_path) == ['file']
+
+def test_the_lock_is_held_across_datastores(datastores):
+    one = storage.TextDatastore('DonQuixote')
+    two = storage.TextDatastore('DonQuixote')
+    events = []
+
+    def take_lock():
+        with two.lock():
+            events.append('two')
+
+    with one.lock():
+        # reentrant
+        with one.lock():
+            thread = threading.Thread(target=take_lock)
+            thread.start()
+            time.sleep(.2)
+            events.append('one')
+
+    thread.join()
+    assert events == ['one', 'two']
+
+def test_concurrent_sessions_keep_each_others_changes(datastores):
+    matching = storage.TextDatastore('DonQuixote')
+    labeling = storage.TextDatastore('DonQuixote')
+    entity_interface = entities.TextEntities(labeling)
+
+    matching.metadata['file_match_hashes']['chapter-x'] = 'hash'
+    matching.raw_matches['chapter-x'] = [matcher.Match(0, 6, 'Sancho')]
+    matching.boundaries['chapter-x'] = {'sentences': [0], 'paragraphs': [0]}
+    matching.save_raw_matches()
+    matching.save_boundaries()
+    matching.save_metadata()
+
+    entity_interface.add_entity('Maritornes')
+    labeling.raw_matches['chapter-y'] = [matcher.Match(0, 7, 'Dapple')]
+    labeling.boundaries['chapter-y'] = {'sentences': [0], 'paragraphs': [0]}
+    labeling.save_raw_matches()
+    labeling.save_boundaries()
+    entity_interface.update_storage()
+
+    reopened = storage.TextDatastore('DonQuixote')
+    assert reopened.metadata['file_match_hashes']['chapter-x'] == 'hash'
+    assert reopened.metadata['entities_hash'] == labeling.metadata['entities_hash']
+    assert {'chapter-x', 'chapter-y'} <= set(reopened.raw_matches)
+    assert [m.text for m in reopened.raw_matches['chapter-x']] == ['Sancho']
+    assert {'chapter-x', 'chapter-y'} <= set(reopened.boundaries)
+
+def test_merged_metadata_keeps_our_changes():
+    base = {'a': 1, 'nested': {'x': 1, 'y': 1}, 'gone': 1}
+    theirs = {'a': 2, 'nested': {'x': 2, 'y': 1}, 'gone': 1, 'new': 1}
+    ours = {'a': 3, 'nested': {'x': 1, 'y': 3}}
+
+    storage.merge_changes(ours, base, theirs)
+    assert ours == {'a': 3, 'nested': {'x': 2, 'y': 3}, 'new': 1}
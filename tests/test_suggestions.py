@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from ennotator import suggestions
+
+# words and their vectors; a string's vector is the mean of its words'
+VECTORS = {
+    'sancho': [1, 0, 0],
+    'panza': [1, .2, 0],
+    'squire': [.9, .1, 0],
+    'quixote': [0, 1, 0],
+    'knight': [0, .9, .1],
+    'dulcinea': [0, 0, 1],
+}
+
+class FakeDoc():
+    def __init__(self, string):
+        words = [VECTORS[w] for w in string.lower().split() if w in VECTORS]
+        self.vector = np.mean(words, axis=0) if words else np.zeros(3)
+
+class FakeNLP():
+    def make_doc(self, string):
+        return FakeDoc(string)
+
+def make_suggester(keys, **kwargs):
+    return suggestions.AliasSuggester(keys, nlp=FakeNLP(), **kwargs)
+
+def test_similar_keys_are_suggested_first():
+    suggester = make_suggester(['Sancho Panza', 'Quixote', 'Dulcinea'])
+
+    assert [key for key, _ in suggester.suggest('squire')] == ['Sancho Panza', 'Quixote', 'Dulcinea']
+    assert suggester.suggest('knight', k=1)[0][0] == 'Quixote'
+
+def test_shared_words_count_too():
+    # no vectors at all, so only the words count
+    suggester = make_suggester(['Sancho Panza', 'Quixote'], vector_weight=0)
+
+    (key, score), (_, other_score) = suggester.suggest('Sancho')
+    assert key == 'Sancho Panza'
+    assert score == pytest.approx(.5)
+    assert other_score == 0
+
+def test_the_matrix_grows_as_keys_are_added():
+    suggester = make_suggester(['Quixote'])
+    assert suggester._vectors.shape[0] == 16
+
+    keys = ['key {}'.format(i) for i in range(20)] + ['Dulcinea', 'Quixote']
+    for key in keys:
+        suggester.add([key])
+
+    assert len(suggester.keys) == 22
+    assert suggester.vectors.shape == (22, 3)
+    assert suggester._vectors.shape[0] == 32
+
+    # the rows are still each key's
+    np.testing.assert_allclose(suggester.vectors[0], suggester.vectorize(['Quixote'])[0])
+    assert suggester.suggest('dulcinea', k=1)[0][0] == 'Dulcinea'
+
+def test_suggesting_many_at_once():
+    suggester = make_suggester(['Sancho Panza', 'Quixote'])
+    assert [s[0][0] for s in suggester.suggest_many(['squire', 'knight'], k=1)] == ['Sancho Panza', 'Quixote']
+    assert make_suggester([]).suggest_many(['squire']) == [[]]